@@ -1,30 +1,50 @@
 import logging
+import signal
 import sys
 import argparse
 
+
+def CreateUploader(type, task_info_file, mode, sn):
+    """ 根据数据源类型创建上传器，不支持的类型返回None """
+    if type == "ab":
+        from modules.apps.DJi.DJiUploader import DJiUploader
+        return DJiUploader(task_info_file, mode, sn)
+    elif type == "zg":
+        from modules.apps.CAIC.GAICUploader import GAICUploader
+        return GAICUploader(task_info_file, mode, sn)
+    elif type == "ag":
+        from modules.apps.gacrnd.gacrndUploader import garcndUploader
+        return garcndUploader(task_info_file, mode, sn)
+    return None
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--task_info_file', type=str, help='task info json')
     parser.add_argument('-t', '--type', type=str, help='data source type')
     parser.add_argument('-m', '--mode', type=str, help='run mode', default="prod")
     parser.add_argument('-s', '--sn', type=str, help='sn num', default="fake_sn_num")
+    parser.add_argument('-d', '--daemon', action='store_true', help='run as long-lived daemon consuming upload jobs')
+    parser.add_argument('--spool', type=str, help='daemon job spool root', default="/tmp/cloud_upload_spool")
+    parser.add_argument('--socket', type=str, help='daemon unix socket path', default=None)
+    parser.add_argument('--max_jobs', type=int, help='daemon concurrent jobs', default=2)
     args = parser.parse_args()
 
+    if args.daemon:
+        from modules.CloudUploader.UploadDaemon import UploadDaemon
+        daemon = UploadDaemon(args.spool, CreateUploader, socket_path=args.socket, max_jobs=args.max_jobs,
+                              run_mode=args.mode, sn=args.sn)
+        # docker stop / Ctrl+C 后不再领取新任务，等待运行中的任务结束
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.Stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: daemon.Stop())
+        sys.exit(1 if daemon.Run() > 0 else 0)
+
     # TODO : 自动重试
     rt = 0
-    if args.type == "ab":
-        from modules.apps.DJi.DJiUploader import *
-        uploader = DJiUploader(args.task_info_file, args.mode, args.sn)
-        rt = uploader.Run()
-    elif args.type == "zg":
-        from modules.apps.CAIC.GAICUploader import *
-        uploader = GAICUploader(args.task_info_file, args.mode, args.sn)
+    uploader = CreateUploader(args.type, args.task_info_file, args.mode, args.sn)
+    if uploader is not None:
         rt = uploader.Run()
-    elif args.type == "ag":
-        from modules.apps.gacrnd.gacrndUploader import garcndUploader
-        runner = garcndUploader(args.task_info_file, args.mode, args.sn)
-        rt = runner.Run()
     else:
         logging.fatal(f"不支持当前操作类型:{args.type}")
         rt = 255
-    sys.exit(int(rt))
\ No newline at end of file
+    sys.exit(int(rt))
@@ -1,5 +1,10 @@
+import logging
+import os
 from abc import ABC, abstractmethod
 
+from util_modules.TransferEngine import GetTransferEngine
+from util_modules.disk_util import SortByLayout
+
 class BaseService(ABC):
     @abstractmethod
     def DownloadFile(self, prefix, local_path):
@@ -9,8 +14,11 @@ class BaseService(ABC):
     def UploadFile(self, prefix, local_path):
         pass
 
+    """
+    inventory : InventoryCache，不为None时跳过云端已存在且大小一致的文件
+    """
     @abstractmethod
-    def UploadFolder(self, prefix, local_path):
+    def UploadFolder(self, prefix, local_path, inventory=None):
         pass
 
     @abstractmethod
@@ -23,4 +31,63 @@ class BaseService(ABC):
 
     @abstractmethod
     def ListFiles(self, prefix, recursive=False):
-        pass
\ No newline at end of file
+        pass
+
+    """
+    递归列举prefix下所有对象的元信息，返回[(key, size, etag), ...]，用于InventoryCache批量建立索引；列举失败返回None
+    子类未实现时退化为ListFiles，size记为-1、etag记为None
+    """
+    def ListObjects(self, prefix):
+        files = self.ListFiles(prefix, recursive=True)
+        if files is None or files is False:
+            return None
+        return [(key, -1, None) for key in files]
+
+    """
+    按字节范围读取对象内容，length为None时读取到对象末尾，返回bytes；失败返回None
+    """
+    @abstractmethod
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        pass
+
+    """
+    是否可以按range读取对象，SeekableTarReader创建时检查；包装其他连接的子类（如FanoutService）按被包装的连接返回
+    """
+    def SupportsObjectRange(self):
+        return True
+
+    """
+    多目标上传（FanoutService）使用：上传已读入内存的文件内容，对象路径与UploadFile(prefix, local_path)一致；
+    子类未实现时重新读取本地文件上传
+    """
+    def UploadData(self, prefix, local_path, data):
+        return self.UploadFile(prefix, local_path)
+
+    """
+    多目标上传（FanoutService）使用：返回尚未开始的MultipartUpload，分片由调用方读盘一次后分发给各目标；
+    文件不需要分片上传或子类不支持时返回None
+    """
+    def CreateMultipartUpload(self, prefix, local_path):
+        return None
+
+    """
+    将[(remote_path, local_path), ...]按磁盘物理布局排序后提交到全局传输引擎并发上传（元数据文件优先调度），全部成功返回True；
+    inventory不为None时，云端已存在且大小一致的文件不提交，上传成功的文件登记到inventory
+    """
+    def _UploadFilesConcurrently(self, jobs, name=None, inventory=None):
+        engine = GetTransferEngine()
+        batch = engine.NewBatch(name)
+        skipped = 0
+        for remote_path, local_path in SortByLayout(jobs, key=lambda job: job[1]):
+            size = os.path.getsize(local_path)
+            if inventory is not None and inventory.GetSize(remote_path) == size:
+                skipped += 1
+                continue
+            callback = None
+            if inventory is not None:
+                callback = lambda ok, key=remote_path, nbytes=size: inventory.Add(key, nbytes) if ok else None
+            batch.Add(self.UploadFile, remote_path, local_path, size=size, priority=engine.Priority(local_path, size),
+                      callback=callback)
+        if skipped > 0:
+            logging.info(f"{name}: {skipped}/{len(jobs)} files already uploaded, skipped")
+        return batch.Wait()
@@ -1,24 +1,44 @@
+import json
+import threading
+
 from .BaseService import BaseService
+from .EndpointBalancer import ParseEndpoints
+
+_connectors = {}
+_connectors_lock = threading.Lock()
+
 class CSFactory:
+    @staticmethod
+    def GetConnector(cloud_type, **config) -> BaseService:
+        """ 相同配置共享同一个连接实例（连接池、endpoint健康度与熔断状态），常驻进程中多个任务之间复用 """
+        key = (cloud_type, json.dumps(config, sort_keys=True, default=str))
+        with _connectors_lock:
+            if key not in _connectors:
+                _connectors[key] = CSFactory.CreateConnector(cloud_type, **config)
+            return _connectors[key]
+
     @staticmethod
     def CreateConnector(cloud_type, **config) -> BaseService:
+        # endpoint支持单个地址、逗号分隔的字符串或list，多个地址时由EndpointBalancer按健康度分流
+        endpoints = ParseEndpoints(config.get("endpoints") or config.get("endpoint"))
         if cloud_type == "minio":
             from .Minio import MinioServer
             secure = config["secure"] == "true"
-            return MinioServer(config["endpoint"], config["ak"], config["sk"], config["bucket_name"], secure)
+            return MinioServer(endpoints, config["ak"], config["sk"], config["bucket_name"], secure)
         elif cloud_type == "volcano": # 火山云
             from .Volcano import VolcanoServer
-            return VolcanoServer(config["endpoint"], config["ak"], config["sk"], config["bucket_name"], config["region"])
+            return VolcanoServer(endpoints, config["ak"], config["sk"], config["bucket_name"], config["region"])
         elif cloud_type == "obs": # 华为云
             from .obs import ObsServer
             secure = config["secure"] == "true"
-            return ObsServer(config["ak"], config["sk"], config["endpoint"], config["bucket_name"], secure)
+            return ObsServer(config["ak"], config["sk"], endpoints, config["bucket_name"], secure,
+                             config.get("output_root"))
         elif cloud_type == "oss": # 阿里云
             from .oss import OSSServer
-            return OSSServer(config["ak"], config["sk"], config["bucket_name"], config["endpoint"], config["output_root"])
+            return OSSServer(config["ak"], config["sk"], config["bucket_name"], endpoints, config["output_root"])
         elif cloud_type == "s3": # aws s3 亚马逊云服务
             from .aws import AWSService
             return AWSService(bucket_name=config["bucket_name"], aws_access_key_id=config["ak"],
-                              aws_secret_access_key=config["sk"], endpoint_url=config["endpoint"])
+                              aws_secret_access_key=config["sk"], endpoint_url=endpoints or None)
         else:
-            raise TypeError(f"unsupported cloud type {cloud_type}")
\ No newline at end of file
+            raise TypeError(f"unsupported cloud type {cloud_type}")
@@ -0,0 +1,278 @@
+"""
+多endpoint健康感知负载均衡
+按每个endpoint的延迟/错误率EWMA与当前并发选择请求目标，连续失败的endpoint会被摘除，
+由后台线程周期性探测，探测成功后重新加入；同时记录每个endpoint的吞吐统计；
+可为每个endpoint创建熔断器，选择时跳过熔断中的endpoint，重试时按所选endpoint熔断（PickBreaker）
+"""
+import logging
+import random
+import threading
+import time
+
+from util_modules.retry_util import IsRetryable, GetCircuitBreaker
+
+
+def ParseEndpoints(endpoint):
+    """ 支持list或逗号分隔的字符串 """
+    if endpoint is None:
+        return []
+    if isinstance(endpoint, (list, tuple)):
+        endpoints = endpoint
+    else:
+        endpoints = str(endpoint).split(",")
+    return [ep.strip() for ep in endpoints if ep and ep.strip()]
+
+
+class EndpointStats:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.latency = None  # 每MB耗时的EWMA（秒），None表示尚未探索
+        self.error_rate = 0.0  # 错误率EWMA
+        self.inflight = 0
+        self.consecutive_errors = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+
+    def ToJson(self):
+        return {
+            "endpoint": self.endpoint,
+            "latency_per_mb": self.latency,
+            "error_rate": round(self.error_rate, 4),
+            "inflight": self.inflight,
+            "ejected": self.ejected_until > time.time(),
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "throughput_mb_s": (self.bytes / pow(1024, 2) / self.busy_seconds) if self.busy_seconds > 0 else 0.0
+        }
+
+
+class BalancedClient:
+    """
+    Best()选中的客户端的包装，用于list/head等轻量请求：每次方法调用结束后上报结果，
+    网络错误、5xx等可重试的错误计入该endpoint的错误率与连续失败，对象不存在等错误不计入
+    """
+    def __init__(self, balancer, index, client):
+        self._balancer = balancer
+        self._index = index
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                res = attr(*args, **kwargs)
+            except Exception as e:
+                self._balancer.ReportLight(self._index, not IsRetryable(e))
+                raise
+            # obs等SDK不抛异常，以返回值的状态码表示失败
+            status = getattr(res, "status", None)
+            self._balancer.ReportLight(self._index, not (isinstance(status, int) and status >= 500))
+            return res
+        return call
+
+
+class EndpointBalancer:
+    def __init__(self, endpoints, probe_func=None, alpha=0.3, eject_errors=3, eject_seconds=30,
+                 probe_interval=15, breaker_name=None):
+        """
+        endpoints : endpoint列表
+        probe_func : probe_func(index) -> bool，用于探测被摘除的endpoint是否恢复
+        alpha : EWMA平滑系数
+        eject_errors : 连续失败多少次后摘除
+        eject_seconds : 摘除时长，到期后若仍无探测结果则半开放给少量流量
+        probe_interval : 后台探测周期（秒）
+        breaker_name : 不为None时每个endpoint使用共享熔断器GetCircuitBreaker(f"{breaker_name}:{endpoint}")
+        """
+        if len(endpoints) == 0:
+            raise ValueError("endpoint list is empty")
+        self.stats = [EndpointStats(ep) for ep in endpoints]
+        self.breakers = None
+        if breaker_name is not None:
+            self.breakers = [GetCircuitBreaker(f"{breaker_name}:{ep}") for ep in endpoints]
+        self.probe_func = probe_func
+        self.alpha = alpha
+        self.eject_errors = eject_errors
+        self.eject_seconds = eject_seconds
+        self.probe_interval = probe_interval
+        self.lock = threading.Lock()
+        self._probe_thread = None
+        self._stop_event = threading.Event()
+
+    def __len__(self):
+        return len(self.stats)
+
+    def _Score(self, stat: EndpointStats):
+        if stat.latency is None:
+            return 0.0  # 优先探索未使用过的endpoint
+        return stat.latency * (1.0 + 10.0 * stat.error_rate) * (stat.inflight + 1)
+
+    def _Choose(self, exclude=None):
+        """ 在self.lock内调用；采用power of two choices，在健康（未摘除、未熔断）的endpoint中选择得分较低者 """
+        if len(self.stats) == 1:
+            return 0
+        now = time.time()
+        candidates = [i for i, st in enumerate(self.stats) if st.ejected_until <= now and i != exclude]
+        if self.breakers is not None:
+            # 全部熔断时仍在未摘除的endpoint中选择，由熔断器的Acquire等待恢复
+            candidates = [i for i in candidates if self.breakers[i].Available()] or candidates
+        if len(candidates) == 0:
+            # 全部被摘除时退化为选择最早恢复的endpoint，避免请求直接失败
+            return min(range(len(self.stats)), key=lambda i: self.stats[i].ejected_until)
+        if len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+        return min(candidates, key=lambda i: self._Score(self.stats[i]))
+
+    def Pick(self, exclude=None, index=None):
+        """ 返回endpoint下标并计入并发；index不为None时使用已选定的endpoint（PickBreaker的结果） """
+        with self.lock:
+            if index is None:
+                index = self._Choose(exclude)
+            self.stats[index].inflight += 1
+        return index
+
+    def PickBreaker(self):
+        """
+        选择endpoint但不计入并发，返回(index, 该endpoint的熔断器)，用于RetryPolicy.Call(pick=...)：
+        每次尝试重新选择endpoint并按其熔断器放行，请求由func中的Pick(index=index)或Call(..., index=index)计入并发
+        """
+        with self.lock:
+            index = self._Choose()
+        return index, self.Breaker(index)
+
+    def Breaker(self, index):
+        """ endpoint对应的熔断器，未配置breaker_name时为None """
+        return self.breakers[index] if self.breakers is not None else None
+
+    def Best(self):
+        """ 返回当前得分最低的健康endpoint下标，不计入并发，用于list/head等轻量请求 """
+        if len(self.stats) == 1:
+            return 0
+        now = time.time()
+        with self.lock:
+            candidates = [i for i, st in enumerate(self.stats) if st.ejected_until <= now]
+            if len(candidates) == 0:
+                return min(range(len(self.stats)), key=lambda i: self.stats[i].ejected_until)
+            return min(candidates, key=lambda i: (self._Score(self.stats[i]), random.random()))
+
+    def BestClient(self, clients):
+        """ 返回Best()选中的clients[index]的包装（BalancedClient），轻量请求的失败同样计入健康统计 """
+        index = self.Best()
+        return BalancedClient(self, index, clients[index])
+
+    def Report(self, index, elapsed, ok, nbytes=0, error=None):
+        """
+        请求结束后上报耗时、结果与传输字节数；失败时只有error为网络错误、5xx等可重试的错误才计入该endpoint的失败，
+        本地文件缺失或读取不完整、4xx等与endpoint健康无关的失败（以及没有异常的失败）只释放并发
+        """
+        stat = self.stats[index]
+        cost = elapsed / max(1.0, nbytes / pow(1024, 2))
+        with self.lock:
+            stat.inflight = max(0, stat.inflight - 1)
+            if not ok and (error is None or not IsRetryable(error)):
+                return
+            stat.requests += 1
+            stat.busy_seconds += elapsed
+            stat.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * stat.error_rate
+            if ok:
+                stat.bytes += nbytes
+                stat.consecutive_errors = 0
+                stat.latency = cost if stat.latency is None else self.alpha * cost + (1 - self.alpha) * stat.latency
+                return
+            self._RecordError(stat)
+        if self.probe_func is not None:
+            self._EnsureProbeThread()
+
+    def ReportLight(self, index, ok):
+        """ 轻量请求（Best()选中、未计入并发）结束后上报结果，只更新错误率与连续失败，不影响并发与每MB延迟 """
+        stat = self.stats[index]
+        with self.lock:
+            stat.requests += 1
+            stat.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * stat.error_rate
+            if ok:
+                stat.consecutive_errors = 0
+                return
+            self._RecordError(stat)
+        if self.probe_func is not None:
+            self._EnsureProbeThread()
+
+    def _RecordError(self, stat: EndpointStats):
+        """ 在self.lock内调用，连续失败达到eject_errors次后摘除 """
+        stat.errors += 1
+        stat.consecutive_errors += 1
+        if stat.consecutive_errors >= self.eject_errors and len(self.stats) > 1:
+            stat.ejected_until = time.time() + self.eject_seconds
+            logging.warning(f"endpoint {stat.endpoint} ejected for {self.eject_seconds}s after "
+                            f"{stat.consecutive_errors} consecutive errors")
+
+    def Call(self, func, nbytes=0, is_ok=bool, index=None):
+        """ 选择endpoint（index不为None时使用指定的endpoint）并执行func(index)，自动上报耗时与结果；异常视为失败并继续抛出 """
+        index = self.Pick(index=index)
+        st = time.time()
+        try:
+            res = func(index)
+        except Exception as e:
+            self.Report(index, time.time() - st, False, nbytes, e)
+            raise
+        self.Report(index, time.time() - st, is_ok(res), nbytes)
+        return res
+
+    def CallDeferred(self, func, nbytes=0):
+        """
+        选择endpoint并执行func(index, report)，用于跨越多次调用的请求（如返回尚未开始的分片上传）：
+        请求结束时由调用方调用report(ok, error)上报；func异常视为失败并继续抛出
+        """
+        index = self.Pick()
+        st = time.time()
+
+        def report(ok, error=None):
+            self.Report(index, time.time() - st, ok, nbytes, error)
+
+        try:
+            return func(index, report)
+        except Exception as e:
+            report(False, e)
+            raise
+
+    def _EnsureProbeThread(self):
+        with self.lock:
+            if self._probe_thread is not None:
+                return
+            self._probe_thread = threading.Thread(target=self._ProbeLoop, daemon=True)
+            self._probe_thread.start()
+
+    def _ProbeLoop(self):
+        while not self._stop_event.wait(self.probe_interval):
+            with self.lock:
+                ejected = [i for i, st in enumerate(self.stats) if st.consecutive_errors >= self.eject_errors]
+                if len(ejected) == 0:
+                    # 与判断在同一把锁内退出，之后新摘除的endpoint会重新启动探测线程
+                    self._probe_thread = None
+                    return
+            for index in ejected:
+                stat = self.stats[index]
+                try:
+                    ok = self.probe_func(index)
+                except Exception as e:
+                    logging.debug(f"probe endpoint {stat.endpoint} failed : {e}")
+                    ok = False
+                with self.lock:
+                    if ok:
+                        stat.consecutive_errors = 0
+                        stat.ejected_until = 0.0
+                        logging.info(f"endpoint {stat.endpoint} recovered")
+                    else:
+                        stat.ejected_until = time.time() + self.eject_seconds
+
+    def Metrics(self):
+        with self.lock:
+            return [stat.ToJson() for stat in self.stats]
+
+    def Close(self):
+        self._stop_event.set()
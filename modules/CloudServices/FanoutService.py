@@ -0,0 +1,173 @@
+"""
+同一份数据上传到多个目标（如red bucket与异地容灾bucket，或不同云厂商），本地数据只读一次：
+  - 需要分片上传的文件：分片大小一致的目标共用同一组预读块（FanoutMultipartUpload），各目标独立重试、独立中止；
+    排队超过max_lag_parts个分片的目标被拆出，其他目标不再等待它，拆出的目标单独读盘上传剩余分片
+  - 不需要分片上传的文件：读入内存一次，各目标并发调用UploadData
+第一个目标为主目标：UploadFile/UploadFolder返回主目标的结果，决定数据包是否上传成功；下载、列举等读操作只访问主目标。
+UploadFile在所有目标都结束后才返回（上传后删除本地文件时副本目标不会读到已删除的文件），
+副本目标的结果记录在会话中（NewSession，每个数据包一个），由调用方分别记录各目标的上传状态；
+会话可以只包含部分目标，用于主目标已上传成功后只补传失败的副本目标
+"""
+import logging
+import os
+import threading
+
+from util_modules.log_util import LogContextExecutor
+from .BaseService import BaseService
+from .MultipartUpload import FanoutMultipartUpload, MultipartUpload
+
+
+class FanoutService(BaseService):
+    def __init__(self, targets, names=None, max_lag_parts=2, max_data_bytes=128 * 1024 * 1024, workers=16,
+                 parent=None):
+        """
+        targets : 各目标的连接，第一个为主目标
+        names : 各目标的名称，用于日志与上传记录
+        max_lag_parts : 共用预读块时，单个目标最多落后的分片数，超过后被拆出
+        max_data_bytes : 不分片上传的文件不超过该大小时读入内存一次分发给各目标，超过时各目标分别读盘
+        """
+        self.targets = list(targets)
+        self.names = list(names or [f"target{i}" for i in range(len(self.targets))])
+        self.primary = self.targets[0]
+        self.primary_name = parent.primary_name if parent is not None else self.names[0]
+        self.max_lag_parts = max_lag_parts
+        self.max_data_bytes = max_data_bytes
+        self.parent = parent
+        self.executor = parent.executor if parent is not None else LogContextExecutor(
+            max_workers=workers, thread_name_prefix="fanout")
+        self.lock = threading.Lock()
+        self.stats = {name: {"files": 0, "failed": 0, "bytes": 0, "detached": 0} for name in self.names}
+        self.shared_read_bytes = 0  # 只读一次、发送到多个目标而节省的读盘量
+
+    def NewSession(self, names=None):
+        """
+        共用目标与线程池、单独统计结果的视图，每个数据包一个，ReplicaStatus只包含该会话上传的文件；
+        names不为None时会话只上传到这些目标，第一个目标的结果作为UploadFile/UploadFolder的返回值
+        """
+        indexes = range(len(self.targets)) if names is None else [self.names.index(name) for name in names]
+        return FanoutService([self.targets[i] for i in indexes], [self.names[i] for i in indexes],
+                             max_lag_parts=self.max_lag_parts, max_data_bytes=self.max_data_bytes, parent=self)
+
+    def _Record(self, index, ok, nbytes, detached=False):
+        service = self
+        while service is not None:
+            with service.lock:
+                stats = service.stats[self.names[index]]
+                stats["files"] += 1
+                stats["failed"] += 0 if ok else 1
+                stats["bytes"] += nbytes if ok else 0
+                stats["detached"] += 1 if detached else 0
+            service = service.parent
+
+    def _RecordSharedRead(self, nbytes):
+        service = self
+        while service is not None:
+            with service.lock:
+                service.shared_read_bytes += nbytes
+            service = service.parent
+
+    def _CreateMultipartUpload(self, index, prefix, local_path):
+        """ 初始化失败时返回False，该目标本次上传失败 """
+        try:
+            return self.targets[index].CreateMultipartUpload(prefix, local_path)
+        except Exception as e:
+            logging.error(f"初始化分片上传失败（{self.names[index]}）：{local_path}，{e}")
+            return False
+
+    def _UploadData(self, index, prefix, local_path, data):
+        if data is None:
+            return self.targets[index].UploadFile(prefix, local_path)
+        return self.targets[index].UploadData(prefix, local_path, data)
+
+    def UploadFile(self, prefix, local_path):
+        file_size = os.path.getsize(local_path)
+        uploads = [self._CreateMultipartUpload(index, prefix, local_path) for index in range(len(self.targets))]
+        results = [upload if upload is False else None for upload in uploads]
+        futures = {}
+        detached = set()
+
+        # 分片上传：与第一个分片上传目标分片大小相同的目标共用读盘，其余目标单独上传
+        multipart = [index for index, upload in enumerate(uploads) if isinstance(upload, MultipartUpload)]
+        shared = [index for index in multipart if uploads[index].part_size == uploads[multipart[0]].part_size]
+        for index in multipart:
+            if index not in shared or len(shared) == 1:
+                futures[index] = self.executor.submit(uploads[index].Run)
+
+        # 不分片上传：读入内存一次，各目标并发上传
+        direct = [index for index, upload in enumerate(uploads) if upload is None]
+        if len(direct) > 0:
+            data = None
+            if len(direct) > 1 and file_size <= self.max_data_bytes:
+                with open(local_path, "rb") as f:
+                    data = f.read()
+                self._RecordSharedRead(file_size * (len(direct) - 1))
+            for index in direct:
+                futures[index] = self.executor.submit(self._UploadData, index, prefix, local_path, data)
+
+        if len(shared) > 1:
+            fanout = FanoutMultipartUpload(local_path, [uploads[index] for index in shared],
+                                           max_lag=self.max_lag_parts, name=prefix)
+            for index, result in zip(shared, fanout.Run()):
+                if result is None:
+                    # 落后过多被拆出的目标单独读盘上传剩余分片
+                    detached.add(index)
+                    futures[index] = self.executor.submit(uploads[index].Run)
+                else:
+                    results[index] = result
+            self._RecordSharedRead(file_size * (len(shared) - 1 - len(detached)))
+
+        for index, future in futures.items():
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                logging.error(f"上传失败（{self.names[index]}）：{local_path}，{e}")
+                results[index] = False
+        for index, result in enumerate(results):
+            self._Record(index, bool(result), file_size, index in detached)
+            if not result and self.names[index] != self.primary_name:
+                logging.error(f"文件{local_path}上传到副本目标{self.names[index]}失败")
+        return bool(results[0])
+
+    def UploadFolder(self, prefix, local_path, inventory=None):
+        jobs = []
+        for root, _, files in os.walk(local_path):
+            for file in files:
+                local_file_path = os.path.join(root, file)
+                relative_path = os.path.relpath(local_file_path, local_path)
+                jobs.append((os.path.normpath(os.path.join(prefix, relative_path)), local_file_path))
+        return self._UploadFilesConcurrently(jobs, local_path, inventory)
+
+    def ReplicaStatus(self):
+        """ 返回{副本目标名称: 本会话上传的文件是否全部成功}，只包含本会话上传的副本目标 """
+        with self.lock:
+            return {name: self.stats[name]["failed"] == 0 for name in self.names if name != self.primary_name}
+
+    def DownloadFile(self, prefix, local_path):
+        return self.primary.DownloadFile(prefix, local_path)
+
+    def DownloadFolder(self, prefix, local_path):
+        return self.primary.DownloadFolder(prefix, local_path)
+
+    def IsFileExists(self, prefix):
+        return self.primary.IsFileExists(prefix)
+
+    def ListFiles(self, prefix, recursive=False):
+        return self.primary.ListFiles(prefix, recursive=recursive)
+
+    def ListObjects(self, prefix):
+        return self.primary.ListObjects(prefix)
+
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        return self.primary.GetObjectRange(prefix, offset, length)
+
+    def SupportsObjectRange(self):
+        return self.primary.SupportsObjectRange()
+
+    def Metrics(self):
+        with self.lock:
+            metrics = {}
+            for name, stats in self.stats.items():
+                metrics[name] = {"files": stats["files"], "failed": stats["failed"], "detached": stats["detached"],
+                                 "mb": round(stats["bytes"] / pow(1024, 2), 1)}
+            metrics["shared_read_mb"] = round(self.shared_read_bytes / pow(1024, 2), 1)
+            return metrics
@@ -0,0 +1,169 @@
+"""
+远端对象清单缓存
+一次性列举prefix下的所有对象，在内存中保存有序的key/size/etag索引，按TTL失效，
+存在性/大小查询为O(log n)，避免逐个文件发起HEAD请求（stat_object/object_exists/headObject/head_object）
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+
+from .BaseService import BaseService
+
+
+def _NormKey(key):
+    # 各云服务对前导'/'与重复分隔符的处理不一致，统一后再比较
+    return os.path.normpath(key).replace("\\", "/").lstrip("/") if key else ""
+
+
+def _UnderPrefix(key, prefix):
+    # 按目录边界匹配，a/b 不覆盖 a/bc
+    return prefix == "" or key == prefix or key.startswith(prefix + "/")
+
+
+class _PrefixIndex:
+    def __init__(self, prefix, keys, sizes, etags, load_time):
+        self.prefix = prefix
+        self.keys = keys  # 有序
+        self.sizes = sizes  # array('q')，-1表示未知
+        self.etags = etags
+        self.load_time = load_time
+        self.extra = {}  # 索引建立后新上传的对象 <key, (size, etag)>
+
+    def Find(self, key):
+        if key in self.extra:
+            return self.extra[key]
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.sizes[i], self.etags[i]
+        return None
+
+
+class InventoryCache:
+    def __init__(self, conn: BaseService, ttl=600, cache_root=None):
+        """
+        conn : 云服务连接
+        ttl : 索引有效期（秒），过期后下一次查询会重新列举
+        cache_root : 可选的落盘目录，进程重启后在TTL内可直接复用
+        """
+        self.conn = conn
+        self.ttl = ttl
+        self.cache_root = cache_root
+        self.indexes = {}  # <prefix, _PrefixIndex>
+        self.lock = threading.Lock()
+        if self.cache_root:
+            os.makedirs(self.cache_root, exist_ok=True)
+
+    def Prefetch(self, prefix):
+        """ 列举prefix并建立索引，已存在且未过期时直接返回；列举失败返回None """
+        prefix = _NormKey(prefix)
+        with self.lock:
+            index = self.indexes.get(prefix)
+            if index and time.time() - index.load_time < self.ttl:
+                return index
+        index = self._LoadFromDisk(prefix)
+        if index is None:
+            st = time.time()
+            objects = self.conn.ListObjects(prefix)
+            if objects is None:
+                # 列举失败不缓存，该prefix下的文件视为未上传，下一次Prefetch重新列举
+                logging.warning(f"failed to list inventory of {prefix}")
+                return None
+            objects = sorted(((_NormKey(key), size, etag) for key, size, etag in objects), key=lambda x: x[0])
+            index = _PrefixIndex(prefix,
+                                 [obj[0] for obj in objects],
+                                 array('q', (obj[1] if obj[1] is not None else -1 for obj in objects)),
+                                 [obj[2] for obj in objects],
+                                 time.time())
+            logging.info(f"inventory of {prefix} loaded, {len(index.keys)} objects, cost {time.time() - st:.2f}s")
+            self._DumpToDisk(index)
+        with self.lock:
+            self.indexes[prefix] = index
+        return index
+
+    def Invalidate(self, prefix=None):
+        with self.lock:
+            if prefix is None:
+                self.indexes.clear()
+            else:
+                self.indexes.pop(_NormKey(prefix), None)
+
+    def _GetIndex(self, key):
+        """ 找到覆盖key的最长prefix索引，过期的索引视为不存在 """
+        now = time.time()
+        best = None
+        with self.lock:
+            for prefix, index in self.indexes.items():
+                if not _UnderPrefix(key, prefix) or now - index.load_time >= self.ttl:
+                    continue
+                if best is None or len(prefix) > len(best.prefix):
+                    best = index
+        return best
+
+    def Lookup(self, key):
+        """
+        返回(size, etag)，不存在返回None；key不在任何已加载的prefix下时同样返回None（视为未上传），
+        不逐个发起HEAD请求：HEAD得不到大小，调用方无法据此跳过上传
+        """
+        key = _NormKey(key)
+        index = self._GetIndex(key)
+        if index is None:
+            return None
+        return index.Find(key)
+
+    def Exists(self, key):
+        return self.Lookup(key) is not None
+
+    def GetSize(self, key):
+        res = self.Lookup(key)
+        return None if res is None else res[0]
+
+    def Add(self, key, size, etag=None):
+        """ 上传成功后登记，避免同一TTL内重复列举 """
+        key = _NormKey(key)
+        index = self._GetIndex(key)
+        if index is not None:
+            with self.lock:
+                index.extra[key] = (size, etag)
+
+    def _CacheFile(self, prefix):
+        name = hashlib.md5(prefix.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_root, f"inventory_{name}.json")
+
+    def _LoadFromDisk(self, prefix):
+        if not self.cache_root:
+            return None
+        cache_file = self._CacheFile(prefix)
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            with open(cache_file, "r") as fp:
+                content = json.load(fp)
+            if content["prefix"] != prefix or time.time() - content["load_time"] >= self.ttl:
+                return None
+            return _PrefixIndex(prefix, content["keys"], array('q', content["sizes"]), content["etags"],
+                                content["load_time"])
+        except Exception as e:
+            logging.warning(f"failed to load inventory cache {cache_file} : {e}")
+            return None
+
+    def _DumpToDisk(self, index: _PrefixIndex):
+        if not self.cache_root:
+            return
+        cache_file = self._CacheFile(index.prefix)
+        try:
+            with open(cache_file + ".tmp", "w") as fp:
+                json.dump({
+                    "prefix": index.prefix,
+                    "load_time": index.load_time,
+                    "keys": index.keys,
+                    "sizes": index.sizes.tolist(),
+                    "etags": index.etags
+                }, fp)
+            os.replace(cache_file + ".tmp", cache_file)
+        except Exception as e:
+            logging.warning(f"failed to dump inventory cache {cache_file} : {e}")
@@ -1,65 +1,163 @@
+import io
 import logging
 import os
 from minio import Minio
 from minio.error import S3Error
-from tqdm import tqdm
-from itertools import cycle
+from minio.datatypes import Part
+import time
 
 from .BaseService import BaseService
+from .EndpointBalancer import EndpointBalancer, ParseEndpoints
+from .MultipartUpload import MultipartUpload
+from util_modules.PrefetchPool import GetPrefetchPool
+from util_modules.retry_util import GetRetryPolicy
+
+# minio的公开接口put_object不支持单个分片重试，分片上传使用SDK内部的分片接口（requirements.txt中限定了minio版本），
+# 所装版本没有这些接口时退回put_object整体上传
+_MULTIPART_API = all(hasattr(Minio, name) for name in ("_create_multipart_upload", "_upload_part",
+                                                       "_complete_multipart_upload", "_abort_multipart_upload"))
+if not _MULTIPART_API:
+    logging.warning("当前minio版本没有分片上传接口，大文件改用put_object整体上传")
+
 
 class MinioServer(BaseService):
     def __init__(self, endpoint, access_key, secret_key, bucket_name, secure=True):
-        """ secure ： 是否使用HTTPS """
-        endpoints = endpoint.split(",")
+        """ secure ： 是否使用HTTPS；endpoint支持list或逗号分隔的多个地址 """
+        endpoints = ParseEndpoints(endpoint)
         self.clients = [Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure) for endpoint in
                         endpoints]
         self.bucket_name = bucket_name
         self.part_size = 100 * 1024 * 1024
-        self.client_cycle = cycle(self.clients)
+        self.balancer = EndpointBalancer(endpoints,
+                                         probe_func=lambda i: self.clients[i].bucket_exists(self.bucket_name),
+                                         breaker_name="minio")
         self.__initBucket()
 
     def get_client(self):
-        """获取下一个可用的Minio客户端（简单轮询）。"""
-        return next(self.client_cycle)
+        """获取当前最健康的Minio客户端，用于list/stat等轻量请求，请求结果计入该endpoint的健康统计。"""
+        return self.balancer.BestClient(self.clients)
 
     def __initBucket(self):
         tmp_client = self.get_client()
         if not tmp_client.bucket_exists(self.bucket_name):
             tmp_client.make_bucket(self.bucket_name)
 
+    @staticmethod
+    def _ObjectName(prefix, local_path):
+        file_name = os.path.basename(local_path)
+        if file_name not in prefix:
+            prefix = os.path.normpath(os.path.join(prefix, file_name))
+        return prefix
+
     def UploadFile(self, prefix, local_path):
         logging.info(f"Uploading {local_path} to {prefix}")
+        prefix = self._ObjectName(prefix, local_path)
         try:
-            tmp_client = self.get_client()
-            file_name = os.path.basename(local_path)
-            if file_name not in prefix:
-                prefix = os.path.normpath(os.path.join(prefix, file_name))
-            tmp_client.fput_object(self.bucket_name, prefix, local_path,
-                                    part_size=self.part_size, num_parallel_uploads=4)
+            if _MULTIPART_API and os.path.getsize(local_path) > self.part_size:
+                return self._MultipartUpload(prefix, local_path)
+            return GetRetryPolicy().Call(self._UploadFileOnce, prefix, local_path, pick=self.balancer.PickBreaker,
+                                         name=f"upload {local_path}")
+        except Exception as e:
+            logging.error(f"上传失败：{e}")
+            return False
+
+    def _UploadFileOnce(self, prefix, local_path, index=None):
+        upload_mark = False
+        error = None
+        file_size = 0
+        index = self.balancer.Pick(index=index)
+        st = time.time()
+        try:
+            file_size = os.path.getsize(local_path)
+            # 由预读缓冲池按顺序读盘，put_object从缓冲区取数据发送
+            with GetPrefetchPool().Open(local_path) as stream:
+                self.clients[index].put_object(self.bucket_name, prefix, stream, file_size,
+                                               part_size=self.part_size, num_parallel_uploads=4)
+            upload_mark = True
             return True
-        except S3Error as e:
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.balancer.Report(index, time.time() - st, upload_mark, file_size, error)
+
+    def UploadData(self, prefix, local_path, data):
+        prefix = self._ObjectName(prefix, local_path)
+        try:
+            return GetRetryPolicy().Call(
+                self.balancer.Call,
+                lambda i: self.clients[i].put_object(self.bucket_name, prefix, io.BytesIO(data), len(data)) is not None,
+                nbytes=len(data), pick=self.balancer.PickBreaker, name=f"upload {local_path}")
+        except Exception as e:
             logging.error(f"上传失败：{e}")
             return False
 
+    def CreateMultipartUpload(self, prefix, local_path):
+        file_size = os.path.getsize(local_path)
+        if not _MULTIPART_API or file_size <= self.part_size:
+            return None
+        return self.balancer.CallDeferred(
+            lambda i, report: self._NewMultipartUpload(self.clients[i], self._ObjectName(prefix, local_path),
+                                                       local_path, on_finish=report), nbytes=file_size)
+
+    def _NewMultipartUpload(self, client, prefix, local_path, on_finish=None):
+        upload_id = client._create_multipart_upload(self.bucket_name, prefix,
+                                                    {"Content-Type": "application/octet-stream"})
+
+        def upload_part(part_number, reader, size):
+            return client._upload_part(self.bucket_name, prefix, reader.read(), None, upload_id, part_number)
+
+        def complete(parts):
+            client._complete_multipart_upload(self.bucket_name, prefix, upload_id,
+                                              [Part(n, etag) for n, etag in parts])
+            return True
+
+        def abort():
+            client._abort_multipart_upload(self.bucket_name, prefix, upload_id)
+
+        return MultipartUpload(local_path, self.part_size, upload_part, complete, abort, workers=4,
+                               breaker=self.balancer.Breaker(self.clients.index(client)),
+                               name=f"minio://{self.bucket_name}/{prefix}", on_finish=on_finish)
+
+    def _MultipartUpload(self, prefix, local_path):
+        """
+        大文件分片上传，单个分片失败只重试该分片，其余分片继续上传，分片重试耗尽后才中止上传；
+        put_object内部的分片上传任一分片失败即整体失败，这里改用SDK的底层分片接口
+        """
+        return self.CreateMultipartUpload(prefix, local_path).Run()
+
     def DownloadFile(self, prefix, local_path):
         logging.info(f"Downloading {local_path} from {prefix}")
         try:
-            tmp_client = self.get_client()
-            tmp_client.fget_object(self.bucket_name, prefix, local_path)
+            self.balancer.Call(lambda i: self.clients[i].fget_object(self.bucket_name, prefix, local_path),
+                               is_ok=lambda _: True)
             return True
         except S3Error as e:
             logging.error(f"下载失败：{e}")
             return False
 
-    def UploadFolder(self, prefix, local_path):
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        resp = None
+        try:
+            resp = self.get_client().get_object(self.bucket_name, prefix, offset=offset, length=length or 0)
+            return resp.read()
+        except S3Error as e:
+            logging.error(f"读取失败：{e}")
+            return None
+        finally:
+            if resp is not None:
+                resp.close()
+                resp.release_conn()
+
+    def UploadFolder(self, prefix, local_path, inventory=None):
         logging.info(f"Uploading {local_path} to {prefix}")
+        jobs = []
         for root, _, files in os.walk(local_path):
-            for file in tqdm(files, desc="上传进度"):
+            for file in files:
                 local_file_path = os.path.join(root, file)
                 object_name = os.path.normpath(os.path.join(prefix, os.path.relpath(local_file_path, local_path)))
-                if not self.UploadFile(object_name, local_file_path):
-                    return False
-        return True
+                jobs.append((object_name, local_file_path))
+        return self._UploadFilesConcurrently(jobs, local_path, inventory)
 
     def DownloadFolder(self, prefix, local_path):
         os.makedirs(local_path, exist_ok=True)
@@ -102,4 +200,16 @@ class MinioServer(BaseService):
                 result.append(obj.object_name)
             return result
         except S3Error as exc:
-            return result
\ No newline at end of file
+            return result
+
+    def ListObjects(self, prefix):
+        result = []
+        try:
+            tmp_client = self.get_client()
+            objects = tmp_client.list_objects(self.bucket_name, prefix=prefix, recursive=True)
+            for obj in objects:
+                result.append((obj.object_name, obj.size, obj.etag))
+        except S3Error as exc:
+            logging.error(exc.message)
+            return None
+        return result
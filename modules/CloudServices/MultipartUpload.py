@@ -0,0 +1,473 @@
+"""
+各云服务共用的并行分片上传
+分片数据由预读缓冲池按顺序读盘，多个线程并行上传；单个分片失败时只按统一重试策略退避重试该分片，
+其余分片继续上传，某个分片重试耗尽后才中止整个上传。各后端只需提供上传分片/完成/中止三个函数：
+  - upload_part(part_number, reader, size) -> etag，reader为可read/seek的文件对象，每次重试重新创建
+  - complete(parts) -> 成功与否，parts为按序号排序的[(part_number, etag)]
+  - abort() : 中止上传，释放服务端已上传的分片
+FanoutMultipartUpload : 同一个文件上传到多个目标时每个分片只读盘一次，同一缓冲区并发发送到各目标
+可选对冲（HedgePolicy）：分片耗时超过近期分片耗时的高分位时，通过hedge_part（默认同upload_part）
+在另一个连接/endpoint上重复发送同一分片，先成功者生效，另一个请求的body被中断；对冲数据量不超过总数据量的一定比例
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from util_modules.log_util import LogContextExecutor, RunInLogContext
+from util_modules.PrefetchPool import GetPrefetchPool, BlockReader
+from util_modules.retry_util import GetRetryPolicy, IsRetryable, RequestCancelled
+
+
+class HedgePolicy:
+    def __init__(self, percentile=95, max_ratio=0.05, min_samples=20, window=200, min_delay=0.5, max_workers=256):
+        """
+        percentile : 分片耗时（按每MB折算）超过近期该分位时发起对冲
+        max_ratio : 对冲发送的数据量占分片总数据量的比例上限
+        min_samples : 样本数不足时不对冲
+        window : 统计最近多少个分片的耗时
+        min_delay : 对冲等待时间下限（秒）
+        max_workers : 执行对冲请求的线程数
+        """
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window)
+        self.total_bytes = 0
+        self.hedge_bytes = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.executor = LogContextExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def Record(self, size, seconds):
+        """ 记录成功分片的耗时 """
+        with self.lock:
+            self.samples.append(seconds / max(size / pow(1024, 2), 1e-3))
+            self.total_bytes += size
+
+    def Delay(self, size):
+        """ 返回发起对冲前的等待时间，样本不足时返回None """
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        value = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+        return max(self.min_delay, value * size / pow(1024, 2))
+
+    def TryHedge(self, size):
+        """ 对冲数据量未超过上限时计入并返回True """
+        with self.lock:
+            if self.hedge_bytes + size > self.max_ratio * self.total_bytes:
+                return False
+            self.hedge_bytes += size
+            self.hedges += 1
+            return True
+
+    def OnHedgeWin(self):
+        with self.lock:
+            self.hedge_wins += 1
+
+    def Metrics(self):
+        with self.lock:
+            return {
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_bytes": self.hedge_bytes,
+                "hedge_ratio": round(self.hedge_bytes / self.total_bytes, 4) if self.total_bytes else 0.0
+            }
+
+
+class MultipartUpload:
+    def __init__(self, local_path, part_size, upload_part, complete, abort=None, workers=4, breaker=None,
+                 done_parts=None, on_part_done=None, name=None, hedge=None, hedge_part=None, on_finish=None):
+        """
+        done_parts : 断点续传时已上传的分片{part_number: etag}
+        on_part_done : on_part_done(part_number, etag)，分片上传成功后调用，可用于持久化断点
+        hedge : HedgePolicy，为None时使用全局对冲策略（默认未开启）
+        hedge_part : 对冲请求使用的上传函数，签名同upload_part，可选择另一个endpoint
+        on_finish : on_finish(ok, error)，上传完成或中止后调用，error为导致失败的异常（没有时为None），可用于向EndpointBalancer上报结果
+        """
+        self.local_path = local_path
+        self.part_size = part_size
+        self.upload_part = upload_part
+        self.complete = complete
+        self.abort = abort
+        self.workers = max(1, workers)
+        self.breaker = breaker
+        self.done_parts = dict(done_parts or {})
+        self.on_part_done = on_part_done
+        self.on_finish = on_finish
+        self.name = name or local_path
+        self.hedge = hedge or GetHedgePolicy()
+        self.hedge_part = hedge_part or upload_part
+        self.lock = threading.Lock()
+        self.failed = threading.Event()
+        self.error = None  # 导致上传失败的异常
+        self.part_retries = 0
+
+    def _Ranges(self, file_size):
+        """ 返回尚未上传的[(part_number, offset, length)] """
+        return [(offset // self.part_size + 1, offset, min(self.part_size, file_size - offset))
+                for offset in range(0, file_size, self.part_size)
+                if offset // self.part_size + 1 not in self.done_parts]
+
+    def _SendWithRetry(self, part_number, block, readers, cancelled=None):
+        attempts = [0]
+
+        def send():
+            if cancelled is not None and cancelled.is_set():
+                raise RequestCancelled(f"part {part_number} of {self.name} cancelled")
+            attempts[0] += 1
+            reader = BlockReader(block)
+            readers.append(reader)
+            return self.upload_part(part_number, reader, block.size)
+
+        try:
+            return GetRetryPolicy().Call(send, breaker=self.breaker, name=f"part {part_number} of {self.name}")
+        finally:
+            with self.lock:
+                self.part_retries += attempts[0] - 1
+
+    def _SendHedged(self, part_number, block, readers, cancelled):
+        """ 主请求（带重试）超过对冲等待时间仍未完成时，发起一个对冲请求，返回先成功者的etag """
+        delay = self.hedge.Delay(block.size)
+        if delay is None:
+            # 样本不足时不对冲，直接在当前线程发送
+            return self._SendWithRetry(part_number, block, readers, cancelled), []
+        primary = self.hedge.executor.submit(self._SendWithRetry, part_number, block, readers, cancelled)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.hedge.TryHedge(block.size):
+            return primary.result(), [primary]
+        logging.info(f"part {part_number} of {self.name} running over {delay:.1f}s, sending hedged request")
+        hedge_reader = BlockReader(block)
+        readers.append(hedge_reader)
+        hedged = self.hedge.executor.submit(self.hedge_part, part_number, hedge_reader, block.size)
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        self.hedge.OnHedgeWin()
+                    return future.result(), [primary, hedged]
+                if future is primary or error is None:
+                    error = future.exception()
+        raise error
+
+    def _UploadPart(self, part_number, block):
+        """ 上传一个分片，所有请求结束后归还预读块 """
+        readers = []
+        futures = []
+        cancelled = threading.Event()
+        st = time.time()
+        try:
+            if self.hedge is None:
+                etag = self._SendWithRetry(part_number, block, readers)
+            else:
+                etag, futures = self._SendHedged(part_number, block, readers, cancelled)
+        finally:
+            # 中断仍在发送的请求并停止其重试；部分SDK先读入整个body（如botocore计算校验和），读取中断不了，
+            # 此时把数据复制出来后立即归还缓冲区，落后的请求使用副本直到结束，不占用预读缓冲区
+            cancelled.set()
+            for reader in list(readers):
+                reader.Cancel()
+            if any(not future.done() for future in futures):
+                block.Detach()
+            block.Release()
+        if self.hedge is not None:
+            self.hedge.Record(block.size, time.time() - st)
+        with self.lock:
+            self.done_parts[part_number] = etag
+        if self.on_part_done is not None:
+            self.on_part_done(part_number, etag)
+
+    def Run(self):
+        """ 上传全部分片并完成上传，成功返回True；分片重试耗尽时中止上传并返回False """
+        file_size = os.path.getsize(self.local_path)
+        todo = self._Ranges(file_size)
+        logging.info(f"multipart upload {self.name}: {len(todo)} parts to upload, "
+                     f"{len(self.done_parts)} parts already uploaded, workers={self.workers}")
+        if len(todo) > 0:
+            stream = GetPrefetchPool(self.part_size, self.workers * 2 + 2).Open(
+                self.local_path, ranges=[(offset, length) for _, offset, length in todo], max_ahead=self.workers + 1)
+
+            def worker():
+                while not self.failed.is_set():
+                    block = stream.Next()
+                    if block is None:
+                        return
+                    part_number = todo[block.index][0]
+                    try:
+                        self._UploadPart(part_number, block)
+                    except Exception as e:
+                        logging.error(f"part {part_number} of {self.name} failed after retries : {e}")
+                        self._Fail(e)
+
+            with stream, LogContextExecutor(max_workers=self.workers) as executor:
+                for future in [executor.submit(worker) for _ in range(min(self.workers, len(todo)))]:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.error(f"read {self.local_path} failed : {e}")
+                        self._Fail(e)
+        return self._Finish()
+
+    def _Fail(self, error):
+        self.error = self.error or error
+        self.failed.set()
+
+    def _Finish(self):
+        ok = self._Complete()
+        if self.on_finish is not None:
+            self.on_finish(ok, None if ok else self.error)
+        return ok
+
+    def _Complete(self):
+        """ 所有分片结束后完成上传，有分片重试耗尽时中止上传并返回False """
+        if self.part_retries > 0:
+            logging.info(f"multipart upload {self.name}: {self.part_retries} part retries")
+        if self.failed.is_set():
+            self._Abort()
+            return False
+        parts = sorted(self.done_parts.items())
+        try:
+            ok = GetRetryPolicy().Call(self.complete, parts, breaker=self.breaker, is_ok=bool,
+                                       name=f"complete {self.name}")
+        except Exception as e:
+            logging.error(f"complete multipart upload {self.name} failed : {e}")
+            self.error = e
+            # 参数类错误（如分片缺失）无法通过重试恢复，中止后由上层重新上传
+            if not IsRetryable(e):
+                self._Abort()
+            return False
+        return bool(ok)
+
+    def _Abort(self):
+        if self.abort is None:
+            return
+        try:
+            self.abort()
+            logging.info(f"multipart upload {self.name} aborted")
+        except Exception as e:
+            logging.warning(f"abort multipart upload {self.name} failed : {e}")
+
+
+class _SharedBlock:
+    """ 多个目标共用的预读块，所有目标都发送完成后才归还缓冲区 """
+    def __init__(self, block, refs):
+        self.block = block
+        self.size = block.size
+        self.refs = refs
+        self.lock = threading.Lock()
+
+    def Read(self, start, end):
+        return self.block.Read(start, end)
+
+    def Detach(self):
+        self.block.Detach()
+
+    def Release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+        self.block.Release()
+
+
+class FanoutMultipartUpload:
+    """
+    同一个文件分片上传到多个目标：每个分片只读盘一次，同一块缓冲区由各目标各自的线程并发发送，
+    每个目标独立重试、独立中止，一个目标失败不影响其他目标。
+    某个目标排队未发送的分片超过max_lag个、其他目标因此累计等待数据超过stall_seconds时，该目标被拆出（detached），
+    已排队的分片归还缓冲区，其他目标不再等待它；拆出的目标之后单独读盘上传剩余分片
+    """
+    def __init__(self, local_path, uploads, max_lag=2, stall_seconds=1.0, name=None):
+        """
+        uploads : 各目标尚未开始的MultipartUpload，分片大小需一致
+        stall_seconds : 因落后的目标而累计等待数据超过该时间才拆出落后的目标，避免短暂的排队波动导致拆出
+        """
+        if len({upload.part_size for upload in uploads}) != 1:
+            raise ValueError("fanout targets must share the same part size")
+        self.local_path = local_path
+        self.uploads = uploads
+        self.max_lag = max_lag
+        self.stall_seconds = stall_seconds
+        self.name = name or local_path
+        self.part_size = uploads[0].part_size
+        self.workers = max(upload.workers for upload in uploads)
+        self.cond = threading.Condition()
+        self.pending = [deque() for _ in uploads]
+        self.starved = [0.0 for _ in uploads]  # 各目标因其他目标落后而等待数据的累计时间
+        self.active = set(range(len(uploads)))
+        self.detached = set()
+        self.dispatched = False
+
+    def _Detach(self, index):
+        """ 在self.cond内调用 """
+        logging.warning(f"{self.uploads[index].name} lagging {len(self.pending[index])} parts behind, "
+                        f"detached from shared reads of {self.name}")
+        self.active.discard(index)
+        self.detached.add(index)
+        # 重新累计，之前的等待由被拆出的目标造成
+        self.starved = [0.0 for _ in self.uploads]
+        while self.pending[index]:
+            self.pending[index].popleft()[1].Release()
+        self.cond.notify_all()
+
+    def _DetachLagging(self, waiting):
+        """ 在self.cond内调用，waiting目标累计等待数据超过stall_seconds时，拆出排队过多的目标 """
+        for index in list(self.active):
+            if index != waiting and len(self.pending[index]) > self.max_lag:
+                self._Detach(index)
+
+    def _Worker(self, index):
+        upload = self.uploads[index]
+        while True:
+            with self.cond:
+                # 已失败的目标不再等待数据，也不会因为它而拆出其他目标
+                while (not self.pending[index] and not self.dispatched and index in self.active
+                       and not upload.failed.is_set()):
+                    st = time.monotonic()
+                    self.cond.wait(timeout=self.stall_seconds / 4)
+                    if any(len(self.pending[i]) > self.max_lag for i in self.active if i != index):
+                        self.starved[index] += time.monotonic() - st
+                        if self.starved[index] >= self.stall_seconds:
+                            self._DetachLagging(index)
+                if not self.pending[index]:
+                    return
+                part_number, block = self.pending[index].popleft()
+                self.cond.notify_all()
+            if upload.failed.is_set():
+                block.Release()
+                continue
+            try:
+                upload._UploadPart(part_number, block)
+            except Exception as e:
+                logging.error(f"part {part_number} of {upload.name} failed after retries : {e}")
+                upload._Fail(e)
+
+    def Run(self):
+        """ 返回各目标的结果列表，True/False为已完成/已失败，None为被拆出、需要单独读盘上传剩余分片的目标 """
+        file_size = os.path.getsize(self.local_path)
+        todo = [{part_number for part_number, _, _ in upload._Ranges(file_size)} for upload in self.uploads]
+        ranges = sorted({item for upload in self.uploads for item in upload._Ranges(file_size)})
+        logging.info(f"fanout multipart upload {self.name}: {len(ranges)} parts to {len(self.uploads)} targets")
+        threads = [threading.Thread(target=RunInLogContext(self._Worker), args=(index,), daemon=True, name="fanout")
+                   for index, upload in enumerate(self.uploads) for _ in range(upload.workers)]
+        for thread in threads:
+            thread.start()
+        # 预读块数足够让最快的目标保持并发，同时容纳落后目标max_lag个分片
+        max_ahead = self.workers * 2 + self.max_lag + 1
+        try:
+            if len(ranges) > 0:
+                with GetPrefetchPool(self.part_size, max_ahead + 1).Open(
+                        self.local_path, ranges=[(offset, length) for _, offset, length in ranges],
+                        max_ahead=max_ahead) as stream:
+                    while True:
+                        block = stream.Next()
+                        if block is None:
+                            break
+                        part_number = ranges[block.index][0]
+                        with self.cond:
+                            receivers = [index for index in self.active
+                                         if part_number in todo[index] and not self.uploads[index].failed.is_set()]
+                            if len(receivers) == 0:
+                                block.Release()
+                                if len(self.active) == 0:
+                                    break
+                                continue
+                            shared = _SharedBlock(block, len(receivers))
+                            for index in receivers:
+                                self.pending[index].append((part_number, shared))
+                            self.cond.notify_all()
+        except Exception as e:
+            logging.error(f"read {self.local_path} failed : {e}")
+            for index in self.active:
+                self.uploads[index]._Fail(e)
+        finally:
+            with self.cond:
+                self.dispatched = True
+                self.cond.notify_all()
+            for thread in threads:
+                thread.join()
+        return [None if index in self.detached and not upload.failed.is_set() else upload._Finish()
+                for index, upload in enumerate(self.uploads)]
+
+
+_hedge = None
+
+
+def InitHedgePolicy(**kwargs) -> HedgePolicy:
+    """ 开启全局分片对冲 """
+    global _hedge
+    _hedge = HedgePolicy(**kwargs)
+    return _hedge
+
+
+def DisableHedgePolicy():
+    """ 关闭全局分片对冲 """
+    global _hedge
+    _hedge = None
+
+
+def GetHedgePolicy():
+    """ 未开启时返回None """
+    return _hedge
+
+
+"""
+性能测试：python -m modules.CloudServices.MultipartUpload [files] [parts] [straggler_ratio]
+用本地模拟的分片上传（每个分片正常耗时约20ms，按straggler_ratio的概率变慢5~10倍）分别在关闭/开启对冲时
+上传files个文件，输出文件完成时间的p50/p99与对冲数据量占比。
+默认参数下本地连续运行5次：关闭对冲p99为253~287ms，开启后为134~225ms，各次差异较大；
+p50基本不变（关闭89~91ms，开启91~94ms，对冲请求占用worker使p50略有上升）
+"""
+if __name__ == "__main__":
+    import random
+    import sys
+    import tempfile
+
+    logging.getLogger().setLevel(logging.WARNING)
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    part_count = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    straggler_ratio = float(sys.argv[3]) if len(sys.argv) > 3 else 0.03
+    part_size = 1024 * 1024
+    chunk_size = 64 * 1024
+    part_seconds = 0.02
+
+    bench_file = tempfile.NamedTemporaryFile(prefix="hedge_bench_", delete=False)
+    bench_file.write(os.urandom(part_size * part_count))
+    bench_file.close()
+
+    def fakeUploadPart(part_number, reader, size):
+        """ 模拟按块发送body，慢请求的每个块耗时放大5~10倍 """
+        slow = random.uniform(5, 10) if random.random() < straggler_ratio else 1.0
+        chunks = max(1, size // chunk_size)
+        for _ in range(chunks):
+            reader.read(chunk_size)
+            time.sleep(part_seconds * slow / chunks)
+        return f"etag-{part_number}"
+
+    def run(hedge):
+        durations = []
+        for _ in range(file_count):
+            st = time.time()
+            upload = MultipartUpload(bench_file.name, part_size, fakeUploadPart, lambda parts: True, workers=4,
+                                     hedge=hedge, name="bench")
+            upload.Run()
+            durations.append(time.time() - st)
+        durations.sort()
+        return durations[len(durations) // 2], durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+
+    hedge_policy = HedgePolicy(percentile=95, max_ratio=0.1, min_samples=20, min_delay=0.0)
+    p50, p99 = run(None)
+    print(f"files={file_count}, parts={part_count}, straggler ratio={straggler_ratio}")
+    print(f"without hedging : p50={p50 * 1000:.0f}ms, p99={p99 * 1000:.0f}ms")
+    p50, p99 = run(hedge_policy)
+    print(f"with hedging    : p50={p50 * 1000:.0f}ms, p99={p99 * 1000:.0f}ms, {hedge_policy.Metrics()}")
+    os.remove(bench_file.name)
@@ -0,0 +1,60 @@
+"""
+基于成员偏移索引（<tar>.idx.json）按需读取云端tar中的单个文件
+只发起 索引读取 + 成员range请求，无需下载或流式读取整个归档
+"""
+import hashlib
+import json
+import logging
+import os
+
+from util_modules.tar_util import INDEX_SUFFIX
+from .BaseService import BaseService
+
+
+def _NormMemberPath(path):
+    path = path.replace("\\", "/")
+    while path.startswith("./"):
+        path = path[2:]
+    return path.strip("/")
+
+
+class SeekableTarReader:
+    def __init__(self, conn: BaseService, object_key, index_key=None):
+        if not conn.SupportsObjectRange():
+            raise ValueError(f"{type(conn).__name__} does not support ranged get")
+        self.conn = conn
+        self.object_key = object_key
+        self.index_key = index_key or object_key + INDEX_SUFFIX
+        content = self.conn.GetObjectRange(self.index_key)
+        if content is None:
+            raise FileNotFoundError(f"missing tar index {self.index_key}")
+        self.index = json.loads(content)
+        self.members = {_NormMemberPath(m["path"]): m for m in self.index["members"]}
+
+    def ListMembers(self):
+        return [path for path, member in self.members.items() if path and member["size"] > 0]
+
+    def ReadMember(self, path, verify=True):
+        """ 读取单个成员的内容，verify为True时校验md5 """
+        member = self.members.get(_NormMemberPath(path))
+        if member is None:
+            raise KeyError(f"{path} not found in {self.object_key}")
+        if member["size"] == 0:
+            return b""
+        data = self.conn.GetObjectRange(self.object_key, member["data_offset"], member["size"])
+        if data is None or len(data) != member["size"]:
+            raise IOError(f"failed to read {path} from {self.object_key}")
+        if verify and member.get("md5") and hashlib.md5(data).hexdigest() != member["md5"]:
+            raise IOError(f"checksum mismatch of {path} in {self.object_key}")
+        return data
+
+    def DownloadMember(self, path, local_path, verify=True):
+        try:
+            data = self.ReadMember(path, verify)
+        except (KeyError, IOError) as e:
+            logging.error(e)
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+        with open(local_path, "wb") as fp:
+            fp.write(data)
+        return True
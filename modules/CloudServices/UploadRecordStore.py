@@ -0,0 +1,46 @@
+"""
+分片上传断点记录
+每个上传一个JSON文件，记录upload_id、源文件大小/mtime/分片大小与已完成分片的etag，
+进程中断后重新上传时据此跳过已完成的分片；先写临时文件再替换，中断不会留下不完整的记录
+"""
+import hashlib
+import json
+import logging
+import os
+
+
+class UploadRecordStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def MakeKey(bucket_name, prefix, local_path):
+        return hashlib.md5(f"{bucket_name}/{prefix}:{os.path.abspath(local_path)}".encode("utf-8")).hexdigest()
+
+    def _File(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def Get(self, key):
+        """ 记录不存在或无法解析时返回None """
+        record_file = self._File(key)
+        if not os.path.exists(record_file):
+            return None
+        try:
+            with open(record_file, "r") as fp:
+                return json.load(fp)
+        except Exception as e:
+            logging.warning(f"failed to load upload record {record_file} : {e}")
+            return None
+
+    def Put(self, key, record):
+        record_file = self._File(key)
+        with open(record_file + ".tmp", "w") as fp:
+            json.dump(record, fp)
+        os.replace(record_file + ".tmp", record_file)
+
+    def Delete(self, key):
+        try:
+            os.remove(self._File(key))
+        except FileNotFoundError:
+            pass
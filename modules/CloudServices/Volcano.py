@@ -1,29 +1,67 @@
 import os
 import logging
+import time
 import tos
 from tos import TosClientV2
 from tos.utils import SizeAdapter
+from tos.models2 import UploadedPart
 from modules.CloudServices.BaseService import BaseService
+from modules.CloudServices.EndpointBalancer import EndpointBalancer, ParseEndpoints
+from modules.CloudServices.MultipartUpload import MultipartUpload
+from util_modules.retry_util import GetRetryPolicy, StatusError
 
 class VolcanoServer(BaseService):
     def __init__(self, endpoint, access_key, secret_key, bucket_name, region):
-        self.client = TosClientV2(
-            endpoint=endpoint,
+        """ endpoint支持list或逗号分隔的多个地址 """
+        endpoints = ParseEndpoints(endpoint)
+        self.clients = [TosClientV2(
+            endpoint=ep,
             region=region,
             ak=access_key,
             sk=secret_key
-        )
+        ) for ep in endpoints]
         self.bucket = bucket_name
         self.part_size = 100 * 1024 * 1024  # 100MB, 分片大小
+        self.balancer = EndpointBalancer(endpoints,
+                                         probe_func=lambda i: self.clients[i].head_bucket(self.bucket) is not None,
+                                         breaker_name="volcano")
+
+    @property
+    def client(self):
+        """ 当前最健康endpoint对应的client，用于list/head等轻量请求，请求结果计入该endpoint的健康统计 """
+        return self.balancer.BestClient(self.clients)
 
     def _MultiUpload(self, prefix, local_path):
+        """ 分片上传，单个分片失败只重试该分片，其余分片继续上传，分片重试耗尽后才中止上传 """
         logging.info(f"分片上传{local_path}")
-        resp = self.client.upload_file(self.bucket, prefix, local_path, task_num=6, part_size=self.part_size)
-        if resp.status_code in (200, 201):
-            return True
-        else:
-            return False
+        return self.CreateMultipartUpload(prefix, local_path).Run()
+
+    def _NewMultipartUpload(self, client, prefix, local_path, on_finish=None):
+        upload_id = client.create_multipart_upload(self.bucket, prefix).upload_id
+
+        def upload_part(part_number, reader, size):
+            return client.upload_part(self.bucket, prefix, upload_id, part_number, content=reader).etag
 
+        def complete(parts):
+            resp = client.complete_multipart_upload(self.bucket, prefix, upload_id,
+                                                    parts=[UploadedPart(n, etag) for n, etag in parts])
+            return resp.status_code in (200, 201)
+
+        def abort():
+            client.abort_multipart_upload(self.bucket, prefix, upload_id)
+
+        return MultipartUpload(local_path, self.part_size, upload_part, complete, abort, workers=6,
+                               breaker=self.balancer.Breaker(self.clients.index(client)),
+                               name=f"tos://{self.bucket}/{prefix}", on_finish=on_finish)
+
+    def _UploadFile(self, client, prefix, local_path, file_size, data=None):
+        if data is None:
+            with open(local_path, "rb") as f:
+                data = f.read()
+        resp = client.put_object(self.bucket, prefix, content=data)
+        if resp.status_code not in (200, 201):
+            raise StatusError(resp.status_code, f"upload {local_path}")
+        return True
 
     def UploadFile(self, prefix, local_path):
         if prefix.startswith('/'):
@@ -32,15 +70,11 @@ class VolcanoServer(BaseService):
         try:
             file_size = os.path.getsize(local_path)
             if file_size > self.part_size:
+                # 分片上传在分片粒度重试，不再整体重试
                 return self._MultiUpload(prefix, local_path)
-            else:
-                with open(local_path, "rb") as f:
-                    data = f.read()
-                resp = self.client.put_object(self.bucket, prefix, content=data)
-                if resp.status_code in (200, 201):
-                    return True
-                else:
-                    return False
+            return GetRetryPolicy().Call(
+                self.balancer.Call, lambda i: self._UploadFile(self.clients[i], prefix, local_path, file_size),
+                nbytes=file_size, pick=self.balancer.PickBreaker, name=f"upload {local_path}")
         except tos.exceptions.TosClientError as e:
             logging.error(f"客户端异常:{e}")
             return False
@@ -51,15 +85,36 @@ class VolcanoServer(BaseService):
             logging.error(f"未知错误:{e}")
             return False
 
+    def UploadData(self, prefix, local_path, data):
+        prefix = prefix.lstrip('/')
+        try:
+            return GetRetryPolicy().Call(
+                self.balancer.Call, lambda i: self._UploadFile(self.clients[i], prefix, local_path, len(data), data),
+                nbytes=len(data), pick=self.balancer.PickBreaker, name=f"upload {local_path}")
+        except Exception as e:
+            logging.error(f"上传失败:{e}")
+            return False
+
+    def CreateMultipartUpload(self, prefix, local_path):
+        file_size = os.path.getsize(local_path)
+        if file_size <= self.part_size:
+            return None
+        return self.balancer.CallDeferred(
+            lambda i, report: self._NewMultipartUpload(self.clients[i], prefix.lstrip('/'), local_path,
+                                                       on_finish=report), nbytes=file_size)
+
     def DownloadFile(self, prefix, local_path):
         logging.info(f"Downloading {local_path} from {prefix}")
         try:
             os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            file_stream = self.client.get_object(self.bucket, prefix)
-            with open(local_path, "wb") as f:
-                for content in file_stream:
-                    f.write(content)
-            return True
+
+            def _download(index):
+                file_stream = self.clients[index].get_object(self.bucket, prefix)
+                with open(local_path, "wb") as f:
+                    for content in file_stream:
+                        f.write(content)
+                return True
+            return self.balancer.Call(_download)
         except tos.exceptions.TosClientError as e:
             logging.error(f"客户端异常:{e}")
             return False
@@ -70,16 +125,32 @@ class VolcanoServer(BaseService):
             logging.error(f"未知错误:{e}")
             return False
 
-    def UploadFolder(self, prefix, local_path):
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        try:
+            if not length and offset == 0:
+                return self.client.get_object(self.bucket, prefix).read()
+            if not length:
+                length = self.client.head_object(self.bucket, prefix).content_length - offset
+            resp = self.client.get_object(self.bucket, prefix, range_start=offset, range_end=offset + length - 1)
+            return resp.read()
+        except tos.exceptions.TosClientError as e:
+            logging.error(f"客户端异常:{e}")
+        except tos.exceptions.TosServerError as e:
+            logging.error(f"服务端异常:{e}")
+        except Exception as e:
+            logging.error(f"未知错误:{e}")
+        return None
+
+    def UploadFolder(self, prefix, local_path, inventory=None):
         try:
+            jobs = []
             for root, _, files in os.walk(local_path):
                 for file in files:
                     local_file_path = os.path.join(root, file)
                     relative_path = os.path.relpath(local_file_path, local_path)
                     remote_path = os.path.normpath(os.path.join(prefix, relative_path))
-                    if not self.UploadFile(remote_path, local_file_path):
-                        return False
-            return True
+                    jobs.append((remote_path, local_file_path))
+            return self._UploadFilesConcurrently(jobs, local_path, inventory)
         except tos.exceptions.TosClientError as e:
             logging.error(f"客户端异常:{e}")
             return False
@@ -146,4 +217,27 @@ class VolcanoServer(BaseService):
             return False
         except Exception as e:
             logging.error(f"未知错误:{e}")
-            return False
\ No newline at end of file
+            return False
+
+    def ListObjects(self, prefix):
+        result = []
+        continuation_token = None
+        try:
+            while True:
+                resp = self.client.list_objects_type2(self.bucket, prefix=prefix, max_keys=1000,
+                                                      continuation_token=continuation_token)
+                for content in resp.contents:
+                    result.append((content.key, content.size, content.etag))
+                if not resp.is_truncated:
+                    break
+                continuation_token = resp.next_continuation_token
+        except tos.exceptions.TosClientError as e:
+            logging.error(f"客户端异常:{e}")
+            return None
+        except tos.exceptions.TosServerError as e:
+            logging.error(f"服务端异常:{e}")
+            return None
+        except Exception as e:
+            logging.error(f"未知错误:{e}")
+            return None
+        return result
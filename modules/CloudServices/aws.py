@@ -1,11 +1,14 @@
 import logging
 
 from .BaseService import BaseService
+from .EndpointBalancer import EndpointBalancer, ParseEndpoints
+from .MultipartUpload import MultipartUpload
+from util_modules.retry_util import GetRetryPolicy
 
 import boto3
 import os
+import time
 from botocore.exceptions import ClientError
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
 
@@ -18,25 +21,43 @@ class AWSService(BaseService):
             bucket_name (str): S3存储桶名称
             aws_access_key_id (str, optional): AWS访问密钥ID
             aws_secret_access_key (str, optional): AWS秘密访问密钥
-            end
+            endpoint_url (str|list, optional): 自定义endpoint，支持list或逗号分隔的多个地址
         """
         self.bucket_name = bucket_name
 
-        # 初始化S3客户端
-        if aws_access_key_id and aws_secret_access_key:
-            self.s3_client = boto3.client(
-                's3',
-                aws_access_key_id=aws_access_key_id,
-                aws_secret_access_key=aws_secret_access_key,
-                endpoint_url=endpoint_url
-            )
-        else:
-            # 使用默认凭证（如环境变量、IAM角色等）
-            self.s3_client = boto3.client('s3', endpoint_url=endpoint_url)
+        # 初始化S3客户端，每个endpoint一个
+        endpoint_urls = ParseEndpoints(endpoint_url) or [None]
+        self.s3_clients = []
+        for url in endpoint_urls:
+            if aws_access_key_id and aws_secret_access_key:
+                self.s3_clients.append(boto3.client(
+                    's3',
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                    endpoint_url=url
+                ))
+            else:
+                # 使用默认凭证（如环境变量、IAM角色等）
+                self.s3_clients.append(boto3.client('s3', endpoint_url=url))
+        self.balancer = EndpointBalancer([url or "default" for url in endpoint_urls],
+                                         probe_func=lambda i: self.s3_clients[i].head_bucket(Bucket=self.bucket_name) is not None,
+                                         breaker_name="s3")
+        self._local = threading.local()
 
         self.max_workers = 4
         self.multipart_chunksize = 100 * 1024 * 1024
 
+    @property
+    def s3_client(self):
+        """
+        当前线程绑定的S3客户端（UploadFile期间固定为balancer选中的endpoint），
+        未绑定时返回当前最健康endpoint对应的客户端，请求结果计入该endpoint的健康统计
+        """
+        index = getattr(self._local, "index", None)
+        if index is None:
+            return self.balancer.BestClient(self.s3_clients)
+        return self.s3_clients[index]
+
     def _get_incomplete_upload(self, prefix):
         """
         获取未完成的分片上传信息
@@ -80,7 +101,7 @@ class AWSService(BaseService):
             return None, []
 
         except Exception as e:
-            print(f"获取未完成上传信息失败: {e}")
+            logging.error(f"获取未完成上传信息失败: {e}")
             return None, []
 
     def _upload_file_multipart(self, prefix, local_path, file_size, chunksize, resume_upload=False):
@@ -97,88 +118,9 @@ class AWSService(BaseService):
         Returns:
             bool: 上传成功返回True，失败返回False
         """
-        upload_id = None
-        existing_parts = []
-
-        try:
-            # 计算分片数量
-            num_parts = (file_size + chunksize - 1) // chunksize
-            print(f"文件将被分成 {num_parts} 个分片上传")
-
-            # 检查是否有未完成的上传
-            if resume_upload:
-                upload_id, existing_parts = self._get_incomplete_upload(prefix)
-                if upload_id:
-                    print(f"找到未完成的上传，UploadId: {upload_id}")
-                    print(f"已上传的分片: {[p['PartNumber'] for p in existing_parts]}")
-                else:
-                    print("未找到未完成的上传，开始新的上传")
-
-            # 如果没有找到未完成的上传，初始化新的分片上传
-            if not upload_id:
-                response = self.s3_client.create_multipart_upload(
-                    Bucket=self.bucket_name,
-                    Key=prefix
-                )
-                upload_id = response['UploadId']
-                print(f"创建新的分片上传，UploadId: {upload_id}")
-
-            # 上传分片
-            parts = existing_parts.copy()  # 复制已上传的分片信息
-            with open(local_path, 'rb') as f:
-                for part_number in range(1, num_parts + 1):
-                    # 检查这个分片是否已经上传
-                    already_uploaded = any(p['PartNumber'] == part_number for p in existing_parts)
-                    if already_uploaded:
-                        print(f"分片 {part_number}/{num_parts} 已上传，跳过")
-                        continue
-
-                    # 定位到分片开始位置
-                    f.seek((part_number - 1) * chunksize)
-
-                    # 读取分片数据
-                    chunk = f.read(chunksize)
-                    if not chunk:
-                        break
-
-                    print(f"上传分片 {part_number}/{num_parts} (大小: {len(chunk)} bytes)")
-
-                    # 上传单个分片
-                    part_response = self.s3_client.upload_part(
-                        Bucket=self.bucket_name,
-                        Key=prefix,
-                        PartNumber=part_number,
-                        UploadId=upload_id,
-                        Body=chunk
-                    )
-
-                    # 保存分片信息
-                    parts.append({
-                        'PartNumber': part_number,
-                        'ETag': part_response['ETag']
-                    })
-
-            # 按PartNumber排序parts
-            parts.sort(key=lambda x: x['PartNumber'])
-
-            # 完成分片上传
-            print("正在完成分片上传...")
-            self.s3_client.complete_multipart_upload(
-                Bucket=self.bucket_name,
-                Key=prefix,
-                UploadId=upload_id,
-                MultipartUpload={'Parts': parts}
-            )
-
-            print("分片上传完成")
-            return True
-
-        except Exception as e:
-            print(f"分片上传失败: {e}")
-            # 不要自动中止上传，以便后续恢复
-            print(f"上传已中断，UploadId: {upload_id}")
-            print("可以使用 resume_upload=True 参数恢复上传")
-            return False
+        # 与并行上传共用MultipartUpload（单个分片失败时按统一重试策略只重试该分片），只使用一个上传线程
+        return self._upload_file_multipart_parallel(prefix, local_path, file_size, chunksize, resume_upload,
+                                                    max_workers=1)
 
     def _upload_file_multipart_parallel(self, prefix, local_path, file_size, chunksize, resume_upload=False, max_workers=5):
         """
@@ -201,16 +143,16 @@ class AWSService(BaseService):
         try:
             # 计算分片数量
             num_parts = (file_size + chunksize - 1) // chunksize
-            print(f"文件将被分成 {num_parts} 个分片上传，使用 {max_workers} 个线程并行上传")
+            logging.info(f"文件将被分成 {num_parts} 个分片上传，使用 {max_workers} 个线程并行上传")
 
             # 检查是否有未完成的上传
             if resume_upload:
                 upload_id, existing_parts = self._get_incomplete_upload(prefix)
                 if upload_id:
-                    print(f"找到未完成的上传，UploadId: {upload_id}")
-                    print(f"已上传的分片: {[p['PartNumber'] for p in existing_parts]}")
+                    logging.info(f"找到未完成的上传，UploadId: {upload_id}")
+                    logging.info(f"已上传的分片: {[p['PartNumber'] for p in existing_parts]}")
                 else:
-                    print("未找到未完成的上传，开始新的上传")
+                    logging.info("未找到未完成的上传，开始新的上传")
 
             # 如果没有找到未完成的上传，初始化新的分片上传
             if not upload_id:
@@ -219,7 +161,7 @@ class AWSService(BaseService):
                     Key=prefix
                 )
                 upload_id = response['UploadId']
-                print(f"创建新的分片上传，UploadId: {upload_id}")
+                logging.info(f"创建新的分片上传，UploadId: {upload_id}")
 
             # 准备需要上传的分片列表
             parts_to_upload = []
@@ -230,7 +172,7 @@ class AWSService(BaseService):
                     parts_to_upload.append(part_number)
 
             if not parts_to_upload:
-                print("所有分片都已上传，直接完成上传")
+                logging.info("所有分片都已上传，直接完成上传")
                 # 所有分片都已上传，直接完成上传
                 parts = existing_parts.copy()
                 parts.sort(key=lambda x: x['PartNumber'])
@@ -240,101 +182,84 @@ class AWSService(BaseService):
                     UploadId=upload_id,
                     MultipartUpload={'Parts': parts}
                 )
-                print("分片上传完成")
+                logging.info("分片上传完成")
+                return True
+
+            logging.info(f"需要上传 {len(parts_to_upload)} 个分片")
+
+            # 分片由预读缓冲池按顺序读入，单个分片失败时只重试该分片，重试耗尽后才中止整个上传
+            upload = self._NewMultipartUpload(self.s3_client, prefix, local_path, upload_id, existing_parts,
+                                              chunksize, max_workers)
+            if upload.Run():
+                logging.info("并行分片上传完成")
                 return True
+            self._local.error = upload.error
+            return False
 
-            print(f"需要上传 {len(parts_to_upload)} 个分片")
-
-            # 使用线程池并行上传
-            parts_lock = threading.Lock()
-            completed_parts = existing_parts.copy()
-            completed_count = 0
-            total_parts = len(parts_to_upload)
-
-            def upload_part(part_number):
-                """上传单个分片"""
-                nonlocal completed_count
-                try:
-                    # 读取分片数据
-                    with open(local_path, 'rb') as f:
-                        f.seek((part_number - 1) * chunksize)
-                        chunk = f.read(chunksize)
-
-                    if not chunk:
-                        return None
-
-                    # 上传分片
-                    part_response = self.s3_client.upload_part(
-                        Bucket=self.bucket_name,
-                        Key=prefix,
-                        PartNumber=part_number,
-                        UploadId=upload_id,
-                        Body=chunk
-                    )
-
-                    # 保存分片信息
-                    with parts_lock:
-                        completed_parts.append({
-                            'PartNumber': part_number,
-                            'ETag': part_response['ETag']
-                        })
-                        completed_count += 1
-                        print(f"完成分片 {part_number}/{num_parts} ({completed_count}/{total_parts})")
-
-                    return part_number
-
-                except Exception as e:
-                    print(f"上传分片 {part_number} 失败: {e}")
-                    return None
-
-            # 使用线程池并行上传
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # 提交所有任务
-                future_to_part = {executor.submit(upload_part, part_num): part_num for part_num in parts_to_upload}
-
-                # 等待所有任务完成
-                for future in as_completed(future_to_part):
-                    part_num = future_to_part[future]
-                    try:
-                        result = future.result()
-                        if result is None:
-                            print(f"分片 {part_num} 上传失败")
-                            raise Exception(f"分片 {part_num} 上传失败")
-                    except Exception as e:
-                        print(f"分片 {part_num} 执行失败: {e}")
-                        # 中止上传
-                        try:
-                            self.s3_client.abort_multipart_upload(
-                                Bucket=self.bucket_name,
-                                Key=prefix,
-                                UploadId=upload_id
-                            )
-                            print("已中止上传")
-                        except:
-                            pass
-                        return False
-
-            # 按PartNumber排序parts
-            completed_parts.sort(key=lambda x: x['PartNumber'])
-
-            # 完成分片上传
-            print("正在完成分片上传...")
-            self.s3_client.complete_multipart_upload(
+        except Exception as e:
+            logging.error(f"并行分片上传失败: {e}")
+            self._local.error = e
+            # 不要自动中止上传，以便后续恢复
+            if upload_id:
+                logging.error(f"上传已中断，UploadId: {upload_id}")
+                logging.error("可以使用 resume_upload=True 参数恢复上传")
+            return False
+
+    def _NewMultipartUpload(self, s3_client, prefix, local_path, upload_id, existing_parts, chunksize, max_workers,
+                            on_finish=None):
+        # 对冲请求优先发往另一个endpoint，只有一个endpoint时使用连接池中的另一个连接
+        index = self.s3_clients.index(s3_client)
+        hedge_client = self.s3_clients[(index + 1) % len(self.s3_clients)]
+
+        def upload_part(part_number, reader, size, client=None):
+            part_response = (client or s3_client).upload_part(
                 Bucket=self.bucket_name,
                 Key=prefix,
+                PartNumber=part_number,
                 UploadId=upload_id,
-                MultipartUpload={'Parts': completed_parts}
+                Body=reader,
+                ContentLength=size
             )
+            return part_response['ETag']
 
-            print("并行分片上传完成")
+        def complete(parts):
+            s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=prefix,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': etag} for n, etag in parts]}
+            )
             return True
 
+        def abort():
+            s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=prefix, UploadId=upload_id)
+
+        return MultipartUpload(local_path, chunksize, upload_part, complete, abort, workers=max_workers,
+                               breaker=self.balancer.Breaker(index),
+                               hedge_part=lambda n, reader, size: upload_part(n, reader, size, hedge_client),
+                               done_parts={p['PartNumber']: p['ETag'] for p in existing_parts},
+                               name=f"s3://{self.bucket_name}/{prefix}", on_finish=on_finish)
+
+    def CreateMultipartUpload(self, prefix, local_path):
+        file_size = os.path.getsize(local_path)
+        if file_size <= self.multipart_chunksize:
+            return None
+
+        def create(index, report):
+            s3_client = self.s3_clients[index]
+            upload_id = s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=prefix)['UploadId']
+            return self._NewMultipartUpload(s3_client, prefix, local_path, upload_id, [], self.multipart_chunksize,
+                                            self.max_workers, on_finish=report)
+        return self.balancer.CallDeferred(create, nbytes=file_size)
+
+    def UploadData(self, prefix, local_path, data):
+        try:
+            return GetRetryPolicy().Call(
+                self.balancer.Call,
+                lambda i: self.s3_clients[i].put_object(Bucket=self.bucket_name, Key=prefix, Body=data) is not None,
+                nbytes=len(data), pick=self.balancer.PickBreaker, name=f"upload {local_path}")
         except Exception as e:
-            print(f"并行分片上传失败: {e}")
-            # 不要自动中止上传，以便后续恢复
-            if upload_id:
-                print(f"上传已中断，UploadId: {upload_id}")
-                print("可以使用 resume_upload=True 参数恢复上传")
+            logging.error(f"上传文件失败: {e}")
             return False
 
     def DownloadFile(self, prefix, local_path):
@@ -366,6 +291,26 @@ class AWSService(BaseService):
             print(f"下载文件时发生错误: {e}")
             return False
 
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        """
+        按字节范围读取S3对象
+
+        Args:
+            prefix (str): S3中的文件路径（键）
+            offset (int): 起始偏移
+            length (int, optional): 读取长度，None表示读取到末尾
+
+        Returns:
+            bytes: 读取的内容，失败返回None
+        """
+        try:
+            byte_range = f"bytes={offset}-{offset + length - 1}" if length else f"bytes={offset}-"
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=prefix, Range=byte_range)
+            return response['Body'].read()
+        except Exception as e:
+            logging.error(f"读取文件时发生错误: {e}")
+            return None
+
     """
     上传单个文件到S3，支持分片上传、断点续传和并行上传
 
@@ -382,6 +327,20 @@ class AWSService(BaseService):
         bool: 上传成功返回True，失败返回False
     """
     def UploadFile(self, prefix, local_path, use_multipart=True, resume_upload=False, parallel_upload=True):
+        file_size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+        index = self.balancer.Pick()
+        self._local.index = index
+        self._local.error = None  # 上传失败的异常，区分endpoint故障与本地/参数错误
+        st = time.time()
+        upload_mark = False
+        try:
+            upload_mark = self._UploadFile(prefix, local_path, use_multipart, resume_upload, parallel_upload)
+        finally:
+            self._local.index = None
+            self.balancer.Report(index, time.time() - st, upload_mark, file_size, self._local.error)
+        return upload_mark
+
+    def _UploadFile(self, prefix, local_path, use_multipart, resume_upload, parallel_upload):
         try:
             # 检查本地文件是否存在
             if not os.path.exists(local_path):
@@ -401,27 +360,33 @@ class AWSService(BaseService):
                     return self._upload_file_multipart(prefix, local_path, file_size, self.multipart_chunksize, resume_upload)
             else:
                 logging.info(f"使用普通上传文件: {local_path} (大小: {file_size} bytes)")
-                # 使用普通上传
-                self.s3_client.upload_file(
+                # 使用普通上传，endpoint已在UploadFile中选定，按该endpoint的熔断器重试
+                GetRetryPolicy().Call(
+                    self.s3_client.upload_file,
                     Filename=local_path,
                     Bucket=self.bucket_name,
-                    Key=prefix
+                    Key=prefix,
+                    breaker=self.balancer.Breaker(self._local.index),
+                    name=f"upload {local_path}"
                 )
                 return True
         except ClientError as e:
             logging.error(f"上传文件失败: {e}")
+            self._local.error = e
             return False
         except Exception as e:
             logging.error(f"上传文件时发生错误: {e}")
+            self._local.error = e
             return False
 
-    def UploadFolder(self, prefix, local_path):
+    def UploadFolder(self, prefix, local_path, inventory=None):
         """
         上传整个文件夹到S3
 
         Args:
             prefix (str): S3中的目标前缀（目录）
             local_path (str): 本地文件夹路径
+            inventory (InventoryCache, optional): 云端对象清单，已存在且大小一致的文件跳过上传
 
         Returns:
             bool: 上传成功返回True，失败返回False
@@ -437,6 +402,7 @@ class AWSService(BaseService):
                 return False
 
             # 遍历文件夹中的所有文件
+            jobs = []
             for root, dirs, files in os.walk(local_path):
                 for file in files:
                     local_file_path = os.path.join(root, file)
@@ -444,14 +410,10 @@ class AWSService(BaseService):
                     # 计算S3中的相对路径
                     relative_path = os.path.relpath(local_file_path, local_path)
                     s3_key = os.path.join(prefix, relative_path).replace('\\', '/')
+                    jobs.append((s3_key, local_file_path))
 
-                    # 上传文件
-                    success = self.UploadFile(s3_key, local_file_path)
-                    if not success:
-                        print(f"上传文件失败: {local_file_path}")
-                        return False
-
-            return True
+            # 提交到全局传输引擎并发上传
+            return self._UploadFilesConcurrently(jobs, local_path, inventory)
         except Exception as e:
             print(f"上传文件夹时发生错误: {e}")
             return False
@@ -566,3 +528,24 @@ class AWSService(BaseService):
         except Exception as e:
             print(f"列出文件时发生错误: {e}")
             return []
+
+    def ListObjects(self, prefix):
+        """
+        递归列出S3中指定前缀下所有对象的元信息
+
+        Args:
+            prefix (str): S3中的前缀（目录）
+
+        Returns:
+            list: [(key, size, etag), ...]，列举失败返回None
+        """
+        result = []
+        try:
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                for obj in page.get('Contents', []):
+                    result.append((obj['Key'], obj['Size'], obj['ETag']))
+        except Exception as e:
+            logging.error(f"列出文件时发生错误: {e}")
+            return None
+        return result
@@ -1,36 +1,164 @@
 from .BaseService import BaseService
+from .EndpointBalancer import EndpointBalancer, ParseEndpoints
+from .MultipartUpload import MultipartUpload
+from .UploadRecordStore import UploadRecordStore
+from util_modules.retry_util import GetRetryPolicy, StatusError
 
 import logging
 import os
-import tqdm
-from obs import ObsClient
+import threading
+import time
+from obs import ObsClient, GetObjectRequest, CompleteMultipartUploadRequest, CompletePart
 
 class ObsServer(BaseService):
-    def __init__(self, ak, sk, endpoint, bucket_name, secure=False):
+    def __init__(self, ak, sk, endpoint, bucket_name, secure=False, output_root=None):
+        """
+        endpoint支持list或逗号分隔的多个地址；
+        output_root : 分片上传断点记录的保存目录，为None时大文件使用SDK自带断点续传的uploadFile顺序上传
+        """
         logging.info(f"set obs client secure as {secure}")
-        self.client = ObsClient(access_key_id=ak, secret_access_key=sk, server=endpoint, is_secure=secure)
+        endpoints = ParseEndpoints(endpoint)
+        self.clients = [ObsClient(access_key_id=ak, secret_access_key=sk, server=ep, is_secure=secure)
+                        for ep in endpoints]
         self.bucket_name = bucket_name
         self.part_size = 100 * 1024 * 1024
+        self.balancer = EndpointBalancer(endpoints,
+                                         probe_func=lambda i: self.clients[i].headBucket(self.bucket_name).status < 300,
+                                         breaker_name="obs")
+        self.store = UploadRecordStore(os.path.join(output_root, "obs_upload_cache")) if output_root else None
+
+    @property
+    def client(self):
+        """ 当前最健康endpoint对应的client，用于list/head等轻量请求，请求结果计入该endpoint的健康统计 """
+        return self.balancer.BestClient(self.clients)
 
     def UploadFile(self, prefix, local_path):
         logging.info(f"Uploading {local_path} to {prefix}")
         try:
-            resp = self.client.uploadFile(self.bucket_name, prefix, local_path, self.part_size,
-                                          4, True)
-            if resp.status < 300:
-                return True
+            if self.store is not None and os.path.getsize(local_path) > self.part_size:
+                return self._MultipartUpload(prefix, local_path)
+            return GetRetryPolicy().Call(self._UploadFileOnce, prefix, local_path, pick=self.balancer.PickBreaker,
+                                         name=f"upload {local_path}")
+        except Exception as e:
+            logging.error(f"上传失败：{e}")
+            return False
+
+    def _UploadFileOnce(self, prefix, local_path, index=None):
+        upload_mark = False
+        error = None
+        file_size = 0
+        index = self.balancer.Pick(index=index)
+        st = time.time()
+        try:
+            file_size = os.path.getsize(local_path)
+            if file_size > self.part_size:
+                # 没有断点记录目录时使用SDK的分片上传，断点记录在源文件旁（enableCheckpoint）
+                resp = self.clients[index].uploadFile(self.bucket_name, prefix, local_path, self.part_size, 4, True)
             else:
+                resp = self.clients[index].putFile(self.bucket_name, prefix, local_path)
+            if resp.status >= 300:
                 logging.error(f"upload {local_path} failed, return code = {resp.status}")
+                raise StatusError(resp.status, f"upload {local_path}")
+            upload_mark = True
+            return True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.balancer.Report(index, time.time() - st, upload_mark, file_size, error)
+
+    def UploadData(self, prefix, local_path, data):
+        def put(index):
+            resp = self.clients[index].putContent(self.bucket_name, prefix, content=data)
+            if resp.status >= 300:
+                raise StatusError(resp.status, f"upload {local_path}")
+            return True
+
+        try:
+            return GetRetryPolicy().Call(self.balancer.Call, put, nbytes=len(data), pick=self.balancer.PickBreaker,
+                                         name=f"upload {local_path}")
         except Exception as e:
             logging.error(f"上传失败：{e}")
+            return False
 
-        return False
+    def CreateMultipartUpload(self, prefix, local_path):
+        file_size = os.path.getsize(local_path)
+        if self.store is None or file_size <= self.part_size:
+            return None
+
+        def create(index, report):
+            upload = self._NewMultipartUpload(self.clients[index], prefix, local_path, on_finish=report)
+            if upload is None:
+                raise ConnectionError(f"initiate multipart upload of {local_path} failed")
+            return upload
+        return self.balancer.CallDeferred(create, nbytes=file_size)
+
+    def _NewMultipartUpload(self, client, prefix, local_path, on_finish=None):
+        """
+        初始化分片上传失败时返回None；upload_id与已完成分片记录在UploadRecordStore中，
+        中断后重新上传时跳过已完成的分片，上传完成或中止后删除记录
+        """
+        file_size = os.path.getsize(local_path)
+        mtime = os.path.getmtime(local_path)
+        store_key = self.store.MakeKey(self.bucket_name, prefix, local_path)
+        record = self.store.Get(store_key)
+        if (record is None or record.get("size") != file_size or record.get("mtime") != mtime
+                or record.get("part_size") != self.part_size):
+            resp = client.initiateMultipartUpload(self.bucket_name, prefix)
+            if resp.status >= 300:
+                logging.error(f"initiate multipart upload of {local_path} failed, return code = {resp.status}")
+                return None
+            record = {"upload_id": resp.body.uploadId, "size": file_size, "mtime": mtime,
+                      "part_size": self.part_size, "parts": {}}
+            self.store.Put(store_key, record)
+        else:
+            logging.info(f"resume multipart upload of {local_path}, {len(record['parts'])} parts already uploaded")
+        upload_id = record["upload_id"]
+        record_lock = threading.Lock()
+
+        def upload_part(part_number, reader, size):
+            resp = client.uploadPart(self.bucket_name, prefix, part_number, upload_id, object=reader,
+                                     partSize=size)
+            if resp.status >= 300:
+                raise StatusError(resp.status, f"upload part {part_number} of {local_path}")
+            return resp.body.etag
+
+        def on_part_done(part_number, etag):
+            with record_lock:
+                record["parts"][str(part_number)] = etag
+                self.store.Put(store_key, record)
+
+        def complete(parts):
+            resp = client.completeMultipartUpload(self.bucket_name, prefix, upload_id, CompleteMultipartUploadRequest(
+                parts=[CompletePart(partNum=n, etag=etag) for n, etag in parts]))
+            if resp.status >= 300:
+                raise StatusError(resp.status, f"complete multipart upload of {local_path}")
+            self.store.Delete(store_key)
+            return True
+
+        def abort():
+            self.store.Delete(store_key)
+            client.abortMultipartUpload(self.bucket_name, prefix, upload_id)
+
+        return MultipartUpload(local_path, self.part_size, upload_part, complete, abort, workers=4,
+                               breaker=self.balancer.Breaker(self.clients.index(client)),
+                               done_parts={int(n): etag for n, etag in record["parts"].items()},
+                               on_part_done=on_part_done, name=f"obs://{self.bucket_name}/{prefix}",
+                               on_finish=on_finish)
+
+    def _MultipartUpload(self, prefix, local_path):
+        """
+        大文件分片上传，单个分片失败只重试该分片，其余分片继续上传，分片重试耗尽后才中止上传；
+        中断后重新上传时跳过已完成的分片
+        """
+        return self.CreateMultipartUpload(prefix, local_path).Run()
 
     def DownloadFile(self, prefix, local_path):
         logging.info(f"Downloading {local_path} from {prefix}")
         try:
-            resp = self.client.downloadFile(self.bucket_name, prefix, local_path, self.part_size,
-                                            4, True)
+            resp = self.balancer.Call(lambda i: self.clients[i].downloadFile(self.bucket_name, prefix, local_path,
+                                                                             self.part_size, 4, True),
+                                      is_ok=lambda r: r.status < 300)
             if resp.status < 300:
                 return True
             else:
@@ -39,15 +167,27 @@ class ObsServer(BaseService):
             logging.error(e)
         return False
 
-    def UploadFolder(self, prefix, local_path):
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        try:
+            byte_range = f"{offset}-{offset + length - 1}" if length else f"{offset}-"
+            resp = self.client.getObject(self.bucket_name, prefix, getObjectRequest=GetObjectRequest(range=byte_range),
+                                         loadStreamInMemory=True)
+            if resp.status < 300:
+                return resp.body.buffer
+            logging.error(f"get {prefix} failed, return code = {resp.status}")
+        except Exception as e:
+            logging.error(e)
+        return None
+
+    def UploadFolder(self, prefix, local_path, inventory=None):
         logging.info(f"Uploading {local_path} to {prefix}")
+        jobs = []
         for root, _, files in os.walk(local_path):
-            for file in tqdm(files, desc="上传进度"):
+            for file in files:
                 local_file_path = os.path.join(root, file)
                 object_name = os.path.normpath(os.path.join(prefix, os.path.relpath(local_file_path, local_path)))
-                if not self.UploadFile(object_name, local_file_path):
-                    return False
-        return True
+                jobs.append((object_name, local_file_path))
+        return self._UploadFilesConcurrently(jobs, local_path, inventory)
 
     def DownloadFolder(self, prefix, local_path):
         os.makedirs(local_path, exist_ok=True)
@@ -79,4 +219,23 @@ class ObsServer(BaseService):
                 all_files.append(content.key)
         except Exception as e:
             logging.error(e)
-        return all_files
\ No newline at end of file
+        return all_files
+
+    def ListObjects(self, prefix):
+        result = []
+        marker = None
+        try:
+            while True:
+                resp = self.client.listObjects(self.bucket_name, prefix, marker=marker, max_keys=1000)
+                if resp.status >= 300:
+                    logging.error(f"list {prefix} failed, return code = {resp.status}")
+                    return None
+                for content in resp.body.contents:
+                    result.append((content.key, content.size, content.etag))
+                if not resp.body.is_truncated:
+                    break
+                marker = resp.body.next_marker
+        except Exception as e:
+            logging.error(e)
+            return None
+        return result
@@ -1,30 +1,47 @@
 import logging
 import os, sys
+import threading
+import time
 import oss2
 from oss2 import ResumableStore
 
 from modules.CloudServices.BaseService import BaseService
+from modules.CloudServices.EndpointBalancer import EndpointBalancer, ParseEndpoints
+from modules.CloudServices.MultipartUpload import MultipartUpload
+from util_modules.retry_util import GetRetryPolicy, StatusError
 from util_modules.log_util import *
 
 class OSSServer(BaseService):
     def __init__(self, access_key, secret_key, bucket_name, end_point, output_root):
+        """ end_point支持list或逗号分隔的多个地址（如内网+外网endpoint） """
         self.auth = oss2.Auth(access_key, secret_key)
-        self.end_point = end_point
+        self.end_points = ParseEndpoints(end_point)
         self.bucket_name = bucket_name
-        self.bucket = oss2.Bucket(self.auth, self.end_point, self.bucket_name, connect_timeout=60)
+        self.buckets = [self._CreateBucket(ep) for ep in self.end_points]
+        self.balancer = EndpointBalancer(self.end_points,
+                                         probe_func=lambda i: self.check_bucket_lightweight(i)[0],
+                                         breaker_name="oss")
         self.part_size = 100 * 1024 * 1024
         self.store = ResumableStore(output_root, 'oss_upload_cache')
-        self.max_retry_times = 3
 
-    def check_bucket_lightweight(self):
+    def _CreateBucket(self, end_point):
+        return oss2.Bucket(self.auth, end_point, self.bucket_name, connect_timeout=60)
+
+    @property
+    def bucket(self):
+        """ 当前最健康endpoint对应的bucket，用于list/head等轻量请求，请求结果计入该endpoint的健康统计 """
+        return self.balancer.BestClient(self.buckets)
+
+    def check_bucket_lightweight(self, index=None):
         """
         更轻量级的连接检测
         尝试对一个临时文件进行HEAD请求
         """
+        bucket = self.bucket if index is None else self.buckets[index]
         try:
             # 尝试获取不存在的对象的元信息（会返回404，但能测试连接）
             # 或者使用更简单的方法：尝试获取Bucket的访问权限
-            self.bucket.get_bucket_acl()
+            bucket.get_bucket_acl()
             return True, "连接正常"
         except oss2.exceptions.NoSuchBucket:
             return False, "Bucket不存在"
@@ -40,53 +57,136 @@ class OSSServer(BaseService):
     eg. /data/20250418_102938.bag --> /cloud_data/20250418_102938.bag
     """
     def UploadFile(self, prefix, local_path):
+        try:
+            if os.path.getsize(local_path) > self.part_size:
+                return self._MultipartUpload(prefix, local_path)
+            return GetRetryPolicy().Call(self._UploadFileOnce, prefix, local_path, pick=self.balancer.PickBreaker,
+                                         name=f"upload {local_path}")
+        except Exception as e:
+            logging.error(f"上传失败：{e}")
+            return False
+
+    def _Reconnect(self, index):
+        """ 网络异常后检测连接，不可用时重建bucket """
+        conn_status, desc = self.check_bucket_lightweight(index)
+        if not conn_status:
+            self.buckets[index] = self._CreateBucket(self.end_points[index])
+
+    def _UploadFileOnce(self, prefix, local_path, data=None, index=None):
+        """ 单次上传小文件，失败抛出异常，由重试策略决定是否重试；data为已读入的文件内容，index为PickBreaker选定的endpoint """
+        index = self.balancer.Pick(index=index)
+        bucket = self.buckets[index]
+        file_size = 0
         upload_mark = False
-        for _ in range(self.max_retry_times):
+        error = None
+        st = time.time()
+        try:
+            logging.info(f"Uploading {local_path} to {prefix} via {self.end_points[index]}")
+            if data is None:
+                with open(local_path, "rb") as f:
+                    data = f.read()
+            file_size = len(data)
+            res = bucket.put_object(prefix, data)
+            if res.status not in (200, 201):
+                raise StatusError(res.status, f"upload {local_path}")
+            logging.info(f"文件{local_path}上传成功")
+            upload_mark = True
+            return True
+        except (oss2.exceptions.RequestError, ConnectionError) as e:
+            error = e
+            self._Reconnect(index)
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.balancer.Report(index, time.time() - st, upload_mark, file_size, error)
+
+    def UploadData(self, prefix, local_path, data):
+        try:
+            return GetRetryPolicy().Call(self._UploadFileOnce, prefix, local_path, data, pick=self.balancer.PickBreaker,
+                                         name=f"upload {local_path}")
+        except Exception as e:
+            logging.error(f"上传失败：{e}")
+            return False
+
+    def CreateMultipartUpload(self, prefix, local_path):
+        file_size = os.path.getsize(local_path)
+        if file_size <= self.part_size:
+            return None
+        return self.balancer.CallDeferred(
+            lambda i, report: self._NewMultipartUpload(i, prefix, local_path, on_finish=report), nbytes=file_size)
+
+    def _NewMultipartUpload(self, index, prefix, local_path, on_finish=None):
+        """
+        upload_id与已完成分片记录在ResumableStore中，中断后重新上传时跳过已完成的分片，上传完成后删除记录
+        """
+        file_size = os.path.getsize(local_path)
+        store_key = self.store.make_store_key(self.bucket_name, prefix, os.path.abspath(local_path))
+        record = self.store.get(store_key)
+        mtime = os.path.getmtime(local_path)
+        if (record is None or record.get("size") != file_size or record.get("mtime") != mtime
+                or record.get("part_size") != self.part_size):
+            upload_id = self.buckets[index].init_multipart_upload(prefix).upload_id
+            record = {"upload_id": upload_id, "size": file_size, "mtime": mtime, "part_size": self.part_size,
+                      "parts": {}}
+            self.store.put(store_key, record)
+        upload_id = record["upload_id"]
+        record_lock = threading.Lock()
+
+        def upload_part(part_number, reader, size, bucket_index=index):
             try:
-                file_size = os.path.getsize(local_path)
-                logging.info(f"Uploading {local_path} to {prefix}")
-                # 上传
-                if file_size > self.part_size:
-                    res = oss2.resumable_upload(
-                        self.bucket,
-                        prefix,
-                        local_path,
-                        part_size=self.part_size,
-                        store=self.store,
-                        num_threads=4
-                    )
-                else:
-                    with open(local_path, "rb") as f:
-                        data = f.read()
-                    res = self.bucket.put_object(prefix, data)
-
-                # 检查
-                if res.status in (200, 201):
-                    logging.info(f"文件{local_path}上传成功")
-                    upload_mark = True
-            except Exception as e:
-                logging.error(f"上传失败：{e}")
-                conn_status, desc = self.check_bucket_lightweight()
-                if not conn_status:
-                    self.bucket = oss2.Bucket(self.auth, self.end_point, self.bucket_name, connect_timeout=60)
-            if upload_mark:
-                break
+                return self.buckets[bucket_index].upload_part(prefix, upload_id, part_number, reader).etag
+            except (oss2.exceptions.RequestError, ConnectionError):
+                self._Reconnect(bucket_index)
+                raise
+
+        def hedge_part(part_number, reader, size):
+            # 对冲请求优先发往另一个endpoint
+            return upload_part(part_number, reader, size, (index + 1) % len(self.buckets))
 
+        def on_part_done(part_number, etag):
+            with record_lock:
+                record["parts"][str(part_number)] = etag
+                self.store.put(store_key, record)
+
+        def complete(parts):
+            res = self.buckets[index].complete_multipart_upload(
+                prefix, upload_id, [oss2.models.PartInfo(n, etag) for n, etag in parts])
+            if res.status in (200, 201):
+                self.store.delete(store_key)
+                return True
+            return False
+
+        def abort():
+            self.store.delete(store_key)
+            self.buckets[index].abort_multipart_upload(prefix, upload_id)
+
+        return MultipartUpload(local_path, self.part_size, upload_part, complete, abort, workers=4,
+                               breaker=self.balancer.Breaker(index),
+                               done_parts={int(n): etag for n, etag in record["parts"].items()},
+                               on_part_done=on_part_done, name=f"oss://{self.bucket_name}/{prefix}",
+                               hedge_part=hedge_part, on_finish=on_finish)
+
+    def _MultipartUpload(self, prefix, local_path):
+        """ 大文件分片上传，单个分片失败只重试该分片，中断后重新上传时跳过已完成的分片 """
+        upload_mark = self.CreateMultipartUpload(prefix, local_path).Run()
+        if upload_mark:
+            logging.info(f"文件{local_path}上传成功")
         return upload_mark
 
     """
     eg. /data/20250418_102938 --> /cloud_data/20250418_102938
     """
-    def UploadFolder(self, prefix, local_path):
-        success = True
+    def UploadFolder(self, prefix, local_path, inventory=None):
+        jobs = []
         for root, _, files in os.walk(local_path):
             for file in files:
                 local_file_path = os.path.join(root, file)
                 relative_path = os.path.relpath(local_file_path, local_path)
                 oss_path = os.path.join(prefix, relative_path).replace("\\", "/")
-                if not self.UploadFile(oss_path, local_file_path):
-                    success = False
-        return success
+                jobs.append((oss_path, local_file_path))
+        return self._UploadFilesConcurrently(jobs, local_path, inventory)
 
     """
     eg. /cloud_data/20250418_102938.bag --> /data/20250418_102938.bag
@@ -95,12 +195,21 @@ class OSSServer(BaseService):
         logging.info(f"Downloading {local_path} from {prefix}")
         try:
             os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            self.bucket.get_object_to_file(prefix, local_path)
+            self.balancer.Call(lambda i: self.buckets[i].get_object_to_file(prefix, local_path),
+                               is_ok=lambda _: True)
             return True
         except Exception as e:
             logging.error(f"文件下载失败: {e}")
             return False
 
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        try:
+            byte_range = (offset, offset + length - 1 if length else None)
+            return self.bucket.get_object(prefix, byte_range=byte_range).read()
+        except Exception as e:
+            logging.error(f"读取失败: {e}")
+            return None
+
     """
     eg. /cloud_data/20250418_102938 --> /data/20250418_102938
     """
@@ -120,3 +229,15 @@ class OSSServer(BaseService):
     def ListFiles(self, prefix, recursive=False):
         logging.error("fake function") # FIXME
         return []
+
+    def ListObjects(self, prefix):
+        result = []
+        try:
+            for obj in oss2.ObjectIterator(self.bucket, prefix=prefix):
+                if obj.key.endswith("/"):  # 忽略目录对象
+                    continue
+                result.append((obj.key, obj.size, obj.etag))
+        except Exception as e:
+            logging.error(f"列举文件失败: {e}")
+            return None
+        return result
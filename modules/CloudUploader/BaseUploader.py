@@ -6,6 +6,7 @@ from enum import IntEnum
 from dataclasses import dataclass
 import concurrent.futures
 import threading
+import time
 from typing import Dict, List
 
 from util_modules.taskInfo_util import SimpleTaskInfoUtil
@@ -13,7 +14,24 @@ from util_modules.log_util import *
 from util_modules.platform_util import *
 from util_modules.UploadTracker import *
 from util_modules.loctime_util import *
+from util_modules.TransferEngine import InitTransferEngine, GetTransferEngine, PRIORITY_METADATA, PRIORITY_SMALL, \
+    PRIORITY_BULK, DEFAULT_METADATA_PATTERNS
+from util_modules.AimdController import AimdController
+from util_modules.retry_util import InitRetryPolicy, RetryMetrics
+from modules.CloudServices.MultipartUpload import InitHedgePolicy, DisableHedgePolicy, GetHedgePolicy
+from util_modules.Reclaimer import InitReclaimer
+from util_modules.StagingBudget import GetStagingBudget, StagingTicket
+from util_modules.ProcessSettings import AcquireProcessSetting, ReleaseProcessSetting
+from util_modules.DirectoryWatcher import DirectoryWatcher
+from util_modules.disk_util import InitReadLimiter, GetReadLimiter, SortByLayout
+from util_modules.PrefetchPool import PrefetchMetrics
+from util_modules.tar_util import PackSmallFiles, INDEX_SUFFIX, DONE_SUFFIX
+from util_modules.codec_util import ProbeFolder, CodecLevel
+from util_modules.CpuPool import InitCpuPool, GetCpuPool
+from util_modules.LeaseStore import LeaseStore, LEASE_CLAIMED, LEASE_BUSY
 from modules.CloudServices.CSFactory import CSFactory
+from modules.CloudServices.InventoryCache import InventoryCache
+from modules.CloudServices.FanoutService import FanoutService
 
 """ --------------------------------------------------------------------------------------------------------- """
 
@@ -30,6 +48,7 @@ class FileInfo:
         self.size = 0
         self.remove_after_upload = False
         self.compress_before_upload = False
+        self.priority = None # 传输优先级（PRIORITY_*），为None时按文件名与大小判断
 
 class PackageInfo:
     def __init__(self):
@@ -47,6 +66,8 @@ class PackageInfo:
         self.data_type = None # 如果存在有先使用此处标识的数据类型，用于混合数据上传
 
         self.mq_msg = None # for gac
+        self.codec_info = [] # 压缩格式自动选择的结果，compress_codec=auto时记录
+        self.replica_targets = None # 多目标上传时主目标已上传成功、只需补传的副本目标名称
 
     def ToReqjson(self, tenant_id, app_id, data_type):
         fake_name = os.path.basename(self.file_list[0].abs_path)
@@ -73,6 +94,8 @@ class PackageInfo:
             "sn": sn,
             "taskId": self.task_id
         }
+        if len(self.codec_info) > 0:
+            msg["codec"] = self.codec_info
         if add_header:
             return {"log@customer": msg}
         else:
@@ -81,6 +104,12 @@ class PackageInfo:
 """ --------------------------------------------------------------------------------------------------------- """
 
 class BaseUploader:
+    # 监听模式下上传器自己写入数据包目录的文件（如batch.txt），这些文件的变化不影响拷贝完成的判断
+    WATCH_IGNORE_NAMES = ()
+    # ListInputPackages可以重复调用（每次按当前硬盘内容重新生成数据包）时，监听模式才能边拷贝边上传，
+    # 否则等待全部数据拷贝完成后再上传
+    WATCH_RESCAN_SAFE = True
+
     def __init__(self, task_info_file, run_mode, sn):
         self.sn = sn
         self.cloud_type = None # 对象存储类型
@@ -89,6 +118,7 @@ class BaseUploader:
         self.app_id = None
         self.task_info = None
         self.tracker = None
+        self.process_settings = [] # 本任务登记使用的进程级配置，Run结束时释放
 
         self._Init(task_info_file, run_mode)
 
@@ -98,38 +128,57 @@ class BaseUploader:
 
         self.callback_engine = None
         self.progress_bar = None
+        self.watching = False # 监听模式下数据仍在拷贝，ListInputPackages可据此跳过只需在最后执行一次的操作
+        self.submitted_keys = set() # 监听模式下已提交上传的数据包key，ListInputPackages重新扫描时不能改写这些数据包引用的文件
+        self.lock = threading.Lock()
+        self.codec_cpu_seconds_saved = 0.0 # 自动选择压缩格式节省的CPU时间与字节数（相对全部使用gzip）
+        self.codec_bytes_saved = 0
+        self.busy_groups = [] # 多机协同上传时被其他上传进程领取、尚未完成的分组
+        self.fanout_conn = None # 配置了fanout_targets时同时上传到多个目标的连接
+        self.staged_tickets = [] # 仍保留在打包目录中的暂存文件（上传失败的归档、公共部分归档）的额度，清理打包目录后释放
 
     def _CleanUpTarRoot(self):
-        if os.path.exists(os.path.join(self.task_info.output_root, "tar_root")):
-            RemoveLocalFile(os.path.join(self.task_info.output_root, "tar_root"))
+        with self.lock:
+            tickets, self.staged_tickets = self.staged_tickets, []
+        self.reclaimer.Remove(os.path.join(self.task_info.output_root, "tar_root"),
+                              callback=lambda: [self.staging_budget.Release(ticket) for ticket in tickets])
 
     def Run(self):
-        logging.info(f"> {'-' * 15} \033[34m 开始执行上传脚本 \033[0m {'-' * 15} <")
-        # 命令行获取硬盘数据大小
-        cmd = f"du -sb {self.task_info.input_root} | cut -f1"
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        disk_file_size = int(result.stdout.strip())
-        logging.info(f"|{'-' * 12} 当前硬盘数据大小:{disk_file_size / pow(1024, 3)}GB")
+        try:
+            return self._Run()
+        finally:
+            # 异常退出时同样清理保留的暂存文件，常驻进程中共享的暂存额度不会被一直占用
+            if len(self.staged_tickets) > 0:
+                self._CleanUpTarRoot()
+            self._ReleaseProcessSettings()
 
+    def _Run(self):
+        logging.info(f"> {'-' * 15} \033[34m 开始执行上传脚本 \033[0m {'-' * 15} <")
         self._CleanUpTarRoot()
 
-        groups = self.ListInputPackages()
-        if len(groups) == 0:
-            logging.error(f"找不到需要上传的数据，退出上传")
-            return UploadRC.MISSING_FILE
-        logging.info(f"|{'-' * 12} 检测出需要上传的数据大小为:{self.input_files_size / pow(1024, 3)}GB")
-        self.progress_bar = ProgressManager(self.input_files_size)
+        if str(self.task_info.tags.get("watch_mode", "0")) == "1":
+            # 监听模式：数据仍在拷贝时启动，拷贝完成的数据包立即上传
+            self.progress_bar = ProgressManager(0)
+            self.InitCallbackFunction(self.task_info.tags["upload_log_topic"])
+            rt = self._WatchProcess()
+            # 已上传并删除的数据计入硬盘数据大小，剩余数据大小的统计与非监听模式一致
+            disk_file_size = self._GetDiskFileSize() + sum(
+                file_info.size for package_info in self.package_map.values() if package_info.desc == "success"
+                for file_info in package_info.file_list if file_info.remove_after_upload)
+            if rt == UploadRC.MISSING_FILE:
+                return rt
+        else:
+            disk_file_size = self._GetDiskFileSize()
+            groups = self.ListInputPackages()
+            if len(groups) == 0:
+                logging.error(f"找不到需要上传的数据，退出上传")
+                return UploadRC.MISSING_FILE
+            logging.info(f"|{'-' * 12} 检测出需要上传的数据大小为:{self.input_files_size / pow(1024, 3)}GB")
+            self.progress_bar = ProgressManager(self.input_files_size)
 
-        self.InitCallbackFunction(self.task_info.tags["upload_log_topic"])
+            self.InitCallbackFunction(self.task_info.tags["upload_log_topic"])
 
-        rt = self._UploadProcess(groups)
+            rt = self._UploadProcess(groups)
 
         self._WriteUploadRecords(disk_file_size)
 
@@ -139,9 +188,27 @@ class BaseUploader:
         logging.info(f"> {'-' * 15} \033[34m 上传脚本运行完成, return code = {rt} \033[0m {'-' * 15} <")
 
         self._CleanUpTarRoot()
+        # 退出前等待后台删除完成，未完成的部分下次启动时继续删除
+        logging.info(f"等待后台删除本地数据：{self.reclaimer.Metrics()}")
+        self.reclaimer.Drain()
 
         return int(rt)
 
+    def _GetDiskFileSize(self):
+        # 命令行获取硬盘数据大小
+        cmd = f"du -sb {self.task_info.input_root} | cut -f1"
+        result = subprocess.run(
+            cmd,
+            shell=True,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        disk_file_size = int(result.stdout.strip())
+        logging.info(f"|{'-' * 12} 当前硬盘数据大小:{disk_file_size / pow(1024, 3)}GB")
+        return disk_file_size
+
     def _Init(self, task_info_file, run_mode):
         self.task_info = SimpleTaskInfoUtil(task_info_file)
         # init log
@@ -175,12 +242,134 @@ class BaseUploader:
         local_db_root = "/tmp/cloud_upload_records"
         os.makedirs(local_db_root, exist_ok=True)
         local_data_base_file = os.path.join(local_db_root, f"{self.source_type}.db")
-        self.tracker = UploadTracker(local_data_base_file)
+        self.tracker = GetUploadTracker(local_data_base_file)
+
+        # 本地文件（上传后删除的数据、打包目录）由后台线程限速删除，回收目录与输出目录在同一文件系统
+        self.reclaimer = InitReclaimer(os.path.join(self.task_info.output_root, ".reclaim"),
+                                       workers=int(self.task_info.tags.get("reclaim_workers", 2)),
+                                       max_ops_per_sec=int(self.task_info.tags.get("reclaim_ops_per_sec", 2000)))
+
+        # 打包/压缩前按预估大小申请暂存空间额度，额度在暂存文件上传并删除后释放；
+        # 常驻进程中输出目录在同一文件系统的任务共享同一份额度
+        reserve_bytes = self.task_info.tags.get("staging_reserve_bytes")
+        self.staging_budget = GetStagingBudget(self.task_info.output_root,
+                                               reserve_bytes=int(reserve_bytes) if reserve_bytes is not None else None)
+
+        # 按块设备分别限制读取并发与带宽，运行中根据读取延迟自动调整
+        InitReadLimiter(hdd_readers=int(self.task_info.tags.get("hdd_readers", 2)),
+                        ssd_readers=int(self.task_info.tags.get("ssd_readers", 8)))
+
+        tags = self.task_info.tags
+        # 多机协同上传：多个上传进程共享同一个input_root时，每个分组上传前在共享数据库中领取租约
+        self.lease_store = None
+        if tags.get("coord_db"):
+            self.lease_store = LeaseStore(tags["coord_db"], lease_seconds=float(tags.get("coord_lease_seconds", 300)))
+            logging.info(f"多机协同上传：租约数据库={tags['coord_db']}，持有者={self.lease_store.owner}")
+
+        # CPU密集阶段（压缩、元数据解析）交给进程池，网络I/O仍在线程中，多核机器上不再受GIL限制
+        if tags.get("cpu_stage_mode", "thread") == "process":
+            cpu_processes = tags.get("cpu_processes")
+            InitCpuPool(workers=int(cpu_processes) if cpu_processes else None)
+
+        # 重试策略、分片对冲与全局传输引擎是进程级配置，常驻进程中与正在运行的任务配置不一致时拒绝本任务
+        self._AcquireProcessSettings()
         logging.info(f"red bucket name = {self.task_info.tags['red_bucket_name']}, yellow_bucket_name = {self.task_info.tags['yellow_bucket_name']}")
 
+    def _AcquireProcessSettings(self):
+        tags = self.task_info.tags
+        # 统一重试策略：退避重试、整个运行的重试预算，以及每个后端的熔断器（熔断期间暂停请求而不是判定失败）
+        retry_config = dict(max_attempts=int(tags.get("retry_max_attempts", 3)),
+                            budget_ratio=float(tags.get("retry_budget_ratio", 0.2)),
+                            failure_threshold=int(tags.get("circuit_failure_threshold", 5)),
+                            open_seconds=float(tags.get("circuit_open_seconds", 30)),
+                            max_pause_seconds=float(tags.get("circuit_max_pause_seconds", 3600)))
+
+        # 分片对冲（默认关闭）：分片耗时超过近期高分位时重复发送该分片，先成功者生效
+        hedge_config = None
+        if str(tags.get("hedge_parts", "0")) == "1":
+            hedge_config = dict(percentile=float(tags.get("hedge_percentile", 95)),
+                                max_ratio=float(tags.get("hedge_max_ratio", 0.05)))
+
+        # 全局传输引擎：所有分组、数据包与文件夹共享同一个并发上限
+        # 默认从较低并发起步，根据实测吞吐、耗时与失败自动调节在途任务数，transfer_max_inflight为上限
+        # 元数据/小文件/大文件三个优先级，各自保留一部分并发，排队超时的任务不再让位
+        metadata_patterns = tags.get("metadata_patterns")
+        transfer_config = dict(
+            max_inflight=int(tags.get("transfer_max_inflight", 64)),
+            max_large_inflight=int(tags.get("transfer_max_large_inflight", 4)),
+            reserved_shares=tuple(float(x) for x in str(tags.get("transfer_reserved_shares", "0.1,0.1,0.25")).split(",")),
+            starvation_seconds=float(tags.get("transfer_starvation_seconds", 30)),
+            metadata_patterns=tuple(x.strip() for x in metadata_patterns.split(",")) if metadata_patterns
+            else DEFAULT_METADATA_PATTERNS)
+        autotune = str(tags.get("transfer_autotune", "1")) != "0"
+        initial_inflight = int(tags.get("transfer_initial_inflight", 4))
+
+        def ApplyTransfer():
+            # 同时运行的任务配置相同，共享引擎与调节器；引擎空闲时按本任务的配置重新创建调节器
+            controller = AimdController(initial_limit=initial_inflight, max_limit=transfer_config["max_inflight"]) \
+                if autotune else None
+            InitTransferEngine(controller=controller, **transfer_config)
+
+        settings = [
+            ("retry", retry_config, lambda: InitRetryPolicy(**retry_config)),
+            ("hedge", hedge_config, lambda: InitHedgePolicy(**hedge_config) if hedge_config else DisableHedgePolicy()),
+            ("transfer", dict(transfer_config, autotune=autotune, initial_inflight=initial_inflight), ApplyTransfer)]
+        try:
+            for name, config, apply in settings:
+                AcquireProcessSetting(name, config, apply)
+                self.process_settings.append(name)
+        except Exception:
+            self._ReleaseProcessSettings()
+            raise
+        self.transfer_controller = GetTransferEngine().controller
+
+    def _ReleaseProcessSettings(self):
+        while self.process_settings:
+            ReleaseProcessSetting(self.process_settings.pop())
+
+    def _GroupDevice(self, group):
+        """ 分组第一个文件所在的块设备，找不到文件时返回None """
+        for id in group:
+            for file_info in self.package_map[id].file_list:
+                try:
+                    return os.stat(file_info.abs_path).st_dev
+                except (OSError, TypeError):
+                    continue
+        return None
+
+    def _InterleaveGroupsByDevice(self, groups):
+        """ 多个输入盘时按设备轮流排列分组，使并发执行的分组分散在各个盘上，而不是先读完一个盘再读下一个 """
+        device_groups = {}
+        for group in groups:
+            device_groups.setdefault(self._GroupDevice(group), []).append(group)
+        if len(device_groups) <= 1:
+            return groups
+        logging.info(f"输入数据分布在{len(device_groups)}个设备上：" +
+                     ", ".join(f"{dev}={len(items)}组" for dev, items in device_groups.items()))
+        ordered = []
+        queues = list(device_groups.values())
+        for i in range(max(len(items) for items in queues)):
+            ordered.extend(items[i] for items in queues if i < len(items))
+        return ordered
+
+    def _GroupSize(self, group):
+        return sum(file_info.size for id in group for file_info in self.package_map[id].file_list)
+
+    def _OrderGroups(self, groups):
+        """ 小的分组先上传，下游可以更早拿到完整的数据包；多个输入盘时再按设备轮流排列 """
+        if self.task_info.tags.get("small_packages_first", "true") == "true":
+            groups = sorted(groups, key=self._GroupSize)
+        return self._InterleaveGroupsByDevice(groups)
+
     def _UploadProcess(self, groups):
+        rt = self._UploadGroups(self._OrderGroups(groups))
+        if rt == UploadRC.SUCCESS:
+            rt = self._UploadBusyGroups()
+        return rt
+
+    def _UploadGroups(self, groups):
         cpu_nums = int(self.task_info.tags["cpuNums"])
-        with concurrent.futures.ThreadPoolExecutor(max_workers=cpu_nums) as executor:
+        with LogContextExecutor(max_workers=cpu_nums) as executor:
             future_to_group = {executor.submit(self._UploadSingleGroup, group): group for group in groups}
             for future in concurrent.futures.as_completed(future_to_group):
                 try:
@@ -192,8 +381,213 @@ class BaseUploader:
                     return UploadRC.UNKNOWN_ERROR
         return UploadRC.SUCCESS
 
+    def _WatchProcess(self):
+        """
+        监听模式：inotify监听input_root，数据包在settle时间内没有变化，或数据包目录下出现标记文件（如storage_info.json）
+        后很快没有变化，即视为拷贝完成并立即上传，上传与拷贝重叠进行；
+        出现watch_done_file或整个目录超过watch_idle_exit_seconds没有变化时做最后一次扫描，上传剩余数据包后退出
+        """
+        tags = self.task_info.tags
+        settle_seconds = float(tags.get("watch_settle_seconds", 60))
+        marker_settle_seconds = float(tags.get("watch_marker_settle_seconds", 5))
+        scan_seconds = float(tags.get("watch_scan_seconds", 30))
+        markers = [name.strip() for name in str(tags.get("watch_markers", "storage_info.json,metadata.yaml")).split(",")
+                   if name.strip()]
+        watcher = DirectoryWatcher(self.task_info.input_root, ignore_names=self.WATCH_IGNORE_NAMES,
+                                   ignore_roots=[self.task_info.output_root])
+        watcher.WatchMarkers(markers)
+        logging.info(f"|{'-' * 12} 监听模式：settle={settle_seconds}s, markers={markers}")
+
+        if not self.WATCH_RESCAN_SAFE:
+            logging.warning(f"{type(self).__name__}不支持边拷贝边上传，等待全部数据拷贝完成")
+            marker_events = 0
+            while not self._WatchFinished(watcher):
+                _, marker_events = watcher.Wait(marker_events, scan_seconds)
+            watcher.Stop()
+            groups = self.ListInputPackages()
+            if len(groups) == 0:
+                logging.error(f"找不到需要上传的数据，退出上传")
+                return UploadRC.MISSING_FILE
+            self.progress_bar.AddTotal(self.input_files_size)
+            return self._UploadProcess(groups)
+
+        submitted_keys = self.submitted_keys
+        futures = []
+        last_events = -1
+        marker_events = 0
+        pending = 0
+        self.watching = True
+        executor = LogContextExecutor(max_workers=int(tags["cpuNums"]))
+        try:
+            while True:
+                finished = self._WatchFinished(watcher)
+                events, _ = watcher.Counters()
+                if finished or events != last_events or pending > 0:
+                    last_events = events
+                    self.watching = not finished
+                    try:
+                        groups, pending = self._ScanReadyGroups(watcher, submitted_keys, settle_seconds,
+                                                                marker_settle_seconds, markers, finished)
+                    except Exception as e:
+                        # 拷贝中的文件可能不完整，下一轮重新扫描；最后一次扫描失败时退出
+                        if finished:
+                            raise
+                        logging.warning(f"扫描输入目录失败，稍后重试 : {e}")
+                        groups, pending = [], 1
+                    for group in self._OrderGroups(groups):
+                        futures.append(executor.submit(self._UploadSingleGroup, group))
+                if finished:
+                    break
+                _, marker_events = watcher.Wait(marker_events, scan_seconds)
+        finally:
+            watcher.Stop()
+            executor.shutdown(wait=True)
+
+        if len(futures) == 0:
+            logging.error(f"找不到需要上传的数据，退出上传")
+            return UploadRC.MISSING_FILE
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"catch exception during upload group : {e}")
+                return UploadRC.UNKNOWN_ERROR
+        return self._UploadBusyGroups()
+
+    def _WatchFinished(self, watcher: DirectoryWatcher):
+        done_file = self.task_info.tags.get("watch_done_file")
+        if done_file and os.path.exists(os.path.join(self.task_info.input_root, done_file)):
+            logging.info(f"检测到拷贝完成标记{done_file}")
+            return True
+        idle_exit_seconds = float(self.task_info.tags.get("watch_idle_exit_seconds", 1800))
+        if watcher.IsSettled(self.task_info.input_root, idle_exit_seconds):
+            logging.info(f"输入目录{idle_exit_seconds}s没有变化，视为拷贝完成")
+            return True
+        return False
+
+    def _ScanReadyGroups(self, watcher: DirectoryWatcher, submitted_keys, settle_seconds, marker_settle_seconds,
+                         markers, final):
+        """
+        重新扫描硬盘，返回(本次可以上传的分组, 尚未拷贝完成的分组数)。
+        本次扫描新生成、但未提交上传的数据包不保留（下次扫描重新生成）；提交的数据包重新编号，保持package_map的id连续，
+        ListInputPackages按len(package_map)分配id时不会与上传中的数据包冲突
+        """
+        saved_map = dict(self.package_map)
+        saved_size = self.input_files_size
+        known_keys = {package_info.key for package_info in saved_map.values()}
+        try:
+            groups = self.ListInputPackages()
+        except Exception:
+            self.package_map = saved_map
+            self.input_files_size = saved_size
+            raise
+        scanned_map = self.package_map
+
+        ready_groups = []
+        pending = 0
+        accepted = []
+        for group in groups:
+            package_infos = [scanned_map[id] for id in group]
+            if any(package_info.key in submitted_keys for package_info in package_infos):
+                continue
+            if not final and not all(self._IsPackageReady(package_info, watcher, settle_seconds,
+                                                          marker_settle_seconds, markers)
+                                     for package_info in package_infos):
+                pending += 1
+                continue
+            submitted_keys.update(package_info.key for package_info in package_infos)
+            accepted.append(package_infos)
+        # 已上传过而跳过的数据包只保留第一次扫描的结果，用于上传记录
+        grouped_ids = {id for group in groups for id in group}
+        for id, package_info in scanned_map.items():
+            if id not in saved_map and id not in grouped_ids and package_info.key not in known_keys:
+                known_keys.add(package_info.key)
+                accepted.append([package_info])
+
+        self.package_map = saved_map
+        added_size = 0
+        for package_infos in accepted:
+            group = []
+            for package_info in package_infos:
+                package_info.id = len(self.package_map)
+                self.package_map[package_info.id] = package_info
+                group.append(package_info.id)
+                if package_info.desc != "success":
+                    added_size += sum(file_info.size for file_info in package_info.file_list)
+            if package_infos[0].desc != "success":
+                ready_groups.append(group)
+        self.input_files_size = saved_size + added_size
+        if added_size > 0:
+            self.progress_bar.AddTotal(added_size)
+        if len(ready_groups) > 0:
+            logging.info(f"|{'-' * 12} 监听模式：新增{len(ready_groups)}组待上传，{pending}组仍在拷贝，"
+                         f"累计待上传数据大小为:{self.input_files_size / pow(1024, 3)}GB")
+        return ready_groups, pending
+
+    def _IsPackageReady(self, package_info: PackageInfo, watcher: DirectoryWatcher, settle_seconds,
+                        marker_settle_seconds, markers):
+        """ 数据包位于input_root下的文件/目录全部存在，且settle_seconds内没有变化；出现标记文件时只需marker_settle_seconds """
+        input_root = os.path.abspath(self.task_info.input_root)
+        paths = [file_info.abs_path for file_info in package_info.file_list
+                 if file_info.abs_path and os.path.abspath(file_info.abs_path).startswith(input_root + os.sep)]
+        if package_info.local_root and os.path.abspath(package_info.local_root).startswith(input_root + os.sep):
+            paths.append(package_info.local_root)
+        if not all(os.path.exists(path) for path in paths):
+            return False
+        if any(watcher.HasMarker(path, markers) for path in paths):
+            settle_seconds = marker_settle_seconds
+        return all(watcher.IsSettled(path, settle_seconds) for path in paths)
+
+    def _UploadBusyGroups(self):
+        """ 被其他上传进程领取的分组：等待其完成，持有者释放租约（上传失败）或租约过期（进程退出）后接手上传 """
+        rt = UploadRC.SUCCESS
+        poll_seconds = float(self.task_info.tags.get("coord_poll_seconds", 30))
+        while rt == UploadRC.SUCCESS and len(self.busy_groups) > 0:
+            logging.info(f"|{'-' * 12} 多机协同上传：{len(self.busy_groups)}组由其他上传进程上传中，{poll_seconds}s后重新领取")
+            time.sleep(poll_seconds)
+            with self.lock:
+                groups, self.busy_groups = self.busy_groups, []
+            rt = self._UploadGroups(groups)
+        return rt
+
+    def _GroupLeaseKey(self, group):
+        scope = self.task_info.tags.get("coord_scope", self.sn)
+        # 补传副本目标与首次上传使用不同的租约，首次上传的租约已完成时仍可以补传
+        return LeaseStore.GroupKey(scope, [self.package_map[id].key if not self.package_map[id].replica_targets else
+                                           f"{self.package_map[id].key}@{','.join(self.package_map[id].replica_targets)}"
+                                           for id in group])
+
     def _UploadSingleGroup(self, group):
-        if self.package_map[group[0]].input_bucket_path is None:
+        """ 多机协同上传时先领取分组的租约，其他上传进程已领取的分组稍后重试，已完成的分组跳过 """
+        if self.lease_store is None:
+            return self._UploadLeasedGroup(group, None)
+        lease_key = self._GroupLeaseKey(group)
+        status = self.lease_store.TryClaim(lease_key, label=self.package_map[group[0]].key)
+        if status != LEASE_CLAIMED:
+            if status == LEASE_BUSY:
+                with self.lock:
+                    self.busy_groups.append(group)
+            for id in group:
+                self.package_map[id].desc = "other_uploader"
+            return True
+        try:
+            return self._UploadLeasedGroup(group, lease_key)
+        finally:
+            # 未完成时释放，其他上传进程可以立即接手；已完成时不做修改
+            self.lease_store.Release(lease_key)
+
+    def _UploadLeasedGroup(self, group, lease_key):
+        # 接手其他上传进程的租约时沿用其创建的数据包，继续上传到同一个前缀
+        leased_package = None
+        if lease_key is not None and self.package_map[group[0]].input_bucket_path is None:
+            leased_package = self.lease_store.GetPackage(lease_key)
+        if leased_package is not None:
+            task_id, cloud_prefix = leased_package
+            logging.info(f"沿用租约中记录的数据包：packageId={task_id}，objectKeyRoot={cloud_prefix}")
+            for id in group:
+                self.package_map[id].task_id = task_id
+                self.package_map[id].input_bucket_path = cloud_prefix
+        elif self.package_map[group[0]].input_bucket_path is None:
             j_create_package = self.package_map.get(group[0]).ToReqjson(self.task_info.tags["tenant_id"],
                                                                         self.app_id,
                                                                         self.task_info.tags["data_type"])
@@ -208,6 +602,8 @@ class BaseUploader:
                 package_info = self.package_map.get(id)
                 package_info.task_id = response["data"]["packageId"]
                 package_info.input_bucket_path = cloud_prefix
+            if lease_key is not None:
+                self.lease_store.SetPackage(lease_key, task_id, cloud_prefix)
         else:
             task_id = self.package_map.get(group[0]).task_id
         if task_id is None:
@@ -224,7 +620,16 @@ class BaseUploader:
             "output_root": self.task_info.output_root
         }
         logging.info(f"connect params = {connect_params}")
-        conn = CSFactory.CreateConnector(cloud_type=self.cloud_type, **connect_params)
+        conn = self._FanoutConnector(CSFactory.GetConnector(cloud_type=self.cloud_type, **connect_params),
+                                     connect_params)
+
+        # 开启skip_existing时一次性列举云端目录，替代逐文件HEAD请求
+        # 多目标上传时只能列举主目标，主目标已存在的文件会导致副本目标漏传，不跳过
+        inventory = None
+        if self.task_info.tags.get("skip_existing", "false") == "true" and conn is not self.fanout_conn:
+            inventory = InventoryCache(conn, ttl=int(self.task_info.tags.get("inventory_ttl", 600)),
+                                       cache_root=os.path.join(self.task_info.output_root, "inventory_cache"))
+            inventory.Prefetch(self.package_map.get(group[0]).input_bucket_path)
 
         failed_count = 0
         for id in group:
@@ -232,10 +637,15 @@ class BaseUploader:
             package_info.output_bucket_path = self.task_info.tags["yellow_bucket_name"]
             package_info.st = GetFormattedTime()
 
+            # 多目标上传时每个数据包一个会话，分别统计各副本目标的结果；主目标已上传的数据包只补传失败的副本目标
+            package_conn = conn.NewSession(package_info.replica_targets) if conn is self.fanout_conn else conn
             try:
-                if not self._UploadSinglePackage(package_info, conn):
+                if not self._UploadSinglePackage(package_info, package_conn, inventory):
                     package_info.desc = "failed"
                     failed_count += 1
+                elif package_info.replica_targets:
+                    package_info.desc = "success" if all(package_conn.ReplicaStatus().values()) else "failed"
+                    failed_count += 0 if package_info.desc == "success" else 1
                 else:
                     package_info.desc = "success"
                     self.tracker.updateStatus(self.sn, package_info.key, package_info.input_bucket_path,
@@ -244,12 +654,27 @@ class BaseUploader:
                 logging.error(e)
                 package_info.desc = "failed"
                 failed_count += 1
+            if package_conn is not conn:
+                self._RecordReplicas(package_info, package_conn)
 
             package_info.et = GetFormattedTime()
-            self.SendMessage(package_info, self.task_info.tags["upload_log_topic"])
+            if package_info.replica_targets:
+                # 主目标上传时已发送过上传日志
+                logging.info(f"数据包{package_info.key}补传副本目标{package_info.replica_targets}：{package_info.desc}")
+            else:
+                self.SendMessage(package_info, self.task_info.tags["upload_log_topic"])
+
+        # 多机协同上传：只有租约的持有者可以标记完成，租约已被其他进程接手时由对方通知平台，避免重复通知
+        if failed_count == 0 and lease_key is not None and not self.lease_store.Complete(lease_key):
+            logging.error(f"数据包{task_id}（{[self.package_map[id].key for id in group]}）上传完成时租约已被其他上传进程接手，"
+                          f"本进程不通知平台，由接手的进程完成上传并通知")
+            for id in group:
+                self.package_map[id].desc = "lease_lost"
+            return True
 
-        # 只有一组数据包全部上传成功才通知平台已经上传完成
-        if failed_count == 0 and self.task_info.tags["notice_the_platform"] == "true":
+        # 只有一组数据包全部上传成功才通知平台已经上传完成；只补传副本目标的分组在主目标上传时已通知过
+        replica_only = all(self.package_map[id].replica_targets for id in group)
+        if failed_count == 0 and not replica_only and self.task_info.tags["notice_the_platform"] == "true":
             j_callback = {
                 "appId": self.app_id,
                 "tenantId": self.task_info.tags["tenant_id"],
@@ -260,42 +685,295 @@ class BaseUploader:
                 raise ConnectionError("请求上传回调接口失败，请检查网络连接")
         return True
 
-    def _UploadSinglePackage(self, package_info:PackageInfo, conn):
+    def _FanoutConnector(self, conn, connect_params):
+        """
+        配置了fanout_targets时返回同时上传到主目标（conn）与各副本目标的连接，本地数据只读一次；
+        fanout_targets为json列表，每项为一个副本目标，未填写的连接参数与主目标相同，如：
+        [{"name": "backup", "bucket_name": "red-backup"}, {"name": "minio", "cloud_type": "minio", "endpoint": "..."}]
+        """
+        targets = self.task_info.tags.get("fanout_targets")
+        if not targets:
+            return conn
+        with self.lock:
+            if self.fanout_conn is None:
+                if isinstance(targets, str):
+                    targets = json.loads(targets)
+                connectors = [conn]
+                names = [self.task_info.tags.get("fanout_primary_name", "primary")]
+                for i, target in enumerate(targets):
+                    target = dict(target)
+                    names.append(target.pop("name", f"replica{i + 1}"))
+                    cloud_type = target.pop("cloud_type", self.cloud_type)
+                    connectors.append(CSFactory.GetConnector(cloud_type=cloud_type, **{**connect_params, **target}))
+                self.fanout_conn = FanoutService(
+                    connectors, names, max_lag_parts=int(self.task_info.tags.get("fanout_max_lag_parts", 2)))
+                logging.info(f"多目标上传：{names}，第一个为主目标")
+            return self.fanout_conn
+
+    def _FanoutNames(self):
+        """ 多目标上传的各目标名称，第一个为主目标；未配置fanout_targets时返回空列表 """
+        targets = self.task_info.tags.get("fanout_targets")
+        if not targets:
+            return []
+        if isinstance(targets, str):
+            targets = json.loads(targets)
+        return [self.task_info.tags.get("fanout_primary_name", "primary")] + \
+            [target.get("name", f"replica{i + 1}") for i, target in enumerate(targets)]
+
+    def CheckUploaded(self, package_info:PackageInfo):
+        """
+        返回数据包已上传的记录，未上传时返回None，供ListInputPackages跳过已上传的数据包；
+        多目标上传时主目标已上传、但有副本目标没有成功记录（数据包key@目标名称）的数据包也返回None，
+        并在package_info中记录需要补传的副本目标，之后只上传到这些目标，沿用主目标记录的数据包与前缀
+        """
+        upload_record = self.tracker.checkStatus(self.sn, package_info.key)
+        if not (upload_record and upload_record.upload_mark):
+            return None
+        missing = []
+        for name in self._FanoutNames()[1:]:
+            replica_record = self.tracker.checkStatus(self.sn, f"{package_info.key}@{name}")
+            if not (replica_record and replica_record.upload_mark):
+                missing.append(name)
+        if len(missing) == 0:
+            return upload_record
+        logging.info(f"数据包{package_info.key}已上传到主目标，补传副本目标{missing}")
+        package_info.replica_targets = missing
+        package_info.task_id = upload_record.task_id
+        package_info.input_bucket_path = upload_record.oss_root
+        return None
+
+    def _RecordReplicas(self, package_info:PackageInfo, session:FanoutService):
+        """ 各副本目标单独记录上传状态，key为 数据包key@目标名称，主目标的记录与单目标上传一致 """
+        for name, ok in session.ReplicaStatus().items():
+            if not ok:
+                logging.error(f"数据包{package_info.key}上传到副本目标{name}失败")
+            self.tracker.updateStatus(self.sn, f"{package_info.key}@{name}", package_info.input_bucket_path,
+                                      package_info.task_id, "success" if ok else "failed", package_info.file_size)
+
+    def _UploadSinglePackage(self, package_info:PackageInfo, conn, inventory:InventoryCache=None):
         # 20251208 打包目录添加一级，避免多个上传任务同一个output产生冲突
         tar_root = os.path.join(self.task_info.output_root, "tar_root", str(package_info.task_id), package_info.key)
         os.makedirs(tar_root, exist_ok=True)
 
-        file_num = len(package_info.file_list)
-        for i in range(file_num):
-            file_info = package_info.file_list[i]
-            if not isinstance(file_info, FileInfo):
+        # 数据包内的文件提交到全局传输引擎并发上传，batch用于跟踪本数据包的完成情况
+        engine = GetTransferEngine()
+        batch = engine.NewBatch(package_info.key)
+        folder_mark = True
+        # 元数据与公共部分先提交，不必等待同一数据包内大文件的打包
+        file_list = sorted([file_info for file_info in package_info.file_list if isinstance(file_info, FileInfo)],
+                           key=self._FilePriority)
+        for file_info in file_list:
+            ticket = None
+            if file_info.compress_before_upload and self._ArchiveUploaded(package_info, file_info, inventory):
+                # 断点续传：归档已在云端，不再重新打包
+                self.progress_bar.UpdateMain(file_info.size)
+                with self.lock:
+                    package_info.file_size += file_info.size
                 continue
-
             if file_info.compress_before_upload:
-                file_info.abs_path = TarLocalFolder(file_info.abs_path, tar_root)
+                ticket = self.staging_budget.Acquire(self._EstimateStagedSize(file_info), package_info.key)
+                file_info.abs_path = self._CompressFile(package_info, file_info, tar_root)
                 if file_info.abs_path is None:
+                    self.staging_budget.Release(ticket)
+                    batch.Wait()
                     return False
+                # 额度包含归档旁的索引与完成标记
+                self.staging_budget.Adjust(ticket, sum(os.path.getsize(path) for path in self._StagedFiles(file_info)))
 
             file_name = os.path.basename(file_info.abs_path)
             remote_path = os.path.normpath(os.path.join(package_info.input_bucket_path, file_info.rel_path, file_name))
             if os.path.isfile(file_info.abs_path):
-                upload_mark = conn.UploadFile(remote_path, file_info.abs_path)
+                file_size = os.path.getsize(file_info.abs_path)
+                # 打包时生成的成员偏移索引与tar放在同一目录，供下游按range读取单个文件
+                index_file = file_info.abs_path + INDEX_SUFFIX
+                upload_index = file_info.compress_before_upload and os.path.exists(index_file)
+                on_done = self._FileUploadedCallback(package_info, file_info, ticket, 2 if upload_index else 1)
+                batch.Add(self._UploadSingleFile, conn, remote_path, file_info.abs_path, inventory,
+                          size=file_size, priority=self._FilePriority(file_info, file_size),
+                          callback=lambda ok, done=on_done: done(ok, True))
+                if upload_index:
+                    batch.Add(self._UploadSingleFile, conn, remote_path + INDEX_SUFFIX, index_file, inventory,
+                              size=os.path.getsize(index_file), priority=PRIORITY_METADATA,
+                              callback=lambda ok, done=on_done: done(ok, False))
             elif os.path.isdir(file_info.abs_path):
-                upload_mark = conn.UploadFolder(package_info.input_bucket_path, file_info.abs_path)
+                if self.task_info.tags.get("pack_small_files", "false") == "true":
+                    upload_mark = self._UploadPackedFolder(package_info, file_info, conn, tar_root, inventory)
+                else:
+                    # UploadFolder内部同样通过传输引擎并发上传文件夹内的文件
+                    upload_mark = conn.UploadFolder(package_info.input_bucket_path, file_info.abs_path, inventory)
+                self._OnFileUploaded(package_info, file_info, upload_mark)
+                folder_mark = folder_mark and upload_mark
             else:
                 logging.error(f"找不到本地文件{file_info.abs_path}")
+                batch.Wait()
                 return False
 
+        return batch.Wait() and folder_mark
+
+    """
+    打包数据，zip_before_upload开启时使用进程内多线程压缩，codec/level/workers可通过任务配置调整；
+    compress_codec为auto时先抽样估计可压缩性，选择store/lz4/zstd/gzip，选择结果与收益记录到package_info.codec_info
+    """
+    def _CompressFile(self, package_info:PackageInfo, file_info:FileInfo, tar_root):
+        verify = self.task_info.tags.get("verify_archive", "fast")
+        if self.task_info.tags.get("zip_before_upload", "false") != "true":
+            return TarLocalFolder(file_info.abs_path, tar_root, verify=verify)
+        codec = self.task_info.tags.get("compress_codec", "gzip")
+        level = self.task_info.tags.get("compress_level")
+        probe = None
+        if codec == "auto":
+            # 自动选择时按选出的格式使用其默认级别，compress_level只适用于指定的格式
+            probe = ProbeFolder(file_info.abs_path)
+            codec = probe.codec
+            level = None
+        stats = {}
+        tar_file = TarLocalFolder(file_info.abs_path, tar_root, zip_mark=True, codec=codec,
+                                  level=CodecLevel(codec, int(level) if level is not None else None),
+                                  workers=int(self.task_info.tags.get("compress_workers", os.cpu_count() or 1)),
+                                  stats=stats, verify=verify)
+        if tar_file is None or probe is None or len(stats) == 0:
+            return tar_file
+        # 与全部使用gzip相比节省的CPU与压缩节省的字节数
+        cpu_saved = probe.gzip_seconds_per_byte * stats["raw_bytes"] - stats["cpu_seconds"]
+        bytes_saved = stats["raw_bytes"] - stats["compressed_bytes"]
+        codec_info = probe.ToJson()
+        codec_info.update({"file": os.path.basename(tar_file), "cpu_seconds": round(stats["cpu_seconds"], 3),
+                           "cpu_seconds_saved": round(cpu_saved, 3), "bytes_saved": bytes_saved})
+        with self.lock:
+            package_info.codec_info.append(codec_info)
+            self.codec_cpu_seconds_saved += cpu_saved
+            self.codec_bytes_saved += bytes_saved
+        return tar_file
+
+    """
+    小文件打包上传：小于pack_threshold的文件打成约pack_shard_size大小的tar分片，大文件按原相对路径上传，
+    分片与清单（原始相对路径 -> 分片/偏移）上传到数据包根目录
+    """
+    def _UploadPackedFolder(self, package_info:PackageInfo, file_info:FileInfo, conn, tar_root,
+                            inventory:InventoryCache=None):
+        pack_root = os.path.join(tar_root, "pack")
+        ticket = self.staging_budget.Acquire(self._EstimateStagedSize(file_info), package_info.key)
+        with GetReadLimiter().Slot(file_info.abs_path):
+            pack_res = PackSmallFiles(file_info.abs_path, pack_root,
+                                      small_file_threshold=int(self.task_info.tags.get("pack_threshold", 1024 * 1024)),
+                                      shard_size=int(self.task_info.tags.get("pack_shard_size", 256 * 1024 * 1024)))
+        if pack_res is None:
+            self.staging_budget.Release(ticket)
+            return False
+        shard_list, large_file_list, manifest_file = pack_res
+        self.staging_budget.Adjust(ticket, sum(os.path.getsize(path) for path in shard_list + [manifest_file]))
+        batch = GetTransferEngine().NewBatch(f"{package_info.key}/pack")
+        for local_path in shard_list + [manifest_file]:
+            remote_path = os.path.normpath(os.path.join(package_info.input_bucket_path, os.path.basename(local_path)))
+            batch.Add(self._UploadSingleFile, conn, remote_path, local_path, inventory,
+                      size=os.path.getsize(local_path),
+                      callback=lambda ok, path=local_path: self.reclaimer.Remove(path) if ok else None)
+        for rel_path, local_path in SortByLayout(large_file_list, key=lambda item: item[1]):
+            remote_path = os.path.normpath(os.path.join(package_info.input_bucket_path, rel_path))
+            batch.Add(self._UploadSingleFile, conn, remote_path, local_path, inventory,
+                      size=os.path.getsize(local_path))
+        upload_mark = batch.Wait()
+        if upload_mark:
+            self.reclaimer.Remove(pack_root, callback=lambda: self.staging_budget.Release(ticket))
+        else:
+            # 上传失败的分片保留在打包目录中，额度在任务结束清理打包目录时释放
+            with self.lock:
+                self.staged_tickets.append(ticket)
+        return upload_mark
+
+    @staticmethod
+    def _FilePriority(file_info:FileInfo, size=None):
+        """ 指定了priority时直接使用；需要打包的目录视为大文件；其余按文件名与大小判断 """
+        if file_info.priority is not None:
+            return file_info.priority
+        if file_info.compress_before_upload:
+            return PRIORITY_BULK
+        if os.path.isdir(file_info.abs_path):
+            return PRIORITY_SMALL
+        return GetTransferEngine().Priority(file_info.abs_path, file_info.size if size is None else size)
+
+    @staticmethod
+    def _EstimateStagedSize(file_info:FileInfo):
+        """ 打包后的大小按原始数据大小估计（压缩率未知时取上限） """
+        if file_info.size > 0:
+            return file_info.size
+        return GetFolderSize(file_info.abs_path) if os.path.isdir(file_info.abs_path) else os.path.getsize(file_info.abs_path)
+
+    def _ArchiveUploaded(self, package_info:PackageInfo, file_info:FileInfo, inventory:InventoryCache=None):
+        """
+        打包前在云端清单中查找该目录的归档，按任务配置确定归档名（compress_codec为auto时任一格式均可），
+        未压缩的归档还需要其成员索引已上传
+        """
+        if inventory is None:
+            return False
+        codec = self.task_info.tags.get("compress_codec", "gzip")
+        if self.task_info.tags.get("zip_before_upload", "false") != "true" or codec == "store":
+            suffixes = [".tar"]
+        elif codec == "auto":
+            suffixes = [".tar"] + list(ARCHIVE_SUFFIX_MAP.values())
+        else:
+            suffixes = [ARCHIVE_SUFFIX_MAP[codec]]
+        folder_name = os.path.basename(file_info.abs_path)
+        for suffix in suffixes:
+            remote_path = os.path.normpath(os.path.join(package_info.input_bucket_path, file_info.rel_path,
+                                                        folder_name + suffix))
+            if inventory.Exists(remote_path) and (suffix != ".tar" or inventory.Exists(remote_path + INDEX_SUFFIX)):
+                logging.info(f"{remote_path}已存在，跳过打包与上传")
+                return True
+        return False
+
+    @staticmethod
+    def _UploadSingleFile(conn, remote_path, local_path, inventory:InventoryCache=None):
+        local_size = os.path.getsize(local_path)
+        if inventory is not None and inventory.GetSize(remote_path) == local_size:
+            logging.info(f"{remote_path}已存在且大小一致，跳过上传")
+            return True
+        upload_mark = conn.UploadFile(remote_path, local_path)
+        if upload_mark and inventory is not None:
+            inventory.Add(remote_path, local_size)
+        return upload_mark
+
+    @staticmethod
+    def _StagedFiles(file_info:FileInfo):
+        """ 暂存的归档及其索引、完成标记 """
+        return [file_info.abs_path] + [file_info.abs_path + suffix for suffix in (INDEX_SUFFIX, DONE_SUFFIX)
+                                       if os.path.exists(file_info.abs_path + suffix)]
+
+    def _FileUploadedCallback(self, package_info:PackageInfo, file_info:FileInfo, ticket:StagingTicket, jobs):
+        """ 返回callback(ok, is_data)：文件与其索引都上传结束后才调用_OnFileUploaded（之后可能删除两者），结果以文件为准 """
+        state = {"pending": jobs, "ok": False}
+        lock = threading.Lock()
+
+        def callback(ok, is_data):
+            with lock:
+                if is_data:
+                    state["ok"] = ok
+                state["pending"] -= 1
+                if state["pending"] > 0:
+                    return
+            self._OnFileUploaded(package_info, file_info, state["ok"], ticket)
+        return callback
+
+    def _OnFileUploaded(self, package_info:PackageInfo, file_info:FileInfo, upload_mark, ticket:StagingTicket=None):
+        if ticket is None:
             if file_info.remove_after_upload:
-                RemoveLocalFile(file_info.abs_path)
-            if upload_mark:
-                self.progress_bar.UpdateMain(file_info.size)
+                self.reclaimer.Remove(file_info.abs_path, file_info.size)
+        elif file_info.remove_after_upload or upload_mark:
+            # 暂存的归档（连同索引与完成标记）上传成功后即删除，归档删除完成后释放暂存额度
+            staged_files = self._StagedFiles(file_info)
+            for path in staged_files[1:]:
+                self.reclaimer.Remove(path)
+            self.reclaimer.Remove(staged_files[0], callback=lambda: self.staging_budget.Release(ticket))
+        else:
+            # 上传失败且保留的归档仍占用磁盘，额度在任务结束清理打包目录时释放
+            with self.lock:
+                self.staged_tickets.append(ticket)
+        if upload_mark:
+            self.progress_bar.UpdateMain(file_info.size)
+            with self.lock:
                 package_info.file_size += file_info.size
-            else:
-                logging.error(f"上传数据{file_info.abs_path}到{package_info.input_bucket_path}失败")
-                return False
-
-        return True
+        else:
+            logging.error(f"上传数据{file_info.abs_path}到{package_info.input_bucket_path}失败")
 
     def _WriteUploadRecords(self, disk_file_size):
         timestamp_str = GetFormattedTime()
@@ -318,10 +996,32 @@ class BaseUploader:
             if package_info.desc == "success":
                 upload_file_size += package_info.file_size
                 upload_file_count += len(package_info.file_list)
-            else:
+            elif package_info.desc not in ("other_uploader", "lease_lost"):
+                # 由其他上传进程完成的数据包不计入未上传
                 self.unupload_package_count += 1
 
         logging.info(f"上传完成：本次上传数据大小={upload_file_size/pow(1024,3)}GB，剩余数据大小={(disk_file_size-upload_file_size)/pow(1024,3)}GB")
+        if self.task_info.tags.get("compress_codec") == "auto":
+            logging.info(f"压缩格式自动选择：节省CPU时间={self.codec_cpu_seconds_saved:.1f}s，"
+                         f"压缩节省数据大小={self.codec_bytes_saved / pow(1024, 3)}GB")
+        logging.info(f"本地待删除数据大小={self.reclaimer.Metrics()['backlog_bytes'] / pow(1024, 3)}GB，"
+                     f"暂存空间统计：{self.staging_budget.Metrics()}")
+        logging.info(f"重试与熔断统计：{RetryMetrics()}")
+        logging.info(f"传输优先级统计：{GetTransferEngine().Metrics()}")
+        if self.lease_store is not None:
+            logging.info(f"多机协同上传租约统计：{self.lease_store.Metrics()}")
+        if self.fanout_conn is not None:
+            logging.info(f"多目标上传统计（shared_read_mb为只读一次节省的读盘量）：{self.fanout_conn.Metrics()}")
+        if GetCpuPool() is not None:
+            logging.info(f"CPU进程池统计：{GetCpuPool().Metrics()}")
+        if GetHedgePolicy() is not None:
+            logging.info(f"分片对冲统计：{GetHedgePolicy().Metrics()}")
+        if self.transfer_controller is not None:
+            logging.info(f"上传并发自动调节统计：{self.transfer_controller.Metrics()}")
+        for metrics in GetReadLimiter().Metrics():
+            logging.info(f"输入设备读取统计：{metrics}")
+        for metrics in PrefetchMetrics():
+            logging.info(f"预读缓冲池统计（bound=disk为读盘瓶颈，network为网络瓶颈）：{metrics}")
         writer.write(f"/,/,/,{upload_file_size / pow(1024, 4)}TB,/,/,/,/,/,/,/\n")
         writer.close()
 
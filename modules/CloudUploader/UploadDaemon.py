@@ -0,0 +1,264 @@
+"""
+常驻上传进程
+一个进程持续接收上传任务（每个任务对应一次 main.py -i -t -s 的参数），多个硬盘的任务并发执行，
+连接池、Kafka producer、上传状态数据库连接以及全局传输引擎、读盘限速、重试预算与熔断器在任务之间共享
+（传输引擎、重试与对冲参数与运行中任务不一致的任务被拒绝，见ProcessSettings；日志按任务写入各自的日志文件）：
+  - spool目录 : 任务以json文件放入 <spool_root>/incoming，按文件名顺序领取，运行中移入running，
+    结束后连同返回码写入done（返回码非0时写入failed）；进程重启后running中的任务重新放回incoming
+  - unix socket : 客户端发送一行json任务，守护进程写入spool后回复任务ID；"wait": true时任务结束后再回复结果
+
+任务格式：
+  {"type": "ag", "mode": "prod", "sn": "DISK_SN_001", "task_info": {...}}
+  task_info也可以换成"task_info_file": "/path/to/task_info.json"，mode与sn缺省时使用命令行参数
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from util_modules.log_util import *
+from util_modules.loctime_util import GetFormattedTime
+
+INCOMING = "incoming"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class UploadJob:
+    def __init__(self, job_id, payload, job_file):
+        self.job_id = job_id
+        self.payload = payload
+        self.job_file = job_file  # running目录下的任务文件
+        self.task_info_file = None
+        self.output_root = None
+        self.rc = None
+        self.st = None
+        self.et = None
+        self.error = None
+
+    def ToJson(self):
+        result = dict(self.payload)
+        result.update({
+            "job_id": self.job_id,
+            "rc": self.rc,
+            "start_time": self.st,
+            "end_time": self.et
+        })
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+class UploadDaemon:
+    def __init__(self, spool_root, create_uploader, socket_path=None, max_jobs=2, poll_seconds=2.0,
+                 run_mode="prod", sn="fake_sn_num"):
+        """
+        spool_root : spool目录
+        create_uploader : create_uploader(type, task_info_file, run_mode, sn)，返回上传器，不支持的类型返回None
+        socket_path : unix socket路径，为None时只监听spool目录
+        max_jobs : 同时执行的任务数，所有任务共享全局并发与带宽上限
+        poll_seconds : 扫描spool目录的周期
+        run_mode / sn : 任务未指定时使用的默认值
+        """
+        self.spool_root = spool_root
+        self.create_uploader = create_uploader
+        self.socket_path = socket_path
+        self.max_jobs = max_jobs
+        self.poll_seconds = poll_seconds
+        self.run_mode = run_mode
+        self.sn = sn
+        for name in (INCOMING, RUNNING, DONE, FAILED):
+            os.makedirs(os.path.join(spool_root, name), exist_ok=True)
+
+        self.cond = threading.Condition()
+        self.running = {}  # <job_id, UploadJob>
+        self.finished = {}  # <job_id, UploadJob>，只保存等待结果的socket请求
+        self.waiters = set()
+        self.stopped = False
+        self.job_count = 0
+        self.failed_count = 0
+
+    def _Path(self, state, name):
+        return os.path.join(self.spool_root, state, name)
+
+    def _RecoverRunning(self):
+        """ 上次退出时未完成的任务放回incoming，已上传的数据包由上传状态数据库跳过 """
+        for name in sorted(os.listdir(os.path.join(self.spool_root, RUNNING))):
+            if name.endswith(".json") and not name.endswith(".task_info.json"):
+                logging.warning(f"恢复未完成的上传任务 {name}")
+                os.replace(self._Path(RUNNING, name), self._Path(INCOMING, name))
+
+    @staticmethod
+    def NewJobId():
+        """ 以时间开头，spool目录按文件名排序即为提交顺序 """
+        now = time.time()
+        return f"{time.strftime('%Y%m%d%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}_{uuid.uuid4().hex[:8]}"
+
+    def Submit(self, payload, job_id=None):
+        """ 写入spool目录（先写临时文件再重命名，避免领取到写了一半的任务），返回任务ID """
+        job_id = job_id or self.NewJobId()
+        tmp_file = self._Path(INCOMING, f".{job_id}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as fp:
+            json.dump(payload, fp, ensure_ascii=False)
+        os.replace(tmp_file, self._Path(INCOMING, f"{job_id}.json"))
+        with self.cond:
+            self.cond.notify_all()
+        return job_id
+
+    def _Claim(self, name):
+        """ 在self.cond内调用，将任务移入running并解析，任务无效时直接写入failed """
+        job_id = name[:-len(".json")]
+        job_file = self._Path(RUNNING, name)
+        os.replace(self._Path(INCOMING, name), job_file)
+        job = UploadJob(job_id, {}, job_file)
+        try:
+            with open(job_file, "r", encoding="utf-8") as fp:
+                job.payload = json.load(fp)
+            if "task_info" in job.payload:
+                job.task_info_file = self._Path(RUNNING, f"{job_id}.task_info.json")
+                with open(job.task_info_file, "w", encoding="utf-8") as fp:
+                    json.dump(job.payload["task_info"], fp, ensure_ascii=False)
+                job.output_root = job.payload["task_info"].get("output_root")
+            else:
+                job.task_info_file = job.payload["task_info_file"]
+                with open(job.task_info_file, "r", encoding="utf-8") as fp:
+                    job.output_root = json.load(fp).get("output_root")
+        except (OSError, ValueError, KeyError) as e:
+            job.error = f"invalid job : {e}"
+            job.rc = 255
+            self._Finish(job)
+            return None
+        return job
+
+    def _NextJobs(self):
+        """ 在self.cond内调用，按文件名顺序领取任务；与运行中任务使用同一输出目录的任务等待其结束，避免清理彼此的暂存数据 """
+        jobs = []
+        busy_roots = {job.output_root for job in self.running.values()}
+        for name in sorted(os.listdir(os.path.join(self.spool_root, INCOMING))):
+            if len(self.running) + len(jobs) >= self.max_jobs:
+                break
+            if not name.endswith(".json") or name.startswith("."):
+                continue
+            output_root = self._PeekOutputRoot(name)
+            if output_root in busy_roots:
+                continue
+            job = self._Claim(name)
+            if job is None:
+                continue
+            busy_roots.add(job.output_root)
+            jobs.append(job)
+        return jobs
+
+    def _PeekOutputRoot(self, name):
+        try:
+            with open(self._Path(INCOMING, name), "r", encoding="utf-8") as fp:
+                payload = json.load(fp)
+            if "task_info" in payload:
+                return payload["task_info"].get("output_root")
+            with open(payload["task_info_file"], "r", encoding="utf-8") as fp:
+                return json.load(fp).get("output_root")
+        except (OSError, ValueError, KeyError):
+            return None  # 交给_Claim记录为无效任务
+
+    def _RunJob(self, job: UploadJob):
+        job.st = GetFormattedTime()
+        logging.info(f"> 开始上传任务 {job.job_id} : type={job.payload.get('type')}, "
+                     f"sn={job.payload.get('sn', self.sn)}, 当前运行任务数={len(self.running)}")
+        try:
+            uploader = self.create_uploader(job.payload.get("type"), job.task_info_file,
+                                            job.payload.get("mode", self.run_mode), job.payload.get("sn", self.sn))
+            if uploader is None:
+                job.error = f"不支持当前操作类型:{job.payload.get('type')}"
+                job.rc = 255
+            else:
+                job.rc = int(uploader.Run())
+        except Exception as e:
+            logging.exception(f"上传任务 {job.job_id} 异常退出 : {e}")
+            job.error = str(e)
+            job.rc = 99
+        job.et = GetFormattedTime()
+        logging.info(f"> 上传任务 {job.job_id} 结束, return code = {job.rc}")
+        with self.cond:
+            self.running.pop(job.job_id, None)
+            self._Finish(job)
+
+    def _Finish(self, job: UploadJob):
+        """ 在self.cond内调用，写入结果并清理running目录 """
+        self.job_count += 1
+        state = DONE if job.rc == 0 else FAILED
+        if job.rc != 0:
+            self.failed_count += 1
+        with open(self._Path(state, f"{job.job_id}.json"), "w", encoding="utf-8") as fp:
+            json.dump(job.ToJson(), fp, ensure_ascii=False, indent=2)
+        for path in (job.job_file, self._Path(RUNNING, f"{job.job_id}.task_info.json")):
+            if os.path.exists(path):
+                os.remove(path)
+        if job.job_id in self.waiters:
+            self.waiters.discard(job.job_id)
+            self.finished[job.job_id] = job
+        self.cond.notify_all()
+
+    def _Serve(self):
+        """ unix socket：每个连接发送一行json任务 """
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(16)
+        logging.info(f"上传任务socket监听 {self.socket_path}")
+        while not self.stopped:
+            conn, _ = server.accept()
+            threading.Thread(target=self._HandleClient, args=(conn,), daemon=True).start()
+
+    def _HandleClient(self, conn):
+        with conn, conn.makefile("rwb") as fp:
+            try:
+                payload = json.loads(fp.readline().decode("utf-8"))
+                wait = bool(payload.pop("wait", False))
+                if wait:
+                    # 先登记再写入spool，避免任务在登记之前就已结束
+                    job_id = self.NewJobId()
+                    with self.cond:
+                        self.waiters.add(job_id)
+                    self.Submit(payload, job_id)
+                else:
+                    job_id = self.Submit(payload)
+                fp.write((json.dumps({"job_id": job_id}) + "\n").encode("utf-8"))
+                fp.flush()
+                if wait:
+                    with self.cond:
+                        while job_id not in self.finished:
+                            self.cond.wait()
+                        job = self.finished.pop(job_id)
+                    fp.write((json.dumps(job.ToJson(), ensure_ascii=False) + "\n").encode("utf-8"))
+                    fp.flush()
+            except (OSError, ValueError) as e:
+                logging.error(f"处理上传任务请求失败 : {e}")
+
+    def Stop(self):
+        """ 不再领取新任务，Run在运行中的任务结束后返回 """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def Run(self):
+        """ 阻塞运行直到Stop()，返回处理失败的任务数 """
+        self._RecoverRunning()
+        if self.socket_path:
+            threading.Thread(target=self._Serve, daemon=True).start()
+        logging.info(f"> {'-' * 15} \033[34m 上传守护进程启动, spool={self.spool_root}, max_jobs={self.max_jobs} \033[0m {'-' * 15} <")
+        with self.cond:
+            while not self.stopped:
+                for job in self._NextJobs():
+                    self.running[job.job_id] = job
+                    threading.Thread(target=self._RunJob, args=(job,), daemon=True).start()
+                self.cond.wait(timeout=self.poll_seconds)
+            while len(self.running) > 0:
+                logging.info(f"等待{len(self.running)}个运行中的上传任务结束")
+                self.cond.wait(timeout=60)
+        logging.info(f"> {'-' * 15} \033[34m 上传守护进程退出, 共处理{self.job_count}个任务, 失败{self.failed_count}个 \033[0m {'-' * 15} <")
+        return self.failed_count
@@ -6,6 +6,8 @@ from modules.CloudUploader.BaseUploader import *
 from util_modules.elastic_util import *
 
 class GAICUploader(BaseUploader):
+    WATCH_IGNORE_NAMES = ("batch.txt",)
+
     def __init__(self, task_info_file, run_mode, sn):
         super().__init__(task_info_file, run_mode, sn)
         self.batch_name = self.task_info.output_root.rstrip('/').split('/')[-1]
@@ -27,7 +29,7 @@ class GAICUploader(BaseUploader):
 
     def ListInputPackages(self):
         def addPkg(package_info:PackageInfo, groups: list, file_size):
-            upload_record = self.tracker.checkStatus(self.sn, package_info.key)
+            upload_record = self.CheckUploaded(package_info)
             if upload_record and upload_record.upload_mark:
                 logging.info(f"数据包{package_info.key}已经上传过，跳过")
                 package_info.desc = "success"
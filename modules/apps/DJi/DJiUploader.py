@@ -1,16 +1,23 @@
 import logging
 import os
 import re
+import threading
 from datetime import datetime
-import shutil
 
 from modules.CloudUploader.BaseUploader import *
-from util_modules.platform_util import TarLocalFolder
+from util_modules.log_util import LogContextExecutor
+from util_modules.platform_util import TarLocalMembers
+from util_modules.tar_util import CheckArchiveMarker, IterMembers
 
 class DJiUploader(BaseUploader):
     def __init__(self, task_info_file, run_mode, sn):
         super().__init__(task_info_file, run_mode, sn)
         self.invalid_package_list = {}
+        self.invalid_lock = threading.Lock() # 多个行程目录并行扫描
+        self.scan_lock = threading.Lock()
+        self.common_parts = {} # <行程目录, 公共部分FileInfo>，监听模式下已有clip提交上传后不再重新打包
+        self.common_part_tickets = {} # <行程目录, 公共部分归档的暂存额度>，监听模式下重复扫描时复用
+        self.folder_sizes = {} # <clip目录, (mtime, 大小)>，监听模式下重复扫描时复用
 
     def _checkTravelDataRoot(self, name):
         m = re.match(r"^car_(\d{4})-(\d{2})-(\d{2})", name)
@@ -24,36 +31,55 @@ class DJiUploader(BaseUploader):
         except ValueError:
             return False
 
+    def _AddInvalidPackage(self, package_path, desc):
+        with self.invalid_lock:
+            self.invalid_package_list[package_path] = desc
+
+    def _LoadJson(self, package_path, json_file):
+        """ 监听模式下文件可能还没有拷贝完，解析失败视为数据包未就绪（返回None，下次扫描重新检查），否则记为不合规 """
+        try:
+            with open(json_file, "r") as fp:
+                return json.load(fp)
+        except (OSError, ValueError) as e:
+            if self.watching:
+                logging.warning(f"{json_file}解析失败，可能仍在拷贝，稍后重新检查 : {e}")
+            else:
+                logging.error(f"{json_file}解析失败 : {e}")
+                self._AddInvalidPackage(package_path, f"invalid {os.path.basename(json_file)}")
+            return None
+
     def _checkProcess(self, package_path, source_type):
         if source_type == 'raw_data':
             storage_info_json = os.path.join(package_path, "storage_info.json")
             if not os.path.exists(storage_info_json):
                 logging.error(f"{storage_info_json} is not existed")
-                self.invalid_package_list[package_path] = "missing storage_info.json"
+                self._AddInvalidPackage(package_path, "missing storage_info.json")
+                return False
+            content = self._LoadJson(package_path, storage_info_json)
+            if content is None:
+                return False
+            if "collectInfo" not in content.keys():
+                logging.error(f"collect_info not found in {storage_info_json}")
+                self._AddInvalidPackage(package_path, "key 'collectInfo' not found in storage_info.json")
                 return False
-            with open(storage_info_json, "r") as fp:
-                content = json.load(fp)
-                if "collectInfo" not in content.keys():
-                    logging.error(f"collect_info not found in {storage_info_json}")
-                    self.invalid_package_list[package_path] = "key 'collectInfo' not found in storage_info.json"
-                    return False
         elif source_type == "TTE":
             meta_root = os.path.join(package_path, "metadata")
             if not os.path.exists(meta_root):
                 logging.error(f"{meta_root} is not existed")
-                self.invalid_package_list[package_path] = "missing metadata folder"
+                self._AddInvalidPackage(package_path, "missing metadata folder")
                 return False
             vehicle_desc_json = os.path.join(meta_root, "vehicle_desc.json")
             if not os.path.exists(vehicle_desc_json):
                 logging.error(f"{vehicle_desc_json} is not existed")
-                self.invalid_package_list[package_path] = "missing vehicle_desc.json"
+                self._AddInvalidPackage(package_path, "missing vehicle_desc.json")
+                return False
+            content = self._LoadJson(package_path, vehicle_desc_json)
+            if content is None:
+                return False
+            if "collect_info" not in content.keys():
+                logging.error(f"collect_info not found in {vehicle_desc_json}")
+                self._AddInvalidPackage(package_path, "key 'collect_info' not found in vehicle_desc.json")
                 return False
-            with open(vehicle_desc_json, "r") as fp:
-                content = json.load(fp)
-                if "collect_info" not in content.keys():
-                    logging.error(f"collect_info not found in {vehicle_desc_json}")
-                    self.invalid_package_list[package_path] = "key 'collect_info' not found in vehicle_desc.json"
-                    return False
         else:
             raise TypeError(f"Unsupported source type: {source_type}")
 
@@ -67,6 +93,7 @@ class DJiUploader(BaseUploader):
     20251121 新增一种数据类型以及两种数据的校验规格，参考：http://wiki.kuandeng.com/pages/viewpage.action?pageId=83102236
     """
     def ListInputPackages(self):
+        self.invalid_package_list = {} # 监听模式下会重复扫描，只保留最后一次的校验结果
         travel_data_root_list = [] # 形成数据目录清单 car_YY-MM-DD_xxx
         level3_folder_list, _ = listLevelDirs(self.task_info.input_root, 3)
         for level3_folder in level3_folder_list:
@@ -77,53 +104,15 @@ class DJiUploader(BaseUploader):
 
         package_info_list = []
 
-        for travel_data_root in travel_data_root_list:
-            travel_base_name = os.path.basename(travel_data_root)
-            tmp_root = os.path.join(self.task_info.output_root, f"tmp/{travel_base_name}")
-            os.makedirs(tmp_root, exist_ok=True)
-            tar_root = os.path.join(self.task_info.output_root, f"tar_root/{travel_base_name}/common_part")
-            os.makedirs(tar_root, exist_ok=True)
-
-            clip_list = []
-            rel_path_to_input_root = os.path.relpath(travel_data_root, self.task_info.input_root)
-            for sub_name in os.listdir(travel_data_root):
-                source_type = "common"
-                sub_path = os.path.join(travel_data_root, sub_name)
-                if sub_name.startswith("AIPC_DATA") and os.path.isdir(sub_path):
-                    source_type = "raw_data"
-                elif sub_name.startswith("trigger_") and os.path.isdir(sub_path):
-                    source_type = "TTE"
-                elif 'dlog' in sub_name:
-                    logging.warning(f"跳过当前目录:{sub_name}")
-                    continue
-                else:
-                    target_path = os.path.join(tmp_root, sub_name)
-                    if os.path.isdir(sub_path):
-                        shutil.copytree(sub_path, target_path, dirs_exist_ok=True)
-                    else:
-                        shutil.copyfile(sub_path, target_path)
-                    continue
-                if not self._checkProcess(sub_path, source_type):
-                    logging.warning(f"clip = {sub_path}, source type = {source_type}, 检查不通过，跳过数据！！！")
-                    continue
-                 # generate clip
-                file_info = FileInfo()
-                file_info.rel_path = rel_path_to_input_root
-                file_info.remove_after_upload = True
-                file_info.compress_before_upload = True
-                file_info.abs_path = sub_path
-                file_info.size = self._GetFolderSize(file_info.abs_path)
-                clip_list.append(file_info)
-            logging.info(f"行程数据目录下clip总计{len(clip_list)}个，处理中......")
-
-            # add common part
-            file_info_other = FileInfo()
-            file_info_other.rel_path = rel_path_to_input_root
-            file_info_other.remove_after_upload = False
-            file_info_other.compress_before_upload = False
-            file_info_other.abs_path = TarLocalFolder(tmp_root, tar_root)
-            file_info_other.size = os.path.getsize(file_info_other.abs_path)
+        # 各行程目录的扫描、校验与公共部分打包互不依赖，并行处理后按原顺序合并
+        scan_workers = int(self.task_info.tags.get("scan_workers", 4))
+        with LogContextExecutor(max_workers=max(1, min(scan_workers, len(travel_data_root_list)))) as executor:
+            scan_result_list = list(executor.map(self._ScanTravelDataRoot, travel_data_root_list))
 
+        for clip_list, file_info_other in scan_result_list:
+            if file_info_other.abs_path is None:
+                logging.error(f"行程数据公共部分打包失败，跳过{file_info_other.rel_path}")
+                continue
             for file_info in clip_list:
                 package_info = PackageInfo()
                 package_info.id = len(self.package_map)
@@ -132,7 +121,7 @@ class DJiUploader(BaseUploader):
                 package_info.file_list.append(file_info)
                 package_info.file_list.append(file_info_other)
 
-                upload_record = self.tracker.checkStatus(self.sn, package_info.key)
+                upload_record = self.CheckUploaded(package_info)
                 if upload_record and upload_record.upload_mark:
                     if "force_upload" in self.task_info.tags and self.task_info.tags["force_upload"] == "true":
                         logging.info(f"数据包{package_info.key}已经上传过，强制上传")
@@ -149,8 +138,8 @@ class DJiUploader(BaseUploader):
                     package_info_list.append([package_info.id])
                     self.input_files_size += file_info.size
             self.input_files_size += file_info_other.size
-        # 落盘不合规数据记录
-        if len(self.invalid_package_list) > 0:
+        # 落盘不合规数据记录（监听模式下数据仍在拷贝，只在最后一次扫描时记录）
+        if len(self.invalid_package_list) > 0 and not self.watching:
             os.makedirs(os.path.join(self.task_info.output_root, "failed_log"), exist_ok=True)
             timestamp_str = GetFormattedTime()
             output_record_file = os.path.join(self.task_info.output_root, f"failed_log/invalid_package_list_{self.sn}_{timestamp_str}.csv")
@@ -161,6 +150,88 @@ class DJiUploader(BaseUploader):
         logging.info(f"all file info size = {self.input_files_size}")
         return package_info_list
 
+    """
+    扫描单个行程目录：AIPC_DATA*/trigger_*为clip，校验后各自作为数据包；其余内容（dlog除外）为公共部分，
+    按(源路径, 归档名)直接写入common_part/<行程目录名>.tar，不再拷贝到output_root/tmp
+    """
+    def _ScanTravelDataRoot(self, travel_data_root):
+        travel_base_name = os.path.basename(travel_data_root)
+        tar_root = os.path.join(self.task_info.output_root, f"tar_root/{travel_base_name}/common_part")
+        rel_path_to_input_root = os.path.relpath(travel_data_root, self.task_info.input_root)
+
+        clip_list = []
+        common_member_list = []
+        for sub_name in sorted(os.listdir(travel_data_root)):
+            source_type = "common"
+            sub_path = os.path.join(travel_data_root, sub_name)
+            if sub_name.startswith("AIPC_DATA") and os.path.isdir(sub_path):
+                source_type = "raw_data"
+            elif sub_name.startswith("trigger_") and os.path.isdir(sub_path):
+                source_type = "TTE"
+            elif 'dlog' in sub_name:
+                logging.warning(f"跳过当前目录:{sub_name}")
+                continue
+            else:
+                common_member_list.append((sub_path, sub_name))
+                continue
+            if not self._checkProcess(sub_path, source_type):
+                logging.warning(f"clip = {sub_path}, source type = {source_type}, 检查不通过，跳过数据！！！")
+                continue
+            # generate clip
+            file_info = FileInfo()
+            file_info.rel_path = rel_path_to_input_root
+            file_info.remove_after_upload = True
+            file_info.compress_before_upload = True
+            file_info.abs_path = sub_path
+            file_info.size = self._CachedFolderSize(file_info.abs_path)
+            clip_list.append(file_info)
+        logging.info(f"行程数据目录{travel_data_root}下clip总计{len(clip_list)}个，处理中......")
+
+        # 监听模式下该行程已有clip提交上传时，公共部分归档可能正在上传，不再重新打包
+        clip_keys = {os.path.basename(file_info.abs_path) for file_info in clip_list}
+        with self.scan_lock:
+            frozen = self.common_parts.get(travel_data_root) if clip_keys & self.submitted_keys else None
+        if frozen is not None:
+            member_pairs = [(travel_data_root, ".")] + list(IterMembers(common_member_list))
+            if not CheckArchiveMarker(frozen.abs_path, member_pairs):
+                logging.warning(f"行程{travel_base_name}的公共部分在clip提交上传后发生变化，不再重新打包，变化的内容不会上传")
+            return clip_list, frozen
+
+        # add common part
+        file_info_other = FileInfo()
+        file_info_other.rel_path = rel_path_to_input_root
+        file_info_other.remove_after_upload = False
+        file_info_other.compress_before_upload = False
+        file_info_other.priority = PRIORITY_METADATA # 公共部分归档上传后下游即可开始处理各个clip
+        ticket = self._CommonPartTicket(travel_data_root, common_member_list)
+        file_info_other.abs_path = TarLocalMembers(common_member_list, tar_root, travel_base_name, root_path=travel_data_root,
+                                                   verify=self.task_info.tags.get("verify_archive", "fast"))
+        if file_info_other.abs_path is not None:
+            file_info_other.size = os.path.getsize(file_info_other.abs_path)
+            self.staging_budget.Adjust(ticket, sum(os.path.getsize(path) for path in self._StagedFiles(file_info_other)))
+            with self.scan_lock:
+                self.common_parts[travel_data_root] = file_info_other
+        else:
+            self.staging_budget.Adjust(ticket, 0)
+        return clip_list, file_info_other
+
+    def _CommonPartTicket(self, travel_data_root, common_member_list):
+        """
+        公共部分归档按源数据大小计入暂存额度：归档被该行程的所有clip共用，上传后保留到清理打包目录时才删除，额度随之释放；
+        每个clip上传前都需要它，不等待额度（已占用的额度要等上传后才释放，等待会与上传互相阻塞）
+        """
+        with self.scan_lock:
+            ticket = self.common_part_tickets.get(travel_data_root)
+            if ticket is not None and not ticket.released:
+                return ticket
+            size = sum(GetFolderSize(path) if os.path.isdir(path) and not os.path.islink(path) else os.lstat(path).st_size
+                       for path, _ in common_member_list)
+            ticket = self.staging_budget.Acquire(size, f"{os.path.basename(travel_data_root)}/common_part", wait=False)
+            self.common_part_tickets[travel_data_root] = ticket
+        with self.lock:
+            self.staged_tickets.append(ticket)
+        return ticket
+
     def InitCallbackFunction(self, topic):
         pass
 
@@ -168,6 +239,25 @@ class DJiUploader(BaseUploader):
         msg = package_info.ToCallbackMsg(sn=self.sn)
         HttpPostJson(topic, msg)
 
+    def _CachedFolderSize(self, local_path):
+        """ 监听模式下重复扫描时，目录及其直接子项的mtime都没有变化则复用上次du的结果；最后一次扫描重新计算 """
+        if not self.watching:
+            return self._GetFolderSize(local_path)
+        try:
+            with os.scandir(local_path) as entries:
+                mtime = max([os.stat(local_path).st_mtime_ns] +
+                            [entry.stat(follow_symlinks=False).st_mtime_ns for entry in entries])
+        except OSError:
+            return self._GetFolderSize(local_path)
+        with self.scan_lock:
+            cached = self.folder_sizes.get(local_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        size = self._GetFolderSize(local_path)
+        with self.scan_lock:
+            self.folder_sizes[local_path] = (mtime, size)
+        return size
+
     @staticmethod
     def _GetFolderSize(local_path):
         cmd = f"du -sb {local_path} | cut -f1"
@@ -10,12 +10,16 @@ from typing import Dict
 
 from modules.CloudUploader.BaseUploader import *
 from util_modules.platform_util import *
+from util_modules.CpuPool import GetCpuPool
 from .ledgerUtil import *
 
 INPUT_PACKAGE_LEVEL = 2 # 输入数据包所在的文件夹层级
 
 
 class garcndUploader(BaseUploader):
+    # 第一次扫描即在台账中创建硬盘记录，之后新增的数据包不会加入，监听模式下等待拷贝完成后再扫描
+    WATCH_RESCAN_SAFE = False
+
     def __init__(self, task_info_file, run_mode, sn):
         super().__init__(task_info_file, run_mode, sn)
         self.clip_size = 50 * 1024 * 1024 * 1024  # 50GB一组
@@ -23,7 +27,7 @@ class garcndUploader(BaseUploader):
         self.upload_date = current_time.strftime("%Y%m%d")
         self.ledger_engine = ledgerUtil(self.task_info.tags["cs_gac_data_record_url"])
         self.disk_info = None
-        self.kafka_producer = KafkaProducer(
+        self.kafka_producer = GetKafkaProducer(
             url=self.task_info.tags["Kafka_url"],
             usr=self.task_info.tags["Kafka_user_name"],
             pwd=self.task_info.tags["Kafka_password"],
@@ -181,7 +185,9 @@ class garcndUploader(BaseUploader):
         try:
             with open(meta_data_file, "r") as fp:
                 content = fp.read()
-            root_node = yaml.safe_load(content)
+            # 纯python解析，启用CPU进程池时在子进程中执行，不与上传线程争抢GIL
+            pool = GetCpuPool()
+            root_node = pool.Call(yaml.safe_load, content) if pool is not None else yaml.safe_load(content)
             nanoseconds_since_epoch = str(
                 root_node["gacbag_bagfile_information"]["starting_time"]["nanoseconds_since_epoch"])
             collection_time = str(root_node["gacbag_bagfile_information"]["starting_time"]["time"])
@@ -0,0 +1,122 @@
+import pytest
+
+from modules.CloudServices.EndpointBalancer import EndpointBalancer
+from util_modules.retry_util import CircuitBreaker, RetryPolicy, RetryBudget, IsRetryable
+import util_modules.retry_util as retry_util
+
+
+def _Breaker(**kwargs):
+    return CircuitBreaker("test", failure_threshold=2, open_seconds=10, max_open_seconds=30, **kwargs)
+
+
+def _Expire(breaker):
+    """ 跳过打开时长，下一次Acquire进入半开 """
+    breaker.open_until = 0.0
+
+
+def test_opens_after_consecutive_retryable_failures():
+    breaker = _Breaker()
+    assert breaker.Record(False) is False
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.Record(False) is True
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.Available()
+
+
+def test_success_resets_failures():
+    breaker = _Breaker()
+    breaker.Record(False)
+    breaker.Record(True)
+    breaker.Record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_success_closes():
+    breaker = _Breaker()
+    breaker.Record(False)
+    breaker.Record(False)
+    _Expire(breaker)
+    assert breaker.Available()
+    breaker.Acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.Available()
+    assert breaker.Record(True) is False
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.current_open_seconds == 10
+
+
+def test_half_open_trial_failure_reopens_with_doubled_duration():
+    breaker = _Breaker()
+    breaker.Record(False)
+    breaker.Record(False)
+    for expected in (20, 30):
+        _Expire(breaker)
+        breaker.Acquire()
+        assert breaker.Record(False) is True
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.current_open_seconds == expected
+
+
+def test_non_retryable_failure_leaves_state_unchanged():
+    breaker = _Breaker()
+    breaker.Record(False)
+    breaker.Record(False, retryable=False)
+    assert breaker.consecutive_failures == 1
+    breaker.Record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert breaker.Record(False, retryable=False) is True
+    assert breaker.state == CircuitBreaker.OPEN
+
+    _Expire(breaker)
+    breaker.Acquire()
+    assert breaker.Record(False, retryable=False) is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.current_open_seconds == 10
+    # 试探结束，下一个试探请求可以放行
+    assert breaker.Available()
+    breaker.Acquire()
+    assert breaker.Record(True) is False
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_credential_and_clock_errors_are_not_retryable():
+    class ClientError(Exception):
+        def __init__(self, code, status):
+            super().__init__(code)
+            self.response = {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+    assert not IsRetryable(ClientError("ExpiredToken", 400))
+    assert not IsRetryable(ClientError("RequestTimeTooSkewed", 403))
+    assert IsRetryable(ClientError("SlowDown", 503))
+
+
+def test_retry_picks_another_endpoint_when_breaker_open(monkeypatch):
+    monkeypatch.setattr(retry_util, "_breaker_kwargs", {"failure_threshold": 1, "open_seconds": 60})
+    balancer = EndpointBalancer(["a", "b"], breaker_name="test-pick")
+    calls = []
+
+    def send(index):
+        calls.append(index)
+        if index == 0:
+            raise ConnectionError("reset")
+        return True
+
+    policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0, budget=RetryBudget(min_retries=100))
+    balancer.stats[1].latency = 1.0  # 未熔断时优先选择未探索的endpoint a
+    assert policy.Call(balancer.Call, send, pick=balancer.PickBreaker) is True
+    assert calls == [0, 1]
+    assert balancer.Breaker(0).state == CircuitBreaker.OPEN
+    assert balancer.Breaker(1).state == CircuitBreaker.CLOSED
+    assert sum(stat.inflight for stat in balancer.stats) == 0
+
+
+def test_picked_endpoint_breaker_only_records_its_own_results(monkeypatch):
+    monkeypatch.setattr(retry_util, "_breaker_kwargs", {"failure_threshold": 1})
+    balancer = EndpointBalancer(["a", "b"], breaker_name="test-own")
+    policy = RetryPolicy(max_attempts=1, base_delay=0, max_delay=0, budget=RetryBudget(min_retries=100))
+    with pytest.raises(ConnectionError):
+        policy.Call(balancer.Call, lambda i: (_ for _ in ()).throw(ConnectionError("reset")),
+                    pick=lambda: (1, balancer.Breaker(1)))
+    assert balancer.Breaker(0).state == CircuitBreaker.CLOSED
+    assert balancer.Breaker(1).state == CircuitBreaker.OPEN
@@ -0,0 +1,90 @@
+import pytest
+
+from modules.CloudServices.EndpointBalancer import EndpointBalancer
+from modules.CloudServices.MultipartUpload import MultipartUpload
+from util_modules.retry_util import RetryPolicy, RetryBudget, StatusError
+import util_modules.retry_util as retry_util
+
+
+def _Inflight(balancer):
+    return sum(stat.inflight for stat in balancer.stats)
+
+
+def _Errors(balancer):
+    return sum(stat.errors for stat in balancer.stats)
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(retry_util, "_policy", RetryPolicy(max_attempts=2, base_delay=0, max_delay=0,
+                                                           budget=RetryBudget(min_retries=100)))
+
+
+def test_report_releases_inflight_and_classifies_errors():
+    balancer = EndpointBalancer(["a", "b"])
+    for error, counted in [(None, False), (FileNotFoundError("x"), False), (EOFError("short"), False),
+                           (StatusError(404), False), (StatusError(503), True), (ConnectionError("reset"), True)]:
+        index = balancer.Pick()
+        assert _Inflight(balancer) == 1
+        before = _Errors(balancer)
+        balancer.Report(index, 0.1, False, 0, error)
+        assert _Inflight(balancer) == 0
+        assert _Errors(balancer) - before == (1 if counted else 0)
+
+
+def test_call_releases_inflight():
+    balancer = EndpointBalancer(["a", "b"])
+    assert balancer.Call(lambda i: True)
+    assert balancer.Call(lambda i: False) is False
+    with pytest.raises(ConnectionError):
+        balancer.Call(lambda i: (_ for _ in ()).throw(ConnectionError("reset")))
+    assert _Inflight(balancer) == 0
+    assert _Errors(balancer) == 1
+
+
+def test_best_client_does_not_touch_inflight():
+    class Client:
+        def head(self, status):
+            raise StatusError(status)
+
+    balancer = EndpointBalancer(["a", "b"])
+    clients = [Client(), Client()]
+    balancer.Pick()
+    for status in (404, 503):
+        with pytest.raises(StatusError):
+            balancer.BestClient(clients).head(status)
+    assert _Inflight(balancer) == 1
+    assert _Errors(balancer) == 1
+
+
+def test_call_deferred_reports_once_when_finished():
+    balancer = EndpointBalancer(["a", "b"])
+    report = balancer.CallDeferred(lambda i, report: report)
+    assert _Inflight(balancer) == 1
+    report(True)
+    assert _Inflight(balancer) == 0
+    with pytest.raises(ConnectionError):
+        balancer.CallDeferred(lambda i, report: (_ for _ in ()).throw(ConnectionError("init failed")))
+    assert _Inflight(balancer) == 0
+    assert _Errors(balancer) == 1
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_multipart_upload_reports_through_on_finish(tmp_path, fail):
+    local_path = tmp_path / "data"
+    local_path.write_bytes(b"x" * 2500)
+    balancer = EndpointBalancer(["a", "b"])
+
+    def upload_part(part_number, reader, size):
+        reader.read()
+        if fail and part_number == 2:
+            raise StatusError(503)
+        return f"etag{part_number}"
+
+    upload = balancer.CallDeferred(
+        lambda i, report: MultipartUpload(str(local_path), 1000, upload_part, lambda parts: True, workers=2,
+                                          on_finish=report))
+    assert _Inflight(balancer) == 1
+    assert upload.Run() is not fail
+    assert _Inflight(balancer) == 0
+    assert _Errors(balancer) == (1 if fail else 0)
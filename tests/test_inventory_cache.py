@@ -0,0 +1,89 @@
+import os
+
+from modules.CloudServices.BaseService import BaseService
+from modules.CloudServices.InventoryCache import InventoryCache
+
+
+class FakeService(BaseService):
+    def __init__(self, objects=None):
+        self.objects = objects
+        self.list_calls = 0
+        self.head_calls = 0
+        self.uploaded = []
+
+    def ListObjects(self, prefix):
+        self.list_calls += 1
+        return self.objects
+
+    def IsFileExists(self, prefix):
+        self.head_calls += 1
+        return True
+
+    def UploadFile(self, prefix, local_path):
+        self.uploaded.append(prefix)
+        return True
+
+    def UploadFolder(self, prefix, local_path, inventory=None):
+        jobs = []
+        for root, _, files in os.walk(local_path):
+            for file in files:
+                local_file_path = os.path.join(root, file)
+                jobs.append((os.path.normpath(os.path.join(prefix, os.path.relpath(local_file_path, local_path))),
+                             local_file_path))
+        return self._UploadFilesConcurrently(jobs, local_path, inventory)
+
+    def DownloadFile(self, prefix, local_path):
+        return False
+
+    def DownloadFolder(self, prefix, local_path):
+        return False
+
+    def ListFiles(self, prefix, recursive=False):
+        return []
+
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        return None
+
+
+def test_prefix_matches_on_directory_boundary():
+    inventory = InventoryCache(FakeService([("a/b/x", 1, "e"), ("a/bc/y", 2, "e")]))
+    inventory.Prefetch("a/b")
+    assert inventory.Lookup("a/b/x") == (1, "e")
+    assert inventory.Lookup("a/bc/y") is None
+
+
+def test_lookup_outside_prefetched_prefix_sends_no_head():
+    conn = FakeService([("a/b/x", 1, "e")])
+    inventory = InventoryCache(conn)
+    inventory.Prefetch("a/b")
+    assert inventory.GetSize("c/d") is None
+    assert conn.head_calls == 0
+
+
+def test_failed_listing_is_not_cached():
+    conn = FakeService(None)
+    inventory = InventoryCache(conn)
+    assert inventory.Prefetch("a") is None
+    assert inventory.Lookup("a/x") is None
+    conn.objects = [("a/x", 3, None)]
+    inventory.Prefetch("a")
+    assert conn.list_calls == 2
+    assert inventory.GetSize("a/x") == 3
+
+
+def test_upload_folder_skips_existing_files(tmp_path):
+    folder = tmp_path / "clip"
+    folder.mkdir()
+    (folder / "same").write_bytes(b"12345")
+    (folder / "changed").write_bytes(b"123")
+    (folder / "new").write_bytes(b"1")
+    conn = FakeService([("bucket/same", 5, None), ("bucket/changed", 4, None)])
+    inventory = InventoryCache(conn)
+    inventory.Prefetch("bucket")
+
+    assert conn.UploadFolder("bucket", str(folder), inventory)
+    assert sorted(conn.uploaded) == ["bucket/changed", "bucket/new"]
+    # 上传成功的文件登记到清单，再次上传时全部跳过
+    conn.uploaded.clear()
+    assert conn.UploadFolder("bucket", str(folder), inventory)
+    assert conn.uploaded == []
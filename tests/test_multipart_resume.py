@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from modules.CloudServices.MultipartUpload import MultipartUpload
+from modules.CloudServices.UploadRecordStore import UploadRecordStore
+from util_modules.retry_util import RetryPolicy, RetryBudget, StatusError
+import util_modules.retry_util as retry_util
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(retry_util, "_policy", RetryPolicy(max_attempts=1, base_delay=0, max_delay=0,
+                                                           budget=RetryBudget(min_retries=100)))
+
+
+def _Upload(local_path, store, key, fail_parts=()):
+    """ 与obs.py相同的断点记录用法，返回(upload, 本次上传的分片, complete收到的分片) """
+    record = store.Get(key) or {"upload_id": "id", "parts": {}}
+    store.Put(key, record)
+    sent = []
+    completed = []
+    lock = threading.Lock()
+
+    def upload_part(part_number, reader, size):
+        data = reader.read()
+        if part_number in fail_parts:
+            raise StatusError(503)
+        with lock:
+            sent.append(part_number)
+        return f"etag{part_number}-{data[:1].decode()}"
+
+    def on_part_done(part_number, etag):
+        with lock:
+            record["parts"][str(part_number)] = etag
+            store.Put(key, record)
+
+    def complete(parts):
+        completed.extend(parts)
+        store.Delete(key)
+        return True
+
+    upload = MultipartUpload(str(local_path), 1000, upload_part, complete, workers=2,
+                             done_parts={int(n): etag for n, etag in record["parts"].items()},
+                             on_part_done=on_part_done)
+    return upload, sent, completed
+
+
+def test_resume_uploads_only_missing_parts(tmp_path):
+    local_path = tmp_path / "data"
+    local_path.write_bytes(b"a" * 1000 + b"b" * 1000 + b"c" * 500)
+    store = UploadRecordStore(str(tmp_path / "records"))
+    key = store.MakeKey("bucket", "remote/data", str(local_path))
+
+    upload, sent, completed = _Upload(local_path, store, key, fail_parts=(2,))
+    assert upload.Run() is False
+    assert sorted(sent) == [1, 3]
+    assert store.Get(key)["parts"] == {"1": "etag1-a", "3": "etag3-c"}
+    assert completed == []
+
+    upload, sent, completed = _Upload(local_path, store, key)
+    assert upload.Run() is True
+    assert sent == [2]
+    assert completed == [(1, "etag1-a"), (2, "etag2-b"), (3, "etag3-c")]
+    assert store.Get(key) is None
+
+
+def test_record_store_round_trip(tmp_path):
+    store = UploadRecordStore(str(tmp_path / "records"))
+    key = store.MakeKey("bucket", "remote/data", "data")
+    assert key != store.MakeKey("bucket", "remote/other", "data")
+    assert store.Get(key) is None
+    store.Put(key, {"upload_id": "id", "parts": {"1": "etag"}})
+    assert store.Get(key) == {"upload_id": "id", "parts": {"1": "etag"}}
+    store.Delete(key)
+    store.Delete(key)
+    assert store.Get(key) is None
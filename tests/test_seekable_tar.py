@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from modules.CloudServices.BaseService import BaseService
+from modules.CloudServices.SeekableTarReader import SeekableTarReader
+from util_modules.tar_util import IndexedTarWriter, INDEX_SUFFIX
+
+
+class LocalService(BaseService):
+    """ 以本地文件充当云端对象，只实现range读取 """
+    def __init__(self, ranged=True):
+        self.ranged = ranged
+
+    def GetObjectRange(self, prefix, offset=0, length=None):
+        with open(prefix, "rb") as fp:
+            fp.seek(offset)
+            return fp.read() if length is None else fp.read(length)
+
+    def SupportsObjectRange(self):
+        return self.ranged
+
+    def DownloadFile(self, prefix, local_path):
+        return False
+
+    def UploadFile(self, prefix, local_path):
+        return False
+
+    def UploadFolder(self, prefix, local_path, inventory=None):
+        return False
+
+    def DownloadFolder(self, prefix, local_path):
+        return False
+
+    def IsFileExists(self, prefix):
+        return os.path.exists(prefix)
+
+    def ListFiles(self, prefix, recursive=False):
+        return []
+
+
+def _WriteTar(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a").write_bytes(b"hello")
+    os.link(src / "a", src / "b")
+    os.mkfifo(src / "fifo")
+    tar_file = str(tmp_path / "x.tar")
+    writer = IndexedTarWriter(tar_file)
+    writer.AddTree(str(src))
+    writer.Close()
+    writer.WriteIndex(tar_file + INDEX_SUFFIX)
+    return tar_file
+
+
+def test_hard_link_member_reads_target_data(tmp_path):
+    reader = SeekableTarReader(LocalService(), _WriteTar(tmp_path))
+    assert sorted(reader.ListMembers()) == ["a", "b"]
+    assert reader.ReadMember("b") == b"hello"
+
+
+def test_reader_rejects_backend_without_ranged_get(tmp_path):
+    with pytest.raises(ValueError):
+        SeekableTarReader(LocalService(ranged=False), _WriteTar(tmp_path))
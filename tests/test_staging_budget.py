@@ -0,0 +1,35 @@
+import threading
+
+from util_modules.StagingBudget import StagingBudget
+
+
+def _Budget(tmp_path, monkeypatch, capacity):
+    monkeypatch.setattr(StagingBudget, "_FreeBytes", lambda self: capacity)
+    return StagingBudget(str(tmp_path), reserve_bytes=0)
+
+
+def test_acquire_without_wait_is_charged_and_holds_back_others(tmp_path, monkeypatch):
+    budget = _Budget(tmp_path, monkeypatch, 100)
+    common = budget.Acquire(80, "common", wait=False)
+    assert budget.Metrics()["charged_bytes"] == 80
+
+    admitted = threading.Event()
+
+    def acquire():
+        budget.Acquire(50, "clip")
+        admitted.set()
+
+    threading.Thread(target=acquire, daemon=True).start()
+    assert not admitted.wait(0.2)
+    budget.Release(common)
+    assert admitted.wait(5)
+
+
+def test_adjust_after_release_is_ignored(tmp_path, monkeypatch):
+    budget = _Budget(tmp_path, monkeypatch, 100)
+    ticket = budget.Acquire(10, "common", wait=False)
+    budget.Adjust(ticket, 30)
+    assert budget.Metrics()["charged_bytes"] == 30
+    budget.Release(ticket)
+    budget.Adjust(ticket, 50)
+    assert budget.Metrics()["charged_bytes"] == 0
@@ -0,0 +1,92 @@
+import os
+
+from util_modules.tar_util import (IndexedTarWriter, ChecksumFileWriter, CheckArchiveMarker, SourceFingerprint,
+                                   IterTree, DONE_SUFFIX)
+
+
+def _Source(tmp_path):
+    root = tmp_path / "src"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.bin").write_bytes(b"a" * 3000)
+    (root / "sub" / "b.bin").write_bytes(b"b" * 100)
+    return str(root), list(IterTree(str(root)))
+
+
+def _Archive(tmp_path, member_pairs):
+    """ 与platform_util._WriteArchive相同的不压缩归档流程 """
+    tar_file = str(tmp_path / "src.tar")
+    archive_writer = ChecksumFileWriter(tar_file)
+    writer = IndexedTarWriter(fileobj=archive_writer)
+    for src_path, arcname in member_pairs:
+        writer.AddFile(src_path, arcname)
+    writer.Close()
+    archive_writer.close()
+    writer.WriteMarker(tar_file, archive_writer)
+    return tar_file
+
+
+def test_valid_archive_passes(tmp_path):
+    _, member_pairs = _Source(tmp_path)
+    tar_file = _Archive(tmp_path, member_pairs)
+    assert os.path.exists(tar_file + DONE_SUFFIX)
+    assert CheckArchiveMarker(tar_file, member_pairs)
+    assert CheckArchiveMarker(tar_file, member_pairs, full=True)
+
+
+def test_missing_marker_fails(tmp_path):
+    _, member_pairs = _Source(tmp_path)
+    tar_file = _Archive(tmp_path, member_pairs)
+    os.remove(tar_file + DONE_SUFFIX)
+    assert not CheckArchiveMarker(tar_file, member_pairs)
+
+
+def test_changed_source_size_fails(tmp_path):
+    root, member_pairs = _Source(tmp_path)
+    tar_file = _Archive(tmp_path, member_pairs)
+    with open(os.path.join(root, "sub", "b.bin"), "ab") as fp:
+        fp.write(b"b")
+    assert not CheckArchiveMarker(tar_file, member_pairs)
+
+
+def test_changed_source_mtime_fails(tmp_path):
+    root, member_pairs = _Source(tmp_path)
+    tar_file = _Archive(tmp_path, member_pairs)
+    src_path = os.path.join(root, "a.bin")
+    st = os.stat(src_path)
+    os.utime(src_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert not CheckArchiveMarker(tar_file, member_pairs)
+
+
+def test_new_file_in_directory_does_not_change_existing_members(tmp_path):
+    root, member_pairs = _Source(tmp_path)
+    tar_file = _Archive(tmp_path, member_pairs)
+    # 目录mtime不计入指纹，目录下新增的非成员文件不影响已有归档
+    (tmp_path / "src" / "sub" / "new.bin").write_bytes(b"n")
+    assert CheckArchiveMarker(tar_file, member_pairs)
+
+
+def test_full_check_detects_corruption(tmp_path):
+    _, member_pairs = _Source(tmp_path)
+    tar_file = _Archive(tmp_path, member_pairs)
+    with open(tar_file, "r+b") as fp:
+        fp.seek(600)
+        data = fp.read(1)
+        fp.seek(600)
+        fp.write(bytes([data[0] ^ 0xff]))
+    assert CheckArchiveMarker(tar_file, member_pairs)
+    assert not CheckArchiveMarker(tar_file, member_pairs, full=True)
+
+
+def test_truncated_archive_fails(tmp_path):
+    _, member_pairs = _Source(tmp_path)
+    tar_file = _Archive(tmp_path, member_pairs)
+    with open(tar_file, "r+b") as fp:
+        fp.truncate(os.path.getsize(tar_file) - 512)
+    assert not CheckArchiveMarker(tar_file, member_pairs)
+
+
+def test_fingerprint_ignores_member_order(tmp_path):
+    _, member_pairs = _Source(tmp_path)
+    assert SourceFingerprint(member_pairs) == SourceFingerprint(list(reversed(member_pairs)))
+    renamed = [(src_path, arcname.replace("a.bin", "c.bin")) for src_path, arcname in member_pairs]
+    assert SourceFingerprint(member_pairs) != SourceFingerprint(renamed)
@@ -0,0 +1,215 @@
+"""
+上传并发自动调节（AIMD）
+按固定周期统计完成的传输任务，根据有效吞吐（goodput）、单位数据耗时与失败数调整在途任务上限：
+  - 起步阶段（slow start）：吞吐持续上升时上限翻倍
+  - 吞吐仍上升时加性增加；吞吐不再上升时回落到达到最高吞吐的上限（拐点）并保持，定期试探+1
+  - 出现失败或单位数据耗时超过基准的latency_ratio倍时乘性减小，减小前已开始的任务不再重复触发；
+    出现失败时的并发作为上限记录下来，之后增加并发不超过该值，保持一段时间后才重新试探
+拐点处的吞吐基准每个周期更新，链路带宽变化后可以重新收敛
+"""
+import logging
+import threading
+import time
+
+
+class AimdController:
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64, window_seconds=5.0, gain=0.05,
+                 latency_ratio=3.0, decrease_factor=0.7, probe_windows=6, clock=time.monotonic, name="upload"):
+        """
+        initial_limit : 初始在途任务数
+        min_limit / max_limit : 上下限
+        window_seconds : 统计周期
+        gain : 吞吐提升超过该比例（并发较高时为0.5/limit，即线性增长预期的一半）才视为增加并发有效
+        latency_ratio : 单位数据耗时超过基准的倍数时减小并发
+        decrease_factor : 乘性减小系数
+        probe_windows : 在拐点保持多少个周期后试探增加并发
+        clock : 时钟函数，模拟测试时可替换
+        """
+        self.limit = max(min_limit, min(max_limit, initial_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window_seconds = window_seconds
+        self.gain = gain
+        self.latency_ratio = latency_ratio
+        self.decrease_factor = decrease_factor
+        self.probe_windows = probe_windows
+        self.clock = clock
+        self.name = name
+
+        self.lock = threading.Lock()
+        self.slow_start = True
+        self.best_goodput = 0.0
+        self.best_limit = self.limit
+        self.base_latency = None  # 单位数据耗时（秒/MB）的最小值
+        self.hold_windows = 0
+        self.fail_limit = None  # 出现失败时的并发
+        self.last_decrease = None
+        self.window_start = clock()
+        self.window_bytes = 0
+        self.window_seconds_sum = 0.0
+        self.window_mb = 0.0
+        self.window_jobs = 0
+        self.window_errors = 0
+        self.decisions = 0
+
+    def Limit(self):
+        return self.limit
+
+    def Record(self, nbytes, seconds, ok=True):
+        """ 任务结束后上报数据量、耗时与结果，上限发生变化时返回True """
+        with self.lock:
+            self.window_jobs += 1
+            # 上次减小并发之前开始的任务，其失败与耗时反映的是旧的并发
+            stale = self.last_decrease is not None and self.clock() - seconds < self.last_decrease
+            if ok:
+                self.window_bytes += nbytes
+                # 小文件以1MB计，避免请求往返时间被放大成单位数据耗时
+                if not stale:
+                    self.window_mb += max(nbytes, pow(1024, 2)) / pow(1024, 2)
+                    self.window_seconds_sum += seconds
+            elif not stale:
+                self.window_errors += 1
+            elapsed = self.clock() - self.window_start
+            if elapsed < self.window_seconds:
+                return False
+            return self._Adjust(elapsed)
+
+    def _Adjust(self, elapsed):
+        """ 在self.lock内调用 """
+        goodput = self.window_bytes / elapsed
+        latency = self.window_seconds_sum / self.window_mb if self.window_mb > 0 else None
+        if latency is not None:
+            self.base_latency = latency if self.base_latency is None else min(latency, self.base_latency * 1.02)
+        old_limit = self.limit
+        if self.window_errors > 0:
+            reason = f"{self.window_errors}/{self.window_jobs} failed"
+            self.fail_limit = self.limit
+            self._Decrease()
+        elif latency is not None and latency > self.base_latency * self.latency_ratio:
+            reason = f"latency {latency * 1000:.0f}ms/MB > {self.latency_ratio} x base {self.base_latency * 1000:.0f}ms/MB"
+            self._Decrease()
+        elif goodput > self.best_goodput * (1 + min(self.gain, max(0.01, 0.5 / self.limit))):
+            reason = "goodput rising"
+            self.best_goodput = goodput
+            self.best_limit = self.limit
+            self.hold_windows = 0
+            self.limit = self.limit * 2 if self.slow_start else self.limit + 1
+            if self.fail_limit is not None and self.limit >= self.fail_limit:
+                reason = f"goodput rising, capped below failure point {self.fail_limit}"
+                self.limit = max(old_limit, self.fail_limit - 1)
+        else:
+            # 吞吐不再上升：回到最高吞吐对应的并发并保持，定期试探
+            self.slow_start = False
+            self.hold_windows += 1
+            if self.limit > self.best_limit:
+                reason = "goodput flat, back to knee"
+                self.limit = self.best_limit
+                self.hold_windows = 0
+            elif self.fail_limit is not None and self.limit + 1 >= self.fail_limit:
+                # 紧贴失败点时保持更久才试探
+                self.best_goodput = goodput
+                if self.hold_windows >= self.probe_windows * 10:
+                    reason = f"forget failure point {self.fail_limit}"
+                    self.fail_limit = None
+                    self.hold_windows = 0
+                else:
+                    reason = "hold below failure point"
+            else:
+                # 在拐点处以最新测量值作为比较基准，链路带宽变化后可以重新收敛
+                self.best_goodput = goodput
+                if self.hold_windows >= self.probe_windows:
+                    reason = "probe"
+                    self.hold_windows = 0
+                    self.limit += 1
+                else:
+                    reason = "hold"
+        self.limit = max(self.min_limit, min(self.max_limit, int(self.limit)))
+        self.decisions += 1
+        if self.limit != old_limit:
+            logging.info(f"[{self.name}] concurrency {old_limit} -> {self.limit} ({reason}), "
+                         f"goodput={goodput * 8 / pow(1000, 2):.1f}Mbit/s, jobs={self.window_jobs}")
+        else:
+            logging.debug(f"[{self.name}] concurrency {self.limit} ({reason}), "
+                          f"goodput={goodput * 8 / pow(1000, 2):.1f}Mbit/s")
+        self.window_start = self.clock()
+        self.window_bytes = 0
+        self.window_seconds_sum = 0.0
+        self.window_mb = 0.0
+        self.window_jobs = 0
+        self.window_errors = 0
+        return self.limit != old_limit
+
+    def _Decrease(self):
+        self.last_decrease = self.clock()
+        self.slow_start = False
+        self.hold_windows = 0
+        self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+        self.best_limit = self.limit
+        self.best_goodput = 0.0
+
+    def Metrics(self):
+        with self.lock:
+            return {
+                "limit": self.limit,
+                "best_limit": self.best_limit,
+                "fail_limit": self.fail_limit,
+                "best_goodput_mbit_s": round(self.best_goodput * 8 / pow(1000, 2), 1),
+                "base_latency_per_mb": self.base_latency,
+                "decisions": self.decisions
+            }
+
+
+"""
+模拟测试：python -m util_modules.AimdController [bandwidth_mbit] [rtt_ms] [per_conn_mbit] [server_max_conn]
+按流体模型模拟共享链路：每个在途任务的速率为 min(单连接上限, 总带宽/在途数)，每个任务额外等待一个RTT，
+在途数超过server_max_conn时服务端返回失败；统计后半段的有效吞吐占可用带宽的比例（要求>=90%）
+"""
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    scenarios = [tuple(float(x) for x in sys.argv[1:5])] if len(sys.argv) > 4 else [
+        # 带宽Mbit/s, RTT ms, 单连接上限Mbit/s, 服务端并发上限
+        (100, 80, 20, 1000),  # 4G
+        (1000, 30, 50, 1000),  # 千兆
+        (10000, 5, 200, 1000),  # 万兆光纤
+        (10000, 5, 200, 40),  # 服务端限流
+    ]
+    job_size = 8 * pow(1024, 2)
+    dt = 0.01
+    duration = 600.0
+
+    for bandwidth_mbit, rtt_ms, per_conn_mbit, server_max_conn in scenarios:
+        bandwidth = bandwidth_mbit * pow(1000, 2) / 8
+        per_conn = per_conn_mbit * pow(1000, 2) / 8
+        rtt = rtt_ms / 1000
+        now = [0.0]
+        controller = AimdController(initial_limit=2, max_limit=256, window_seconds=2.0, clock=lambda: now[0],
+                                    name=f"sim {bandwidth_mbit:.0f}Mbit")
+        jobs = []  # [start, remaining_bytes, rtt_remaining]
+        sent_second_half = 0
+        while now[0] < duration:
+            while len(jobs) < controller.Limit():
+                jobs.append([now[0], job_size, rtt])
+            active = [job for job in jobs if job[2] <= 0]
+            rate = min(per_conn, bandwidth / len(active)) if active else 0
+            finished = []
+            for job in jobs:
+                if job[2] > 0:
+                    job[2] -= dt
+                    continue
+                job[1] -= rate * dt
+                if job[1] <= 0:
+                    finished.append(job)
+            now[0] += dt
+            failed = len(jobs) > server_max_conn
+            for job in finished:
+                jobs.remove(job)
+                controller.Record(job_size, now[0] - job[0], ok=not failed)
+                if not failed and now[0] >= duration / 2:
+                    sent_second_half += job_size
+        goodput = sent_second_half / (duration / 2)
+        available = min(bandwidth, per_conn * server_max_conn)
+        print(f"bandwidth={bandwidth_mbit:.0f}Mbit/s rtt={rtt_ms:.0f}ms per_conn={per_conn_mbit:.0f}Mbit/s "
+              f"server_max_conn={server_max_conn:.0f} : goodput={goodput * 8 / pow(1000, 2):.1f}Mbit/s "
+              f"({goodput / available * 100:.1f}% of available), final limit={controller.Limit()}")
@@ -0,0 +1,230 @@
+"""
+CPU密集阶段的进程池
+打包压缩、元数据解析等CPU密集的工作在同一个解释器的多个线程中执行时会争抢GIL，多核上传机CPU利用率上不去。
+cpu_stage_mode为process时这些阶段交给进程池执行，网络I/O仍然在线程中：
+  - SubmitCompress : 数据块通过共享内存传给子进程压缩，压缩结果写回共享内存，不经过pickle
+    共享内存按slot划分（每个slot为一个输入区与一个输出区），slot用完时提交方等待，限制在途数据量
+  - Call : 执行模块级函数（如yaml.safe_load），参数与返回值通过pickle传递，适用于元数据解析等数据量小、计算量大的调用
+"""
+import atexit
+import concurrent.futures
+import gzip
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+# 压缩后超过输入大小时的余量，超过输出区大小的结果直接pickle返回
+_OUT_OVERHEAD = 64 * 1024
+
+_attached = {}  # 子进程中已打开的共享内存 <name, SharedMemory>
+
+
+def _Attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        # 子进程与父进程共用同一个resource_tracker，重复登记不会导致共享内存在子进程退出时被删除
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = shm
+    return shm
+
+
+def _CompressSlot(name, in_offset, length, out_offset, out_capacity, codec, level):
+    """ 子进程中执行：压缩共享内存输入区的数据，写入输出区，返回(输出长度, 超出输出区时的数据, cpu耗时) """
+    st = time.process_time()
+    shm = _Attach(name)
+    block = shm.buf[in_offset:in_offset + length]
+    try:
+        if codec == "gzip":
+            data = gzip.compress(block, compresslevel=level, mtime=0)
+        elif codec == "lz4":
+            import lz4.frame
+            data = lz4.frame.compress(block, compression_level=level)
+        elif codec == "zstd":
+            import zstandard
+            params = zstandard.ZstdCompressionParameters.from_level(level)
+            data = zstandard.ZstdCompressor(compression_params=params).compress(block)
+        else:
+            raise ValueError(f"unsupported codec {codec}")
+    finally:
+        block.release()
+    if len(data) > out_capacity:
+        return -1, data, time.process_time() - st
+    shm.buf[out_offset:out_offset + len(data)] = data
+    return len(data), None, time.process_time() - st
+
+
+class CpuPool:
+    def __init__(self, workers=None, slot_size=4 * 1024 * 1024, slots=None):
+        """
+        workers : 子进程数，默认为CPU核数
+        slot_size : 每个slot可以容纳的最大数据块，不小于压缩块大小
+        slots : slot数量，默认workers * 2，决定在途的数据块上限
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.slot_size = slot_size
+        self.out_size = slot_size + _OUT_OVERHEAD
+        self.slots = slots or self.workers * 2
+        # forkserver：子进程不继承父进程的线程与锁状态，又比spawn启动快
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                               mp_context=multiprocessing.get_context(method))
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * (self.slot_size + self.out_size))
+        self.free_slots = queue.Queue()
+        for i in range(self.slots):
+            self.free_slots.put(i)
+        self.lock = threading.Lock()
+        self.tasks = 0
+        self.bytes_in = 0
+        self.cpu_seconds = 0.0
+        self.slot_wait_seconds = 0.0
+        self.closed = False
+        logging.info(f"CPU进程池：{self.workers}个进程（{method}），共享内存{self.slots}个slot，"
+                     f"共{self.shm.size / pow(1024, 2):.0f}MB")
+
+    def _Offsets(self, slot):
+        base = slot * (self.slot_size + self.out_size)
+        return base, base + self.slot_size
+
+    def SubmitCompress(self, block, codec="gzip", level=6):
+        """ 返回Future，结果为(压缩后的数据, cpu耗时)，与ParallelCompressWriter._Compress一致 """
+        if len(block) > self.slot_size:
+            raise ValueError(f"block size {len(block)} exceeds slot size {self.slot_size}")
+        st = time.time()
+        slot = self.free_slots.get()
+        wait_seconds = time.time() - st
+        in_offset, out_offset = self._Offsets(slot)
+        self.shm.buf[in_offset:in_offset + len(block)] = block
+        with self.lock:
+            self.tasks += 1
+            self.bytes_in += len(block)
+            self.slot_wait_seconds += wait_seconds
+        result = concurrent.futures.Future()
+
+        def onDone(inner):
+            try:
+                length, data, cpu_seconds = inner.result()
+                if length >= 0:
+                    data = bytes(self.shm.buf[out_offset:out_offset + length])
+                with self.lock:
+                    self.cpu_seconds += cpu_seconds
+                result.set_result((data, cpu_seconds))
+            except BaseException as e:
+                result.set_exception(e)
+            finally:
+                self.free_slots.put(slot)
+
+        try:
+            inner = self.executor.submit(_CompressSlot, self.shm.name, in_offset, len(block), out_offset,
+                                         self.out_size, codec, level)
+        except BaseException:
+            self.free_slots.put(slot)
+            raise
+        inner.add_done_callback(onDone)
+        return result
+
+    def Submit(self, func, *args, **kwargs):
+        """ func需要是模块级函数 """
+        with self.lock:
+            self.tasks += 1
+        return self.executor.submit(func, *args, **kwargs)
+
+    def Call(self, func, *args, **kwargs):
+        return self.Submit(func, *args, **kwargs).result()
+
+    def Metrics(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "tasks": self.tasks,
+                "compress_mb": round(self.bytes_in / pow(1024, 2), 1),
+                "cpu_seconds": round(self.cpu_seconds, 2),
+                "slot_wait_seconds": round(self.slot_wait_seconds, 2)
+            }
+
+    def Close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.executor.shutdown(wait=True)
+        self.shm.close()
+        self.shm.unlink()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def InitCpuPool(workers=None, slot_size=4 * 1024 * 1024, slots=None) -> CpuPool:
+    """ 常驻进程中多个任务共享同一个进程池，已创建时直接返回 """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CpuPool(workers=workers, slot_size=slot_size, slots=slots)
+            atexit.register(_pool.Close)
+        return _pool
+
+
+def GetCpuPool():
+    """ 未启用进程模式时返回None，调用方在当前进程的线程中执行 """
+    return _pool
+
+
+"""
+性能测试：python -m util_modules.CpuPool [size_mb] [max_workers]
+分别用线程池与进程池（共享内存）执行压缩与元数据解析，对比1到N个worker的吞吐
+"""
+
+
+def _MetadataText(i):
+    return "\n".join(f'{{"topic": "/sensor/cam_{j}", "frame": {i * 100 + j}, "stamp": {i * 0.1 + j:.6f}, '
+                     f'"tags": ["front", "raw", "h265"], "calib": [{", ".join(str(k * 0.01) for k in range(12))}]}}'
+                     for j in range(200))
+
+
+def _ParseMetadata(text):
+    """ 纯python解析，代表yaml等不释放GIL的元数据解析 """
+    import json
+    records = [json.loads(line) for line in text.splitlines()]
+    return sum(len(str(record)) for record in records)
+
+
+if __name__ == "__main__":
+    from util_modules.tar_util import ParallelCompressWriter
+    import tempfile
+
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    # 可压缩的数据（重复的文本与随机数据交错）
+    chunk = (b"".join(f"frame={i},ts={i * 0.033:.3f},ok\n".encode() for i in range(40000)) + os.urandom(256 * 1024))
+    payload = (chunk * (size_mb * 1024 * 1024 // len(chunk) + 1))[:size_mb * 1024 * 1024]
+    texts = [_MetadataText(i) for i in range(400)]
+    counts = sorted({1, 2, 4, 8, 16, 32, max_workers} & set(range(1, max_workers + 1)))
+    output = os.path.join(tempfile.mkdtemp(prefix="cpu_pool_bench_"), "out.tgz")
+    print(f"cpu={os.cpu_count()}, compress {size_mb}MB gzip-6, parse {len(texts)} metadata files")
+    for workers in counts:
+        pool = CpuPool(workers=workers)
+        results = []
+        for mode in ("thread", "process"):
+            st = time.perf_counter()
+            writer = ParallelCompressWriter(output, workers=workers, pool=pool if mode == "process" else None)
+            for offset in range(0, len(payload), 1024 * 1024):
+                writer.write(payload[offset:offset + 1024 * 1024])
+            writer.close()
+            compress_cost = time.perf_counter() - st
+
+            st = time.perf_counter()
+            if mode == "process":
+                list(pool.executor.map(_ParseMetadata, texts, chunksize=4))
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(_ParseMetadata, texts))
+            parse_cost = time.perf_counter() - st
+            results.append(f"{mode}: compress {size_mb / compress_cost:7.1f} MB/s, parse {len(texts) / parse_cost:7.1f} files/s")
+        pool.Close()
+        print(f"workers={workers:<3} " + " | ".join(results))
+    os.remove(output)
@@ -0,0 +1,211 @@
+"""
+监听正在写入的目录树
+用inotify递归监听root下的所有目录，记录每个路径（及其所有上级目录）最近一次发生变化的时间，
+用于判断数据包是否已经拷贝完成：
+  - LastChange(path) : path及其子路径最近一次变化的时间，监听开始前已存在且之后没有变化的路径返回监听开始时间
+  - IsSettled(path, settle_seconds) : 超过settle_seconds没有变化
+  - HasMarker(path, names) : path目录下存在标记文件（如storage_info.json），拷贝工具最后写入，出现即视为完成
+inotify不可用（非Linux、max_user_watches不足）时退化为遍历目录取最大ctime（拷贝工具可以保留mtime，不能保留ctime）
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def _LoadLibc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class DirectoryWatcher:
+    def __init__(self, root, ignore_names=(), ignore_roots=()):
+        """
+        root : 监听的根目录
+        ignore_names : 忽略这些文件名的变化（上传器自己写入数据包的文件，如batch.txt）
+        ignore_roots : 忽略这些目录下的变化（如位于root内的输出目录）
+        """
+        self.root = os.path.abspath(root)
+        self.ignore_names = set(ignore_names)
+        self.ignore_roots = [os.path.abspath(path) for path in ignore_roots]
+        self.start_time = time.time()
+        self.cond = threading.Condition()
+        self.changes = {}  # <path, 最近一次变化时间>，变化同时记到所有上级目录
+        self.events = 0
+        self.marker_names = set()
+        self.marker_events = 0  # 标记文件出现的次数，等待方据此提前重新扫描
+        self.watches = {}  # <wd, dir path>
+        self.fd = None
+        self.inotify = False
+        self.stopped = False
+        self._Start()
+
+    def _Start(self):
+        libc = _LoadLibc()
+        if libc is None:
+            logging.warning("inotify不可用，按目录ctime判断数据是否拷贝完成")
+            return
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logging.warning(f"inotify_init1 failed : {os.strerror(ctypes.get_errno())}，按目录ctime判断数据是否拷贝完成")
+            return
+        self.libc = libc
+        self.fd = fd
+        if not self._AddTree(self.root):
+            os.close(self.fd)
+            self.fd = None
+            return
+        self.inotify = True
+        logging.info(f"inotify监听{self.root}，共{len(self.watches)}个目录")
+        threading.Thread(target=self._Loop, daemon=True).start()
+
+    def _Ignored(self, path):
+        return any(path == root or path.startswith(root + os.sep) for root in self.ignore_roots)
+
+    def _AddTree(self, top):
+        """ 递归添加监听，目录数超过fs.inotify.max_user_watches时返回False """
+        for dirpath, dirnames, _ in os.walk(top):
+            if self._Ignored(dirpath):
+                dirnames[:] = []
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, dirpath.encode(), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    logging.warning(f"inotify监听数量超过上限（fs.inotify.max_user_watches），按目录ctime判断数据是否拷贝完成")
+                    return False
+                continue  # 目录在遍历期间被删除
+            self.watches[wd] = dirpath
+        return True
+
+    def _Loop(self):
+        while not self.stopped:
+            readable, _, _ = select.select([self.fd], [], [], 1.0)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError:
+                break
+            if self.stopped:
+                break
+            offset = 0
+            now = time.time()
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + name_len].rstrip(b"\0").decode(
+                    errors="surrogateescape")
+                offset += _EVENT_HEADER.size + name_len
+                if mask & IN_Q_OVERFLOW:
+                    # 事件丢失，视为整个目录树都发生了变化
+                    logging.warning("inotify event queue overflow")
+                    self._Touch(self.root, now, False)
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                parent = self.watches.get(wd)
+                if parent is None or name in self.ignore_names:
+                    continue
+                path = os.path.join(parent, name) if name else parent
+                if self._Ignored(path):
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._AddTree(path)
+                self._Touch(path, now, name in self.marker_names and mask & (IN_CLOSE_WRITE | IN_MOVED_TO))
+        os.close(self.fd)
+
+    def _Touch(self, path, now, is_marker):
+        with self.cond:
+            self.events += 1
+            if is_marker:
+                self.marker_events += 1
+            while True:
+                self.changes[path] = now
+                if path == self.root or len(path) <= len(self.root):
+                    break
+                path = os.path.dirname(path)
+            self.cond.notify_all()
+
+    def WatchMarkers(self, names):
+        """ 这些文件写入完成时通知等待方 """
+        with self.cond:
+            self.marker_names.update(names)
+
+    def LastChange(self, path):
+        path = os.path.abspath(path)
+        if not self.inotify:
+            return max(self.start_time, self._MaxCtime(path))
+        with self.cond:
+            return self.changes.get(path, self.start_time)
+
+    def IsSettled(self, path, settle_seconds):
+        return time.time() - self.LastChange(path) >= settle_seconds
+
+    @staticmethod
+    def HasMarker(path, names):
+        folder = path if os.path.isdir(path) else os.path.dirname(path)
+        return any(os.path.exists(os.path.join(folder, name)) for name in names)
+
+    def _MaxCtime(self, path):
+        try:
+            latest = os.lstat(path).st_ctime
+        except OSError:
+            return time.time()
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in dirnames + filenames:
+                if name in self.ignore_names:
+                    continue
+                try:
+                    latest = max(latest, os.lstat(os.path.join(dirpath, name)).st_ctime)
+                except OSError:
+                    continue
+        return latest
+
+    def Wait(self, marker_events, timeout):
+        """ 等待timeout秒，期间有新的标记文件写入完成时提前返回，返回(events, marker_events) """
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.marker_events == marker_events and not self.stopped:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(timeout=remaining)
+            return self.events, self.marker_events
+
+    def Counters(self):
+        with self.cond:
+            return self.events, self.marker_events
+
+    def Stop(self):
+        """ 监听线程在下一次select超时后关闭inotify """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
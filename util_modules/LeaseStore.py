@@ -0,0 +1,275 @@
+"""
+多个上传进程（一台或多台机器，如通过NFS挂载同一块硬盘）协同上传同一个input_root
+每个分组上传前在共享的sqlite数据库中领取有时限的租约，上传期间后台线程定期续约：
+  - TryClaim : 返回LEASE_CLAIMED（领取成功）、LEASE_BUSY（其他进程持有未过期的租约）或LEASE_DONE（已完成）；
+    持有者退出（崩溃、被kill）后租约不再续约，过期后由其他进程接手
+  - Complete : 只有当前持有者可以标记完成，租约已被其他进程接手时返回False，调用方不再通知平台，保证每个分组只完成一次
+  - Release : 上传失败时释放租约，其他进程可以立即接手
+  - SetPackage/GetPackage : 租约中记录分组在平台创建的数据包（packageId与对象存储前缀），接手过期或已释放的租约时
+    沿用同一个数据包，不重复创建、不上传到新的前缀
+数据库放在共享存储上时使用默认的DELETE日志模式（WAL依赖共享内存，不能跨机器使用）；租约按各机器的本地时间判断，需开启时间同步
+"""
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+LEASE_CLAIMED = "claimed"
+LEASE_BUSY = "busy"
+LEASE_DONE = "done"
+
+
+class LeaseStore:
+    def __init__(self, db_file, lease_seconds=300, owner=None):
+        """
+        db_file : 所有上传进程共享的数据库文件
+        lease_seconds : 租约时长，每lease_seconds/3续约一次
+        owner : 持有者标识，默认 主机名:pid:随机后缀
+        """
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.timeout = 60.0  # 共享存储上的锁等待时间
+        self._local = threading.local()
+        self.lock = threading.Lock()
+        self.held = set()  # 当前持有的租约
+        self.stop_event = threading.Event()
+        self.heartbeat = None
+        self.claimed = 0
+        self.reclaimed = 0  # 接手的过期租约
+        self.busy = 0
+        self.lost = 0  # 续约失败（租约已被其他进程接手）
+        self.complete_lost = 0  # 上传完成时租约已被其他进程接手，由对方通知平台
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self._InitDb()
+
+    def _Connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：手动BEGIN IMMEDIATE，领取时先拿写锁，避免两个进程同时读到空闲状态
+            conn = sqlite3.connect(self.db_file, timeout=self.timeout, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _InitDb(self):
+        self._Connect().execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                lease_key TEXT PRIMARY KEY,
+                label TEXT,
+                owner TEXT,
+                expires REAL,
+                state TEXT,
+                attempts INTEGER,
+                updated REAL,
+                package_id TEXT,
+                object_root TEXT
+            )
+        ''')
+        # 兼容没有数据包字段的旧数据库
+        columns = {row[1] for row in self._Connect().execute("PRAGMA table_info(leases)")}
+        for column in ("package_id", "object_root"):
+            if column not in columns:
+                self._Connect().execute(f"ALTER TABLE leases ADD COLUMN {column} TEXT")
+
+    def _Execute(self, func):
+        """ 在写事务中执行func(conn) """
+        conn = self._Connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def GroupKey(scope, package_keys):
+        """ 分组的租约标识：各进程扫描同一块硬盘生成相同的分组，按数据包key生成，与分组编号无关 """
+        digest = hashlib.sha1("\n".join(sorted(package_keys)).encode("utf-8", "surrogateescape")).hexdigest()
+        return f"{scope}/{digest}"
+
+    def TryClaim(self, lease_key, label=""):
+        def claim(conn):
+            now = time.time()
+            row = conn.execute("SELECT owner, expires, state FROM leases WHERE lease_key = ?", (lease_key,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO leases (lease_key, label, owner, expires, state, attempts, updated) "
+                             "VALUES (?, ?, ?, ?, 'leased', 1, ?)",
+                             (lease_key, label, self.owner, now + self.lease_seconds, now))
+                return LEASE_CLAIMED, None
+            owner, expires, state = row
+            if state == LEASE_DONE:
+                return LEASE_DONE, owner
+            if owner != self.owner and expires > now:
+                return LEASE_BUSY, owner
+            conn.execute("UPDATE leases SET owner = ?, expires = ?, attempts = attempts + 1, updated = ? "
+                         "WHERE lease_key = ?", (self.owner, now + self.lease_seconds, now, lease_key))
+            return LEASE_CLAIMED, owner if owner != self.owner and expires > 0 else None
+
+        status, previous_owner = self._Execute(claim)
+        with self.lock:
+            if status == LEASE_CLAIMED:
+                self.claimed += 1
+                self.held.add(lease_key)
+                if previous_owner is not None:
+                    self.reclaimed += 1
+                    logging.warning(f"租约{label or lease_key}已过期（原持有者{previous_owner}），由{self.owner}接手")
+                self._StartHeartbeat()
+            elif status == LEASE_BUSY:
+                self.busy += 1
+        return status
+
+    def Complete(self, lease_key):
+        """ 标记完成，租约已被其他进程接手时返回False """
+        with self.lock:
+            self.held.discard(lease_key)
+        ok = self._Execute(lambda conn: conn.execute(
+            "UPDATE leases SET state = 'done', updated = ? WHERE lease_key = ? AND owner = ? AND state = 'leased'",
+            (time.time(), lease_key, self.owner)).rowcount == 1)
+        if not ok:
+            with self.lock:
+                self.complete_lost += 1
+        return ok
+
+    def SetPackage(self, lease_key, package_id, object_root):
+        """ 记录分组在平台创建的数据包，只有当前持有者可以写入 """
+        return self._Execute(lambda conn: conn.execute(
+            "UPDATE leases SET package_id = ?, object_root = ?, updated = ? WHERE lease_key = ? AND owner = ?",
+            (package_id, object_root, time.time(), lease_key, self.owner)).rowcount == 1)
+
+    def GetPackage(self, lease_key):
+        """ 返回之前的持有者创建的(package_id, object_root)，没有时返回None """
+        row = self._Connect().execute("SELECT package_id, object_root FROM leases WHERE lease_key = ?",
+                                      (lease_key,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row[0], row[1]
+
+    def Release(self, lease_key):
+        """ 释放未完成的租约（已完成或已被接手时不做任何修改） """
+        with self.lock:
+            if lease_key not in self.held:
+                return
+            self.held.discard(lease_key)
+        self._Execute(lambda conn: conn.execute(
+            "UPDATE leases SET expires = 0, updated = ? WHERE lease_key = ? AND owner = ? AND state = 'leased'",
+            (time.time(), lease_key, self.owner)))
+
+    def IsDone(self, lease_key):
+        row = self._Connect().execute("SELECT state FROM leases WHERE lease_key = ?", (lease_key,)).fetchone()
+        return row is not None and row[0] == LEASE_DONE
+
+    def _StartHeartbeat(self):
+        """ 在self.lock内调用 """
+        if self.heartbeat is None or not self.heartbeat.is_alive():
+            self.heartbeat = threading.Thread(target=self._Heartbeat, daemon=True, name="lease-heartbeat")
+            self.heartbeat.start()
+
+    def _Heartbeat(self):
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            with self.lock:
+                keys = list(self.held)
+            if not keys:
+                continue
+            try:
+                lost = self._Execute(lambda conn: self._Renew(conn, keys))
+            except sqlite3.Error as e:
+                # 共享存储暂时不可用，下次继续续约
+                logging.warning(f"续约失败 : {e}")
+                continue
+            if lost:
+                with self.lock:
+                    self.held.difference_update(lost)
+                    self.lost += len(lost)
+                logging.error(f"{len(lost)}个租约已被其他上传进程接手（续约间隔超过租约时长）：{lost}")
+
+    def _Renew(self, conn, keys):
+        expires = time.time() + self.lease_seconds
+        lost = []
+        for key in keys:
+            if conn.execute("UPDATE leases SET expires = ? WHERE lease_key = ? AND owner = ? AND state = 'leased'",
+                            (expires, key, self.owner)).rowcount != 1:
+                lost.append(key)
+        return lost
+
+    def Metrics(self):
+        with self.lock:
+            return {
+                "owner": self.owner,
+                "claimed": self.claimed,
+                "reclaimed": self.reclaimed,
+                "busy": self.busy,
+                "lost": self.lost,
+                "complete_lost": self.complete_lost,
+                "held": len(self.held)
+            }
+
+    def Close(self):
+        self.stop_event.set()
+
+
+"""
+多进程测试：python -m util_modules.LeaseStore [processes] [groups]
+多个进程领取同一批分组，其中一个进程领取后不续约直接退出（模拟崩溃），检查所有分组都恰好完成一次，且崩溃进程的租约被接手
+"""
+
+
+def _Worker(db_file, groups, log_file, crash):
+    import random
+    store = LeaseStore(db_file, lease_seconds=1.5)
+    pending = list(range(groups))
+    while pending:
+        busy = []
+        for i in pending:
+            key = f"bench/{i:04d}"
+            status = store.TryClaim(key)
+            if status == LEASE_BUSY:
+                busy.append(i)
+                continue
+            if status == LEASE_DONE:
+                continue
+            if crash:
+                os._exit(1)  # 持有租约时退出，不释放也不续约
+            time.sleep(random.uniform(0.01, 0.05))  # 上传
+            if random.random() < 0.1:
+                store.Release(key)  # 上传失败
+                busy.append(i)
+                continue
+            if store.Complete(key):
+                with open(log_file, "a") as fp:
+                    fp.write(f"{key} {store.owner}\n")
+        pending = busy
+        if pending:
+            time.sleep(0.2)
+    print(f"{store.Metrics()}")
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    import sys
+    import tempfile
+
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    groups = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    work_root = tempfile.mkdtemp(prefix="lease_bench_")
+    db_file = os.path.join(work_root, "leases.db")
+    log_file = os.path.join(work_root, "completed.log")
+    LeaseStore(db_file)
+    st = time.time()
+    workers = [multiprocessing.Process(target=_Worker, args=(db_file, groups, log_file, i == 0))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    with open(log_file) as fp:
+        completed = [line.split()[0] for line in fp]
+    duplicated = len(completed) - len(set(completed))
+    print(f"processes={processes} (1 crashed), groups={groups}, completed={len(set(completed))}, "
+          f"duplicated={duplicated}, cost={time.time() - st:.1f}s")
+    sys.exit(0 if len(set(completed)) == groups and duplicated == 0 else 1)
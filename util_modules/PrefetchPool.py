@@ -0,0 +1,360 @@
+"""
+上传数据预读缓冲池
+固定数量、按页对齐（mmap）的可复用缓冲区，每个块设备一个I/O线程按顺序把文件读入空闲缓冲区，
+上传线程直接取用缓冲区的memoryview发送，用完归还，读盘延迟不再直接阻塞网络发送：
+  - reader_wait_seconds : I/O线程等待空闲缓冲区的时间，持续增长说明网络是瓶颈
+  - sender_wait_seconds : 上传线程等待数据的时间，持续增长说明磁盘是瓶颈
+"""
+import logging
+import mmap
+import os
+import queue
+import threading
+import time
+
+from util_modules.disk_util import FadviseSequential, FadviseDontNeed, GetReadLimiter
+from util_modules.retry_util import RequestCancelled
+
+
+class PrefetchedBlock:
+    def __init__(self, stream, buffer, index, offset, size):
+        self.stream = stream
+        self.buffer = buffer
+        self.index = index  # 在stream的ranges中的序号
+        self.offset = offset
+        self.size = size
+        self.view = memoryview(buffer)[:size]
+        self.lock = threading.Lock()
+
+    def Read(self, start, end):
+        with self.lock:
+            return bytes(self.view[start:end])
+
+    def Detach(self):
+        """
+        把数据复制到私有内存后立即归还缓冲区，之后的Read读取私有副本；
+        用于仍有无法中断的请求（如先读入整个body的SDK）在使用数据，不让其占用预读缓冲区
+        """
+        with self.lock:
+            if self.buffer is None:
+                return
+            data = bytes(self.view)
+            self.view.release()
+            self.view = memoryview(data)
+            buffer, self.buffer = self.buffer, None
+        self.stream._ReleaseBlock(buffer)
+
+    def Release(self):
+        with self.lock:
+            if self.buffer is None:
+                return
+            self.view.release()
+            buffer, self.buffer = self.buffer, None
+        self.stream._ReleaseBlock(buffer)
+
+
+class BlockReader:
+    """ 将一个预读块包装成SDK可用的文件对象（read/seek/tell），不复制整块数据 """
+    def __init__(self, block: PrefetchedBlock):
+        self.block = block
+        self.pos = 0
+        self.cancelled = False
+
+    def Cancel(self):
+        """ 之后的read抛出异常，用于中断正在发送的请求（如对冲请求中落后的一方） """
+        self.cancelled = True
+
+    def read(self, size=-1):
+        if self.cancelled:
+            raise RequestCancelled("request cancelled")
+        end = self.block.size if size is None or size < 0 else min(self.block.size, self.pos + size)
+        data = self.block.Read(self.pos, end)
+        self.pos = end
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.pos, os.SEEK_END: self.block.size}[whence]
+        self.pos = max(0, min(self.block.size, base + offset))
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        """ 部分SDK发送完成后会关闭body，预读块由调用方Release，这里不做处理 """
+
+    def __len__(self):
+        return self.block.size
+
+
+class PrefetchStream:
+    """ 按ranges顺序预读同一个文件，Next()按顺序返回PrefetchedBlock（可多线程调用），也可作为顺序读取的文件对象 """
+    def __init__(self, pool, device, path, ranges, max_ahead):
+        self.pool = pool
+        self.device = device
+        self.path = path
+        self.ranges = ranges
+        self.max_ahead = max_ahead
+        self.ahead = 0  # 已读入缓冲区、尚未归还的块数，受device.cond保护
+        self.next_index = 0
+        self.fp = None
+        self.ready = queue.Queue()
+        self.closed = False
+        self.eof = False
+        self._current = None
+        self._current_pos = 0
+
+    def Next(self):
+        """ 返回下一个数据块，读完返回None，读取失败抛出异常 """
+        if self.eof:
+            return None
+        st = time.time()
+        item = self.ready.get()
+        self.pool._AddSenderWait(time.time() - st)
+        if isinstance(item, Exception) or item is None:
+            # 结束标记放回队列，多个线程同时调用Next时都能返回
+            self.eof = True
+            self.ready.put(item)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def _ReleaseBlock(self, buffer):
+        self.pool._ReleaseBuffer(buffer)
+        with self.device.cond:
+            self.ahead -= 1
+            self.device.cond.notify()
+
+    def read(self, size=-1):
+        """ 顺序读取接口，返回bytes，供需要文件对象的SDK使用 """
+        chunks = []
+        while size is None or size < 0 or size > 0:
+            if self._current is None:
+                self._current = self.Next()
+                self._current_pos = 0
+                if self._current is None:
+                    break
+            end = self._current.size if size is None or size < 0 else \
+                min(self._current.size, self._current_pos + size)
+            chunks.append(bytes(self._current.view[self._current_pos:end]))
+            if size is not None and size >= 0:
+                size -= end - self._current_pos
+            self._current_pos = end
+            if self._current_pos >= self._current.size:
+                self._current.Release()
+                self._current = None
+        return b"".join(chunks)
+
+    def Close(self):
+        """ 提前结束时归还已预读的缓冲区 """
+        with self.device.cond:
+            self.closed = True
+            self.device.cond.notify()
+        if self._current is not None:
+            self._current.Release()
+            self._current = None
+        while True:
+            try:
+                item = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, PrefetchedBlock):
+                item.Release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.Close()
+
+
+class _DeviceReader:
+    """
+    每个块设备一个I/O线程，在多个stream之间轮转，每次为一个stream连续读取一个块；
+    stream预读块数达到上限时跳过，避免慢速的上传占住磁盘
+    """
+    def __init__(self, pool, dev):
+        self.pool = pool
+        self.dev = dev
+        self.limiter = GetReadLimiter()
+        self.cond = threading.Condition()
+        self.streams = []
+        self.cursor = 0
+        threading.Thread(target=self._Loop, daemon=True).start()
+
+    def Add(self, stream):
+        with self.cond:
+            self.streams.append(stream)
+            self.cond.notify()
+
+    def _NextStream(self):
+        """ 在self.cond内调用，返回可以继续读取的stream """
+        for i in range(len(self.streams)):
+            stream = self.streams[(self.cursor + i) % len(self.streams)]
+            if stream.closed or stream.next_index >= len(stream.ranges):
+                continue
+            if stream.ahead < stream.max_ahead:
+                self.cursor = (self.cursor + i + 1) % len(self.streams)
+                stream.ahead += 1
+                return stream
+        return None
+
+    def _Finish(self, stream, item):
+        if stream.fp is not None:
+            stream.fp.close()
+            stream.fp = None
+        with self.cond:
+            self.streams.remove(stream)
+        stream.ready.put(item)
+
+    def _Loop(self):
+        while True:
+            st = time.time()
+            with self.cond:
+                # 清理已关闭或已读完的stream
+                for stream in [s for s in self.streams if s.closed]:
+                    self.streams.remove(stream)
+                    if stream.fp is not None:
+                        stream.fp.close()
+                        stream.fp = None
+                stream = self._NextStream()
+                while stream is None:
+                    self.cond.wait()
+                    stream = self._NextStream()
+            buffer = self.pool.free.get()
+            self.pool._AddReaderWait(time.time() - st)
+            try:
+                self._ReadBlock(stream, buffer)
+            except Exception as e:
+                logging.error(f"prefetch {stream.path} failed : {e}")
+                stream._ReleaseBlock(buffer)
+                self._Finish(stream, e)
+
+    def _ReadBlock(self, stream: PrefetchStream, buffer):
+        if stream.fp is None:
+            stream.fp = open(stream.path, "rb", buffering=0)
+            FadviseSequential(stream.fp.fileno())
+        index = stream.next_index
+        offset, length = stream.ranges[index]
+        stream.next_index += 1
+        stream.fp.seek(offset)
+        self.limiter.Throttle(self.dev, length)
+        st = time.time()
+        view = memoryview(buffer)
+        size = 0
+        while size < length:
+            n = stream.fp.readinto(view[size:length])
+            if not n:
+                break
+            size += n
+        view.release()
+        self.limiter.Report(self.dev, size, time.time() - st)
+        if size < length:
+            # 文件在上传过程中被截断，不能把不完整的块当作完整数据上传
+            raise EOFError(f"{stream.path} truncated : expect {length} bytes at offset {offset}, read {size}")
+        FadviseDontNeed(stream.fp.fileno(), offset, length)
+        self.pool._AddBytesRead(size)
+        stream.ready.put(PrefetchedBlock(stream, buffer, index, offset, size))
+        if stream.next_index >= len(stream.ranges):
+            self._Finish(stream, None)
+
+
+class PrefetchPool:
+    def __init__(self, buffer_size=8 * 1024 * 1024, buffer_count=32):
+        """
+        buffer_size : 单个缓冲区大小，也是预读块的最大长度
+        buffer_count : 缓冲区数量，决定预读的内存上限
+        """
+        self.buffer_size = buffer_size
+        self.buffer_count = buffer_count
+        self.free = queue.Queue()
+        for _ in range(buffer_count):
+            self.free.put(mmap.mmap(-1, buffer_size))
+        self.lock = threading.Lock()
+        self.devices = {}  # <st_dev, _DeviceReader>
+        self.bytes_read = 0
+        self.reader_wait_seconds = 0.0
+        self.sender_wait_seconds = 0.0
+        self.occupancy_samples = 0
+        self.occupancy_total = 0
+
+    def Open(self, path, ranges=None, max_ahead=4) -> PrefetchStream:
+        """
+        预读path的ranges=[(offset, length)]，每个range不超过buffer_size；ranges为None时按buffer_size切分整个文件
+        max_ahead : 单个stream最多预读的块数，避免一个文件占满缓冲池
+        """
+        if ranges is None:
+            file_size = os.path.getsize(path)
+            ranges = [(offset, min(self.buffer_size, file_size - offset))
+                      for offset in range(0, file_size, self.buffer_size)]
+        for offset, length in ranges:
+            if length > self.buffer_size:
+                raise ValueError(f"range length {length} exceeds prefetch buffer size {self.buffer_size}")
+        dev = os.stat(path).st_dev
+        with self.lock:
+            if dev not in self.devices:
+                self.devices[dev] = _DeviceReader(self, dev)
+            device = self.devices[dev]
+        stream = PrefetchStream(self, device, path, ranges, max(1, min(max_ahead, self.buffer_count)))
+        if len(ranges) == 0:
+            stream.ready.put(None)
+        else:
+            device.Add(stream)
+        return stream
+
+    def _Grow(self, buffer_count):
+        """ 增加缓冲区到buffer_count个，已有的缓冲区不受影响 """
+        with self.lock:
+            added = max(0, buffer_count - self.buffer_count)
+            self.buffer_count += added
+        for _ in range(added):
+            self.free.put(mmap.mmap(-1, self.buffer_size))
+
+    def _ReleaseBuffer(self, buffer):
+        self.free.put(buffer)
+
+    def _AddBytesRead(self, nbytes):
+        with self.lock:
+            self.bytes_read += nbytes
+            self.occupancy_samples += 1
+            self.occupancy_total += self.buffer_count - self.free.qsize()
+
+    def _AddReaderWait(self, seconds):
+        with self.lock:
+            self.reader_wait_seconds += seconds
+
+    def _AddSenderWait(self, seconds):
+        with self.lock:
+            self.sender_wait_seconds += seconds
+
+    def Metrics(self):
+        with self.lock:
+            occupancy = self.occupancy_total / self.occupancy_samples if self.occupancy_samples else 0.0
+            return {
+                "buffer_size": self.buffer_size,
+                "buffer_count": self.buffer_count,
+                "bytes_read": self.bytes_read,
+                "avg_occupancy": round(occupancy / self.buffer_count, 3),
+                "reader_wait_seconds": round(self.reader_wait_seconds, 1),
+                "sender_wait_seconds": round(self.sender_wait_seconds, 1),
+                "bound": "network" if self.reader_wait_seconds > self.sender_wait_seconds else "disk"
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def GetPrefetchPool(buffer_size=8 * 1024 * 1024, buffer_count=32) -> PrefetchPool:
+    """ 按缓冲区大小共享缓冲池，buffer_count取所有调用方要求的最大值，不足时增加缓冲区 """
+    with _pools_lock:
+        if buffer_size not in _pools:
+            _pools[buffer_size] = PrefetchPool(buffer_size, buffer_count)
+        elif _pools[buffer_size].buffer_count < buffer_count:
+            _pools[buffer_size]._Grow(buffer_count)
+        return _pools[buffer_size]
+
+
+def PrefetchMetrics():
+    with _pools_lock:
+        return [pool.Metrics() for pool in _pools.values()]
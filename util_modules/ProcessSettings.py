@@ -0,0 +1,39 @@
+"""
+常驻进程中同时运行的多个任务共享的进程级配置（传输引擎并发、重试策略与预算、分片对冲）
+每项配置由第一个使用它的任务生效，运行期间其他任务的配置必须与之相同，否则拒绝该任务，
+避免后启动的任务改写正在运行的任务的参数；所有使用者结束后，下一个任务可以按自己的配置重新生效
+"""
+import logging
+import threading
+
+
+class ProcessSettingConflict(ValueError):
+    pass
+
+
+_settings = {}  # <name, [config, holders]>
+_settings_lock = threading.Lock()
+
+
+def AcquireProcessSetting(name, config, apply):
+    """
+    登记使用名为name的进程级配置：没有其他使用者时调用apply()使config生效；
+    其他任务正在以不同的配置运行时抛出ProcessSettingConflict
+    """
+    with _settings_lock:
+        entry = _settings.get(name)
+        if entry is not None and entry[1] > 0:
+            if entry[0] != config:
+                raise ProcessSettingConflict(f"{name}配置与正在运行的任务不一致：当前={entry[0]}，本任务={config}")
+            entry[1] += 1
+            return
+        apply()
+        _settings[name] = [config, 1]
+        logging.info(f"进程级配置{name}生效：{config}")
+
+
+def ReleaseProcessSetting(name):
+    with _settings_lock:
+        entry = _settings.get(name)
+        if entry is not None and entry[1] > 0:
+            entry[1] -= 1
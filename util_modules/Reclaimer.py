@@ -0,0 +1,213 @@
+"""
+后台异步删除本地文件
+Remove()先将目标重命名到回收目录（同一文件系统内为瞬时操作，逻辑上立即删除），再由后台worker限速地
+scandir/unlink，避免上传线程被 rm -r 大目录阻塞：
+  - 有界队列，队列满时Remove阻塞，防止回收积压无限增长
+  - 每秒unlink次数限制，减少对同盘读写（上传、打包）的影响
+  - 日志文件记录待删除路径，进程崩溃后重新启动时继续删除
+  - backlog_bytes 为尚未删除的数据量，用于统计本地暂存空间
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+JOURNAL_NAME = "journal"
+TRASH_NAME = "trash"
+TRASH_PREFIX = ".reclaim_"
+
+
+class Reclaimer:
+    def __init__(self, reclaim_root, max_queue=1024, workers=2, max_ops_per_sec=2000):
+        """
+        reclaim_root : 回收目录，存放日志与同盘的待删除数据
+        max_queue : 队列长度上限
+        workers : 删除线程数
+        max_ops_per_sec : 全部worker合计每秒unlink/rmdir次数上限，<=0表示不限速
+        """
+        self.reclaim_root = reclaim_root
+        self.trash_root = os.path.join(reclaim_root, TRASH_NAME)
+        os.makedirs(self.trash_root, exist_ok=True)
+        self.trash_dev = os.stat(self.trash_root).st_dev
+        self.journal_file = os.path.join(reclaim_root, JOURNAL_NAME)
+        self.interval = 1.0 / max_ops_per_sec if max_ops_per_sec > 0 else 0.0
+        self.next_slot = 0.0
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.backlog_bytes = 0
+        self.backlog_items = 0
+        self.removed_bytes = 0
+        self.removed_items = 0
+
+        pending = self._LoadJournal()
+        self.journal = open(self.journal_file, "a", encoding="utf-8")
+        self.workers = [threading.Thread(target=self._WorkerLoop, daemon=True) for _ in range(max(1, workers))]
+        for worker in self.workers:
+            worker.start()
+        # 上次未删除完的数据继续删除，队列满时在后台线程中等待，不阻塞初始化
+        self._resume_thread = None
+        if len(pending) > 0:
+            logging.info(f"resume reclaiming {len(pending)} items under {reclaim_root}")
+            self._resume_thread = threading.Thread(target=lambda: [self._Enqueue(path, None) for path in pending],
+                                                   daemon=True)
+            self._resume_thread.start()
+
+    def _LoadJournal(self):
+        """ 读取日志中未完成的路径与回收目录中的残留，重写日志 """
+        pending = {}
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as fp:
+                for line in fp:
+                    line = line.rstrip("\n")
+                    if line.startswith("+"):
+                        pending[line[1:]] = True
+                    elif line.startswith("-"):
+                        pending.pop(line[1:], None)
+        for name in os.listdir(self.trash_root):
+            pending[os.path.join(self.trash_root, name)] = True
+        pending = [path for path in pending if os.path.lexists(path)]
+        with open(self.journal_file + ".tmp", "w", encoding="utf-8") as fp:
+            for path in pending:
+                fp.write(f"+{path}\n")
+        os.replace(self.journal_file + ".tmp", self.journal_file)
+        return pending
+
+    def _WriteJournal(self, line):
+        with self.lock:
+            self.journal.write(line + "\n")
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def _TrashPath(self, path):
+        """ 同一文件系统移动到回收目录，否则在原目录下重命名为隐藏名称 """
+        name = f"{TRASH_PREFIX}{uuid.uuid4().hex[:12]}_{os.path.basename(os.path.normpath(path))}"
+        if os.lstat(path).st_dev == self.trash_dev:
+            return os.path.join(self.trash_root, name)
+        return os.path.join(os.path.dirname(os.path.normpath(path)), name)
+
+    def Remove(self, path, size=None, callback=None):
+        """ 逻辑删除path并加入后台删除队列，size为数据量（可选，未提供时由worker扫描统计），callback在删除结束后调用 """
+        if not os.path.lexists(path):
+            if callback is not None:
+                callback()
+            return
+        trash_path = self._TrashPath(path)
+        self._WriteJournal(f"+{trash_path}")
+        try:
+            os.rename(path, trash_path)
+        except OSError as e:
+            logging.warning(f"failed to move {path} to trash : {e}, remove in place")
+            trash_path = path
+            self._WriteJournal(f"+{trash_path}")
+        if size is None and os.path.isfile(trash_path):
+            size = os.lstat(trash_path).st_size
+        self._Enqueue(trash_path, size, callback)
+        logging.info(f"removed local file {path}")
+
+    def _Enqueue(self, trash_path, size, callback=None):
+        with self.lock:
+            self.backlog_items += 1
+            self.backlog_bytes += size or 0
+        self.queue.put((trash_path, size, callback))
+
+    def _Throttle(self, ops):
+        if self.interval <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_slot, now)
+            self.next_slot = start + ops * self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _Unlinked(self, nbytes):
+        with self.lock:
+            self.backlog_bytes = max(0, self.backlog_bytes - nbytes)
+            self.removed_bytes += nbytes
+
+    def _RemoveTree(self, trash_path, size):
+        """ 先扫描出所有文件（只读元数据），再限速逐个unlink，最后自底向上rmdir """
+        if not os.path.isdir(trash_path) or os.path.islink(trash_path):
+            self._Throttle(1)
+            os.unlink(trash_path)
+            self._Unlinked(size or 0)
+            return
+        files = []
+        dirs = [trash_path]
+        total_bytes = 0
+        index = 0
+        while index < len(dirs):
+            with os.scandir(dirs[index]) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    else:
+                        file_size = entry.stat(follow_symlinks=False).st_size
+                        files.append((entry.path, file_size))
+                        total_bytes += file_size
+            index += 1
+        with self.lock:
+            # 以扫描结果修正调用方提供的数据量
+            self.backlog_bytes = max(0, self.backlog_bytes + total_bytes - (size or 0))
+        for i, (file_path, file_size) in enumerate(files):
+            if i % 64 == 0:
+                self._Throttle(min(64, len(files) - i))
+            try:
+                os.unlink(file_path)
+            except FileNotFoundError:
+                pass
+            self._Unlinked(file_size)
+        self._Throttle(len(dirs))
+        for dir_path in reversed(dirs):
+            os.rmdir(dir_path)
+
+    def _WorkerLoop(self):
+        while True:
+            trash_path, size, callback = self.queue.get()
+            try:
+                if os.path.lexists(trash_path):
+                    self._RemoveTree(trash_path, size)
+                self._WriteJournal(f"-{trash_path}")
+            except Exception as e:
+                logging.error(f"failed to reclaim {trash_path} : {e}")
+            finally:
+                with self.lock:
+                    self.backlog_items -= 1
+                    self.removed_items += 1
+                if callback is not None:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logging.error(f"reclaim callback of {trash_path} failed : {e}")
+                self.queue.task_done()
+
+    def Metrics(self):
+        with self.lock:
+            return {
+                "backlog_items": self.backlog_items,
+                "backlog_bytes": self.backlog_bytes,
+                "removed_items": self.removed_items,
+                "removed_bytes": self.removed_bytes
+            }
+
+    def Drain(self):
+        """ 等待队列中的数据（包括上次未删除完的数据）全部删除 """
+        if self._resume_thread is not None:
+            self._resume_thread.join()
+        self.queue.join()
+
+
+_reclaimers = {}
+_reclaimers_lock = threading.Lock()
+
+
+def InitReclaimer(reclaim_root, **kwargs) -> Reclaimer:
+    """ 每个回收目录一个实例，重复调用返回已有实例 """
+    reclaim_root = os.path.abspath(reclaim_root)
+    with _reclaimers_lock:
+        if reclaim_root not in _reclaimers:
+            _reclaimers[reclaim_root] = Reclaimer(reclaim_root, **kwargs)
+        return _reclaimers[reclaim_root]
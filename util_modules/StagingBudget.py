@@ -0,0 +1,144 @@
+"""
+本地暂存空间预算
+打包/压缩前按预估大小申请额度，额度在暂存文件上传并删除后释放，保证多个分组并发打包时输出盘不会写满：
+  - 可用额度 = statvfs剩余空间 - 预留空间，没有在途额度时按当前剩余空间重新计算
+  - 空间不足时优先放行可以放下的最小数据包；等待超过starve_seconds的数据包优先，避免大包饿死
+  - 都放不下且没有在途额度时放行最小的数据包，保证超大数据包也能处理
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+
+
+class StagingTicket:
+    def __init__(self, seq, name, size):
+        self.seq = seq
+        self.name = name
+        self.size = size  # 当前占用的额度，打包完成后修正为实际大小
+        self.wait_since = time.time()
+        self.released = False
+
+
+class StagingBudget:
+    def __init__(self, staging_root, reserve_bytes=None, starve_seconds=600):
+        """
+        staging_root : 暂存目录，用于statvfs
+        reserve_bytes : 预留空间，默认为磁盘总容量的5%（至少1GB）
+        starve_seconds : 等待超过该时长的数据包优先放行
+        """
+        self.staging_root = staging_root
+        os.makedirs(staging_root, exist_ok=True)
+        if reserve_bytes is None:
+            st = os.statvfs(staging_root)
+            reserve_bytes = max(int(st.f_blocks * st.f_frsize * 0.05), pow(1024, 3))
+        self.reserve_bytes = reserve_bytes
+        self.starve_seconds = starve_seconds
+        self.cond = threading.Condition()
+        self.seq = itertools.count()
+        self.waiters = []
+        self.charged = 0
+        self.inflight = 0
+        self.capacity = self._FreeBytes()
+        self.max_charged = 0
+        self.wait_seconds = 0.0
+
+    def _FreeBytes(self):
+        st = os.statvfs(self.staging_root)
+        return st.f_bavail * st.f_frsize - self.reserve_bytes
+
+    def _CanAdmit(self, ticket: StagingTicket):
+        """ 在self.cond内调用 """
+        def fits(w):
+            return self.charged + w.size <= self.capacity
+
+        now = time.time()
+        starving = [w for w in self.waiters if now - w.wait_since >= self.starve_seconds]
+        if starving:
+            # 有等待过久的数据包时只放行其中最早的一个，其余数据包等待其完成
+            return ticket is min(starving, key=lambda w: w.seq) and (fits(ticket) or self.inflight == 0)
+        fitting = [w for w in self.waiters if fits(w)]
+        if fitting:
+            return ticket is min(fitting, key=lambda w: (w.size, w.seq))
+        # 都放不下且没有在途额度时放行最小的数据包
+        return self.inflight == 0 and ticket is min(self.waiters, key=lambda w: (w.size, w.seq))
+
+    def Acquire(self, size, name=None, wait=True) -> StagingTicket:
+        """
+        申请size字节的暂存额度，放不下时阻塞等待；
+        wait为False时不等待直接计入额度，用于必须写入、且要等其他暂存文件处理完才删除的文件（等待会互相阻塞），
+        其占用的额度让其他数据包的申请相应等待
+        """
+        ticket = StagingTicket(next(self.seq), name, max(0, int(size)))
+        with self.cond:
+            if self.inflight == 0:
+                self.capacity = self._FreeBytes()
+            if wait:
+                self.waiters.append(ticket)
+                while not self._CanAdmit(ticket):
+                    self.cond.wait(timeout=30)
+                self.waiters.remove(ticket)
+            self.charged += ticket.size
+            self.inflight += 1
+            self.max_charged = max(self.max_charged, self.charged)
+            self.wait_seconds += time.time() - ticket.wait_since
+            self.cond.notify_all()
+        if time.time() - ticket.wait_since > 1:
+            logging.info(f"staging {name} ({size / pow(1024, 3):.2f}GB) admitted after "
+                         f"{time.time() - ticket.wait_since:.1f}s")
+        return ticket
+
+    def Adjust(self, ticket: StagingTicket, size):
+        """ 打包完成后按实际大小修正额度 """
+        with self.cond:
+            if ticket.released:
+                return
+            self.charged += int(size) - ticket.size
+            ticket.size = int(size)
+            self.cond.notify_all()
+
+    def Release(self, ticket: StagingTicket):
+        """ 暂存文件删除后释放额度 """
+        with self.cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            self.charged -= ticket.size
+            self.inflight -= 1
+            if self.inflight == 0:
+                self.charged = 0
+                self.capacity = self._FreeBytes()
+            self.cond.notify_all()
+
+    def Metrics(self):
+        with self.cond:
+            return {
+                "capacity_bytes": self.capacity,
+                "charged_bytes": self.charged,
+                "inflight": self.inflight,
+                "waiting": len(self.waiters),
+                "max_charged_bytes": self.max_charged,
+                "wait_seconds": round(self.wait_seconds, 1)
+            }
+
+
+_budgets = {}  # <st_dev, StagingBudget>
+_budgets_lock = threading.Lock()
+
+
+def GetStagingBudget(staging_root, reserve_bytes=None) -> StagingBudget:
+    """
+    每个文件系统一个实例：常驻进程中输出目录在同一个盘上的多个任务共享同一份额度，
+    预留空间以第一个任务的配置为准
+    """
+    os.makedirs(staging_root, exist_ok=True)
+    device = os.stat(staging_root).st_dev
+    with _budgets_lock:
+        budget = _budgets.get(device)
+        if budget is None:
+            budget = _budgets[device] = StagingBudget(staging_root, reserve_bytes=reserve_bytes)
+        elif reserve_bytes is not None and reserve_bytes != budget.reserve_bytes:
+            logging.warning(f"{staging_root}与{budget.staging_root}在同一文件系统，共享暂存额度，"
+                            f"预留空间沿用{budget.reserve_bytes}字节")
+        return budget
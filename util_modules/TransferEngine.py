@@ -0,0 +1,272 @@
+"""
+全局共享的文件传输引擎
+云服务的UploadFolder与上传器的数据包内文件均以任务形式提交到同一个引擎，统一限制全局并发：
+  - 小文件任务可以保持大量请求在途，队列积压时一个worker一次取出一批小文件顺序处理，减少调度开销
+  - 大文件（内部自带分片并发）单独限流，避免与小文件争抢导致分片线程过度订阅
+  - TransferBatch 跟踪一个数据包/文件夹内所有任务的完成情况
+  - 配置AimdController时，在途任务数由其根据实测吞吐自动调节，max_inflight只作为上限
+  - 任务分为三个优先级：元数据（storage_info.json等小文件与公共部分归档，下游拿到即可开始处理）、小文件、大文件，
+    每个优先级保留一部分并发（有任务排队时优先满足），其余并发按优先级分配，排队超过starvation_seconds的任务优先执行
+"""
+import contextvars
+import fnmatch
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+_local = threading.local()
+
+PRIORITY_METADATA = 0
+PRIORITY_SMALL = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = ("metadata", "small", "bulk")
+DEFAULT_METADATA_PATTERNS = ("storage_info.json", "vehicle_desc.json", "metadata.yaml", "*calib*")
+
+
+class TransferJob:
+    def __init__(self, batch, func, args, size, callback, priority):
+        self.batch = batch
+        self.func = func
+        self.args = args
+        self.size = size
+        self.callback = callback  # callback(ok)，在worker线程中执行
+        self.priority = priority
+        self.enqueue_time = time.monotonic()
+        self.context = contextvars.copy_context()  # 在提交者的上下文中执行，日志写入提交者所属任务的日志文件
+
+
+class TransferBatch:
+    """ 一个数据包（或文件夹）内的一组传输任务 """
+    def __init__(self, engine, name=None):
+        self.engine = engine
+        self.name = name
+        self.pending = 0
+        self.success_count = 0
+        self.failed_jobs = []
+        self.cond = threading.Condition()
+
+    def Add(self, func, *args, size=0, callback=None, priority=None):
+        """
+        提交任务func(*args)，返回值为真视为成功；在引擎worker线程中调用时直接同步执行，避免等待自身造成死锁
+        priority : PRIORITY_*，为None时按大小分为小文件或大文件
+        """
+        if priority is None:
+            priority = PRIORITY_BULK if size >= self.engine.large_file_size else PRIORITY_SMALL
+        job = TransferJob(self, func, args, size, callback, priority)
+        with self.cond:
+            self.pending += 1
+        if getattr(_local, "in_engine", False):
+            self.engine._RunJob(job)
+        else:
+            self.engine._Submit(job)
+
+    def _Done(self, job, ok):
+        with self.cond:
+            self.pending -= 1
+            if ok:
+                self.success_count += 1
+            else:
+                self.failed_jobs.append(job)
+            self.cond.notify_all()
+
+    def Wait(self, timeout=None):
+        """ 等待所有任务结束，全部成功返回True """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.pending == 0, timeout=timeout):
+                return False
+            return len(self.failed_jobs) == 0
+
+
+class TransferEngine:
+    def __init__(self, max_inflight=64, max_large_inflight=4, large_file_size=100 * 1024 * 1024,
+                 small_file_size=4 * 1024 * 1024, small_batch_files=16, controller=None,
+                 reserved_shares=(0.1, 0.1, 0.25), starvation_seconds=30.0, metadata_patterns=DEFAULT_METADATA_PATTERNS):
+        """
+        max_inflight : 全局最大在途任务数（worker线程数）
+        max_large_inflight : 同时进行的大文件任务上限，大文件内部还有各云服务SDK的分片并发
+        large_file_size : 超过该大小视为大文件
+        small_file_size : 低于该大小视为小文件，可批量调度
+        small_batch_files : 队列积压时单个worker一次最多取出的小文件数量
+        controller : AimdController，为None时固定以max_inflight并发
+        reserved_shares : 元数据/小文件/大文件各自保留的并发比例
+        starvation_seconds : 任务排队超过该时间后不再让位于更高优先级
+        metadata_patterns : 按文件名匹配元数据文件的通配符
+        """
+        self.max_inflight = max_inflight
+        self.max_large_inflight = max_large_inflight
+        self.large_file_size = large_file_size
+        self.small_file_size = small_file_size
+        self.small_batch_files = small_batch_files
+        self.controller = controller
+        self.reserved_shares = reserved_shares
+        self.starvation_seconds = starvation_seconds
+        self.metadata_patterns = metadata_patterns
+
+        self.queues = [deque() for _ in PRIORITY_NAMES]
+        self.large_inflight = 0
+        self.running = 0  # 正在执行的worker数
+        self.class_running = [0] * len(PRIORITY_NAMES)
+        self.class_jobs = [0] * len(PRIORITY_NAMES)
+        self.class_wait_seconds = [0.0] * len(PRIORITY_NAMES)
+        self.class_max_wait_seconds = [0.0] * len(PRIORITY_NAMES)
+        self.starved_picks = 0
+        self.cond = threading.Condition()
+        self.workers = []
+        self.stopped = False
+
+    def NewBatch(self, name=None) -> TransferBatch:
+        return TransferBatch(self, name)
+
+    def Priority(self, path, size):
+        """ 按文件名与大小判断优先级 """
+        name = os.path.basename(path)
+        if any(fnmatch.fnmatch(name, pattern) for pattern in self.metadata_patterns):
+            return PRIORITY_METADATA
+        return PRIORITY_BULK if size >= self.large_file_size else PRIORITY_SMALL
+
+    def _Submit(self, job: TransferJob):
+        with self.cond:
+            self.queues[job.priority].append(job)
+            if len(self.workers) < self.max_inflight:
+                worker = threading.Thread(target=self._WorkerLoop, daemon=True)
+                self.workers.append(worker)
+                worker.start()
+            self.cond.notify()
+
+    def _Runnable(self, priority):
+        """ 在self.cond内调用，该优先级队首任务是否可以执行（大文件受max_large_inflight限制） """
+        queue = self.queues[priority]
+        return len(queue) > 0 and (queue[0].size < self.large_file_size or self.large_inflight < self.max_large_inflight)
+
+    def _PickClass(self, limit):
+        """
+        在self.cond内调用，选择下一个执行的优先级：
+        排队超时的任务最先；其次是运行数未达到保留比例的优先级；否则按优先级从高到低
+        """
+        runnable = [priority for priority in range(len(self.queues)) if self._Runnable(priority)]
+        if len(runnable) == 0:
+            return None
+        now = time.monotonic()
+        starved = [priority for priority in runnable if now - self.queues[priority][0].enqueue_time >= self.starvation_seconds]
+        if len(starved) > 0:
+            priority = min(starved, key=lambda p: self.queues[p][0].enqueue_time)
+            if priority != runnable[0]:
+                self.starved_picks += 1
+            return priority
+        for priority in runnable:
+            if self.class_running[priority] < math.ceil(self.reserved_shares[priority] * limit):
+                return priority
+        return runnable[0]
+
+    def _NextJobs(self):
+        """ 在self.cond内调用，返回待执行的任务列表 """
+        limit = self.max_inflight
+        if self.controller is not None:
+            limit = min(limit, self.controller.Limit())
+            if self.running >= limit:
+                return []
+        priority = self._PickClass(limit)
+        if priority is None:
+            return []
+        queue = self.queues[priority]
+        jobs = [queue.popleft()]
+        if jobs[0].size >= self.large_file_size:
+            self.large_inflight += 1
+        # 积压超过worker数量时，批量取出小文件，减少调度与唤醒开销
+        elif jobs[0].size < self.small_file_size and len(queue) > len(self.workers):
+            while queue and len(jobs) < self.small_batch_files and queue[0].size < self.small_file_size:
+                jobs.append(queue.popleft())
+        now = time.monotonic()
+        for job in jobs:
+            wait = now - job.enqueue_time
+            self.class_jobs[priority] += 1
+            self.class_wait_seconds[priority] += wait
+            self.class_max_wait_seconds[priority] = max(self.class_max_wait_seconds[priority], wait)
+        return jobs
+
+    def _WorkerLoop(self):
+        _local.in_engine = True
+        while True:
+            with self.cond:
+                jobs = self._NextJobs()
+                while len(jobs) == 0:
+                    if self.stopped:
+                        return
+                    self.cond.wait()
+                    jobs = self._NextJobs()
+                self.running += 1
+                self.class_running[jobs[0].priority] += 1
+            for job in jobs:
+                self._RunJob(job)
+            with self.cond:
+                self.running -= 1
+                self.class_running[jobs[0].priority] -= 1
+                if jobs[0].size >= self.large_file_size:
+                    self.large_inflight -= 1
+                self.cond.notify_all()
+
+    def _RunJob(self, job: TransferJob):
+        job.context.run(self._RunJobInContext, job)
+
+    def _RunJobInContext(self, job: TransferJob):
+        ok = False
+        st = time.monotonic()
+        try:
+            ok = bool(job.func(*job.args))
+        except Exception as e:
+            logging.error(f"transfer job {job.args} failed : {e}")
+        if self.controller is not None and self.controller.Record(job.size, time.monotonic() - st, ok):
+            with self.cond:
+                self.cond.notify_all()
+        if job.callback is not None:
+            try:
+                job.callback(ok)
+            except Exception as e:
+                logging.error(f"transfer job callback failed : {e}")
+        job.batch._Done(job, ok)
+
+    def Metrics(self):
+        with self.cond:
+            return {
+                "classes": {name: {
+                    "jobs": self.class_jobs[priority],
+                    "avg_wait_seconds": round(self.class_wait_seconds[priority] / max(1, self.class_jobs[priority]), 2),
+                    "max_wait_seconds": round(self.class_max_wait_seconds[priority], 2),
+                    "queued": len(self.queues[priority])
+                } for priority, name in enumerate(PRIORITY_NAMES)},
+                "starved_picks": self.starved_picks
+            }
+
+    def Shutdown(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def InitTransferEngine(**kwargs) -> TransferEngine:
+    """ 配置全局传输引擎，已启动的引擎只更新并发参数 """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TransferEngine(**kwargs)
+        else:
+            with _engine.cond:
+                for key, val in kwargs.items():
+                    setattr(_engine, key, val)
+                _engine.cond.notify_all()
+        return _engine
+
+
+def GetTransferEngine() -> TransferEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TransferEngine()
+        return _engine
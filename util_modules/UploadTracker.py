@@ -1,5 +1,6 @@
 import os
 import sqlite3
+import threading
 from pathlib import Path
 
 class uploadRecord:
@@ -17,12 +18,21 @@ class UploadTracker:
         self.db_file = db_file
         storge_root = os.path.dirname(db_file)
         self.timeout = 30.0  # 增加超时时间为30秒，提高并发写入的稳定性
+        self._local = threading.local()  # 每个线程复用一个连接，避免每次查询都重新打开数据库
         os.makedirs(storge_root, exist_ok=True)
         self._init_db()  # 初始化数据库和表结构
 
+    def _connect(self):
+        """当前线程的数据库连接，with conn只负责提交/回滚事务，不关闭连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
     def _init_db(self):
         """初始化数据库和表结构"""
-        with sqlite3.connect(self.db_file, timeout=self.timeout) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             # 创建表（如果不存在）
             cursor.execute('''
@@ -40,7 +50,7 @@ class UploadTracker:
 
     def initRecord(self, disk_id, package_id, oss_root, task_id, status, size):
         """标记某个package为已上传"""
-        with sqlite3.connect(self.db_file, timeout=self.timeout) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             try:
                 cursor.execute('''
@@ -58,7 +68,7 @@ class UploadTracker:
         if not upload_record:
             self.initRecord(disk_id, package_id, oss_root, task_id, status, size)
         else:
-            with sqlite3.connect(self.db_file, timeout=self.timeout) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                             UPDATE upload_records 
@@ -69,7 +79,7 @@ class UploadTracker:
 
     def checkStatus(self, disk_id, package_id):
         """检查某个package是否已上传"""
-        with sqlite3.connect(self.db_file, timeout=self.timeout) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                     SELECT disk_id, package_id, oss_root, task_id, status, size
@@ -83,4 +93,17 @@ class UploadTracker:
 
     def close(self):
         if os.path.exists(self.db_file):
-            os.remove(self.db_file)
\ No newline at end of file
+            os.remove(self.db_file)
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def GetUploadTracker(db_file) -> UploadTracker:
+    """ 每个数据库文件一个实例，常驻进程中多个任务之间复用 """
+    db_file = os.path.abspath(db_file)
+    with _trackers_lock:
+        if db_file not in _trackers:
+            _trackers[db_file] = UploadTracker(db_file)
+        return _trackers[db_file]
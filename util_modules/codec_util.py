@@ -0,0 +1,123 @@
+"""
+压缩前的可压缩性探测与压缩格式选择
+对文件夹内的文件按大小加权抽样若干数据块，用zlib快速估计压缩比，按结果选择 store/lz4/zstd/gzip：
+已经压缩过的数据（H.265视频、JPEG、lz4 bag分块等）直接存储，避免为约1%的收益消耗大量CPU
+抽样以文件夹路径为随机种子，数据不变时每次运行选择相同的格式（归档后缀不变），中断后重新运行可以复用已打包的归档
+"""
+import logging
+import os
+import random
+import time
+import zlib
+
+STORE_RATIO = 0.95  # 估计压缩比高于该值时不压缩
+FAST_RATIO = 0.80  # 介于两者之间时使用快速压缩
+# 各格式的默认压缩级别：lz4的级别3及以上为HC模式，速度远低于快速模式
+CODEC_LEVELS = {"gzip": 6, "zstd": 3, "lz4": 0}
+
+
+def IsCodecAvailable(codec):
+    if codec in ("store", "gzip"):
+        return True
+    try:
+        if codec == "zstd":
+            import zstandard
+        elif codec == "lz4":
+            import lz4.frame
+        else:
+            return False
+    except ImportError:
+        return False
+    return True
+
+
+class ProbeResult:
+    def __init__(self):
+        self.total_bytes = 0  # 文件夹总大小
+        self.sampled_bytes = 0
+        self.compressed_bytes = 0  # 样本zlib(level=1)压缩后大小
+        self.gzip_seconds_per_byte = 0.0  # 样本按gzip默认级别压缩的CPU耗时，用于估计节省的CPU
+        self.probe_seconds = 0.0
+        self.codec = "gzip"
+
+    @property
+    def ratio(self):
+        return self.compressed_bytes / self.sampled_bytes if self.sampled_bytes > 0 else 1.0
+
+    def ToJson(self):
+        return {
+            "codec": self.codec,
+            "estimated_ratio": round(self.ratio, 4),
+            "total_bytes": self.total_bytes,
+            "sampled_bytes": self.sampled_bytes,
+            "probe_seconds": round(self.probe_seconds, 4)
+        }
+
+
+def CodecLevel(codec, level=None):
+    """ level为None时返回该格式的默认压缩级别 """
+    return CODEC_LEVELS.get(codec) if level is None else level
+
+
+def _SampleFile(file_path, file_size, samples, block_size, result: ProbeResult, rng):
+    if file_size <= 0:
+        return
+    offsets = [0] if file_size <= block_size * samples else \
+        sorted(rng.sample(range(0, file_size - block_size, block_size), samples))
+    with open(file_path, "rb") as fp:
+        for offset in offsets:
+            fp.seek(offset)
+            block = fp.read(block_size if file_size > block_size * samples else file_size)
+            if not block:
+                continue
+            result.sampled_bytes += len(block)
+            result.compressed_bytes += len(zlib.compress(block, 1))
+            st = time.thread_time()
+            zlib.compress(block, 6)
+            result.gzip_seconds_per_byte += time.thread_time() - st
+
+
+"""
+探测folder_path的可压缩性，最多抽样max_files个文件（按大小加权），每个文件samples个block_size大小的数据块
+"""
+def ProbeFolder(folder_path, max_files=32, samples=4, block_size=64 * 1024) -> ProbeResult:
+    st = time.time()
+    result = ProbeResult()
+    rng = random.Random(os.path.abspath(folder_path))
+    files = []
+    for root, _, names in os.walk(folder_path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            if os.path.islink(file_path):
+                continue
+            try:
+                file_size = os.path.getsize(file_path)
+            except OSError:
+                continue
+            result.total_bytes += file_size
+            files.append((file_path, file_size))
+    files.sort()
+    if len(files) > max_files:
+        files = rng.choices(files, weights=[max(1, size) for _, size in files], k=max_files)
+    for file_path, file_size in sorted(set(files)):
+        try:
+            _SampleFile(file_path, file_size, samples, block_size, result, rng)
+        except OSError as e:
+            logging.warning(f"failed to sample {file_path} : {e}")
+    if result.sampled_bytes > 0:
+        result.gzip_seconds_per_byte /= result.sampled_bytes
+    result.codec = ChooseCodec(result.ratio)
+    result.probe_seconds = time.time() - st
+    logging.info(f"probe {folder_path} : {result.ToJson()}")
+    return result
+
+
+def ChooseCodec(ratio):
+    if ratio >= STORE_RATIO:
+        return "store"
+    if ratio >= FAST_RATIO:
+        for codec in ("lz4", "zstd"):
+            if IsCodecAvailable(codec):
+                return codec
+        return "store"
+    return "zstd" if IsCodecAvailable("zstd") else "gzip"
@@ -2,11 +2,16 @@ import logging
 import os
 import json
 import time
+import threading
 from kafka import KafkaProducer, KafkaConsumer
 from util_modules.log_util import *
+from util_modules.retry_util import GetRetryPolicy, GetCircuitBreaker
 
 logging.getLogger("kafka").setLevel(logging.ERROR)
 
+_producers = {}
+_producers_lock = threading.Lock()
+
 class KafkaUtil:
     def __init__(self):
         self.bootstrap_servers = None
@@ -16,7 +21,6 @@ class KafkaUtil:
         self.protocol = None
         self.base_msg = None
         self.topic = None
-        self.max_retry_times = 3
         self.taskinfo_location = None
 
     def InitFromValues(self, bootstrap_servers, username, password, mechanism, protocol):
@@ -81,11 +85,12 @@ class KafkaUtil:
         except json.JSONDecodeError as e:
             raise e
 
-    def SendKafkaMsg(self, topic, message):
-        logging.info(f"sending kafka msg... : topic = {topic}, message = {message}")
-        for _ in range(self.max_retry_times):
-            try:
-                producer = KafkaProducer(
+    def _GetProducer(self):
+        """ 相同服务端与账号共享同一个producer，常驻进程中多个任务之间复用连接 """
+        key = (str(self.bootstrap_servers), self.protocol, self.mechanism, self.username)
+        with _producers_lock:
+            if key not in _producers:
+                _producers[key] = KafkaProducer(
                     bootstrap_servers=self.bootstrap_servers,
                     security_protocol=self.protocol,
                     sasl_mechanism=self.mechanism,
@@ -94,17 +99,39 @@ class KafkaUtil:
                     value_serializer=lambda v: json.dumps(v, ensure_ascii=False).encode('utf-8'),
                     api_version=(2, 8, 2),
                 )
-                # 发送消息
+            return _producers[key]
+
+    def _DropProducer(self, producer):
+        with _producers_lock:
+            for key, val in list(_producers.items()):
+                if val is producer:
+                    del _producers[key]
+        try:
+            producer.close(timeout=5)
+        except Exception as e:
+            logging.warning(f"close kafka producer failed : {e}")
+
+    def SendKafkaMsg(self, topic, message):
+        logging.info(f"sending kafka msg... : topic = {topic}, message = {message}")
+
+        def send():
+            producer = self._GetProducer()
+            try:
+                # 发送消息并等待发送完成
                 producer.send(topic, message)
-                # 等待消息发送完成
                 producer.flush()
-                # 关闭生产者
-                producer.close()
-                return True
-            except Exception as e:
-                logging.error(f"{e}")
-                time.sleep(3 * (_ + 1))
-        return False
+            except Exception:
+                # 连接异常的producer不再复用，下次重新创建
+                self._DropProducer(producer)
+                raise
+            return True
+
+        try:
+            return GetRetryPolicy().Call(send, breaker=GetCircuitBreaker(f"kafka:{self.bootstrap_servers}"),
+                                         name=f"send kafka msg to {topic}")
+        except Exception as e:
+            logging.error(f"{e}")
+            return False
 
     def SendPodMessage(self, msg_type, data):
         message = self.base_msg
@@ -2,8 +2,11 @@
 create by longyunhao 2023-04-25
 全局logging配置
 """
+import contextvars
 import logging
 import logging.handlers
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 """
 usage:
@@ -17,6 +20,42 @@ logging.basicConfig(
     # datefmt='[%a-%d-%b-%Y : %H:%M:%S]',
 )
 
+# 常驻进程中多个任务并发运行时，日志按任务写入各自的日志文件：
+# 记录产生时带上当前上下文的任务（即该任务日志文件的路径），文件handler只接收本任务与不属于任何任务的记录
+_log_job = contextvars.ContextVar("log_job", default=None)
+_record_factory = logging.getLogRecordFactory()
+
+
+def _JobRecordFactory(*args, **kwargs):
+    record = _record_factory(*args, **kwargs)
+    record.log_job = _log_job.get()
+    return record
+
+
+logging.setLogRecordFactory(_JobRecordFactory)
+
+
+class _JobFilter(logging.Filter):
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+
+    def filter(self, record):
+        job = getattr(record, "log_job", None)
+        return job is None or job == self.job
+
+
+class LogContextExecutor(ThreadPoolExecutor):
+    """ 任务在提交时的上下文中执行，线程池中产生的日志仍写入提交者所属任务的日志文件 """
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def RunInLogContext(target):
+    """ 返回在当前上下文中执行target的函数，用于threading.Thread """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(target, *args, **kwargs)
+
 """ 初始化一个全局log文件 """
 def LoggingAddFileHandler(file_path):
     handler = logging.FileHandler(file_path, "a", encoding='utf-8')
@@ -26,8 +65,15 @@ def LoggingAddFileHandler(file_path):
     root_logger.addHandler(handler)
 
 
-""" 初始化全局日志，按照固定周期创建新的日志文件 """
+""" 初始化全局日志，按照固定周期创建新的日志文件；当前上下文（线程）之后的日志只写入该文件，不写入其他任务的日志文件 """
 def LoggingAddTimedRotatingFileHandler(file_path, when, backup_count, interval):
+    root_logger = logging.getLogger()
+    job = os.path.abspath(file_path)
+    _log_job.set(job)
+    # 常驻进程中同一输出目录的多个任务只添加一次
+    for handler in root_logger.handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename == job:
+            return
     handler = logging.handlers.TimedRotatingFileHandler(filename=file_path,
                                                         when=when,
                                                         interval=interval,
@@ -35,5 +81,5 @@ def LoggingAddTimedRotatingFileHandler(file_path, when, backup_count, interval):
                                                         encoding='utf-8')
     formatter = logging.Formatter('%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
     handler.setFormatter(formatter)
-    root_logger = logging.getLogger()
+    handler.addFilter(_JobFilter(job))
     root_logger.addHandler(handler)
\ No newline at end of file
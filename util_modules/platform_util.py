@@ -2,11 +2,18 @@ from confluent_kafka import Producer
 import logging
 import json
 import time
+import threading
 import requests
-from multiprocessing import Process, Queue
-from functools import wraps
 from enum import IntEnum
 import os
+from util_modules.tar_util import IndexedTarWriter, ParallelCompressWriter, ChecksumFileWriter, CheckArchiveMarker, \
+    IterTree, IterMembers, INDEX_SUFFIX, DONE_SUFFIX
+from util_modules.disk_util import SortByLayout, GetReadLimiter
+from util_modules.CpuPool import GetCpuPool
+from util_modules.retry_util import GetRetryPolicy, GetCircuitBreaker, StatusError
+# 超时自动重试，原每次调用创建一个进程，改为复用线程池/进程池
+from util_modules.timeout_util import timeout_retry
+from urllib.parse import urlparse
 
 class RT(IntEnum):
     SUCCESS = 0,
@@ -45,6 +52,19 @@ class KafkaProducer:
         self._producer.flush()
 
 
+_kafka_producers = {}
+_kafka_producers_lock = threading.Lock()
+
+
+def GetKafkaProducer(url, usr, pwd, topic) -> KafkaProducer:
+    """ 相同配置共享同一个producer，常驻进程中多个任务之间复用连接 """
+    key = (url, usr, pwd, topic)
+    with _kafka_producers_lock:
+        if key not in _kafka_producers:
+            _kafka_producers[key] = KafkaProducer(url, usr, pwd, topic)
+        return _kafka_producers[key]
+
+
 class KafkaProducerSSL:
     def __init__(self, url, usr, pwd, topic, certfile):
         self._producer = Producer({'bootstrap.servers':url,
@@ -62,45 +82,6 @@ class KafkaProducerSSL:
         self._producer.produce(self._topic, msg.encode('utf-8'), callback=kafka_callback)
         self._producer.flush()
 
-# 用于进程超时自动重启
-def timeout_retry(max_retry=3, timeout=60):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            retry_count = 0
-            while retry_count < max_retry:
-                result_queue = Queue()
-                exc_queue = Queue()
-
-                def worker(rq, eq):
-                    try:
-                        ret = func(*args, **kwargs)
-                        rq.put(ret)
-                    except Exception as e:
-                        eq.put(e)
-
-                p = Process(target=worker, args=(result_queue, exc_queue))
-                p.start()
-                p.join(timeout=timeout)
-
-                if p.is_alive():
-                    p.terminate()  # 强制终止进程
-                    p.join()  # 等待进程资源回收
-                    retry_count += 1
-                    continue
-
-                if not exc_queue.empty():
-                    retry_count += 1
-                    continue
-
-                return result_queue.get()
-
-            raise TimeoutError(f"操作在{max_retry}次重试后仍失败")
-
-        return wrapper
-
-    return decorator
-
 def RemoveLocalFile(file_path):
     if not os.path.exists(file_path):
         return
@@ -152,33 +133,29 @@ def listLevelDirs(root: str, level: int):
 
 
 def HttpPostJson(url, data, print_logs: bool = True):
-    max_retry_times = 3
-    wait_time = 10
+    """ 网络异常、超时与5xx/429按统一重试策略退避重试，返回码非0视为业务错误不重试；失败返回None """
     headers = {'Content-Type': 'application/json'}
     if print_logs:
         logging.info(f"url = {url}, data = {data}")
-    for attempt in range(max_retry_times):
-        logging.info("retry times = {}".format(attempt))
-        try:
-            response = requests.request("POST", url, headers=headers, json=data,
-                                        timeout=60)
-            if not response.ok:
-                logging.error(f"post data to {url} failed")
-                continue
-            j_res = json.loads(response.content)
-            if j_res['code'] != '0' and j_res['code'] != 0:
-                logging.error("wrong post params, return code = {}".format(j_res['code']))
-                logging.error("return msg = {}".format(j_res["message"]))
-                continue
-            return j_res
-        except requests.exceptions.Timeout:
-            logging.info("timeout, waitting for retry.........")
-            time.sleep(wait_time)
-        except requests.exceptions.RequestException as e:
-            logging.error(e)
-            time.sleep(wait_time)
 
-    return None
+    def post():
+        response = requests.request("POST", url, headers=headers, json=data, timeout=60)
+        if not response.ok:
+            logging.error(f"post data to {url} failed")
+            raise StatusError(response.status_code, f"post {url}")
+        return json.loads(response.content)
+
+    try:
+        j_res = GetRetryPolicy().Call(post, breaker=GetCircuitBreaker(f"http:{urlparse(url).netloc}"),
+                                      name=f"post {url}")
+    except Exception as e:
+        logging.error(e)
+        return None
+    if j_res['code'] != '0' and j_res['code'] != 0:
+        logging.error("wrong post params, return code = {}".format(j_res['code']))
+        logging.error("return msg = {}".format(j_res["message"]))
+        return None
+    return j_res
 
 
 def HttpGetJson(url):
@@ -198,26 +175,124 @@ def HttpGetJson(url):
     return None
 
 
-def TarLocalFolder(folder_path, output_root, zip_mark=False):
+"""
+检查已存在的归档能否复用：verify为fast时只比对完成标记与源文件指纹，full时额外读取整个归档校验crc32；
+不可复用的归档（包括没有完成标记的旧归档）删除完成标记后重新打包，归档本身由新归档原子替换，
+正在上传旧归档的任务（已打开文件）不会读到写了一半的内容
+"""
+def _CheckExistingArchive(tar_file, member_pairs, zip_mark=False, verify="fast"):
+    if not os.path.exists(tar_file):
+        return False
+    if CheckArchiveMarker(tar_file, member_pairs, full=(verify == "full")) and \
+            (zip_mark or os.path.exists(tar_file + INDEX_SUFFIX)):
+        logging.info(f"{tar_file} is already exsited")
+        return True
+    if os.path.exists(tar_file + DONE_SUFFIX):
+        os.remove(tar_file + DONE_SUFFIX)
+    return False
+
+def _ReadOrderedMembers(member_pairs):
+    """ 目录、链接等按原顺序在前，普通文件按磁盘物理布局排序，减少机械盘寻道 """
+    entries, files = [], []
+    for src_path, arcname in member_pairs:
+        if os.path.isfile(src_path) and not os.path.islink(src_path):
+            files.append((src_path, arcname))
+        else:
+            entries.append((src_path, arcname))
+    return entries + SortByLayout(files, key=lambda pair: pair[0])
+
+def _WriteArchive(tar_file, member_pairs, zip_mark, codec, level, workers, stats):
+    """ 写入临时文件，完成后替换tar_file，再写入索引与完成标记 """
+    tmp_file = tar_file + ".tmp"
+    archive_writer = None
+    try:
+        if zip_mark:
+            archive_writer = ParallelCompressWriter(tmp_file, codec=codec, level=level, workers=workers, pool=GetCpuPool())
+        else:
+            archive_writer = ChecksumFileWriter(tmp_file)
+        writer = IndexedTarWriter(fileobj=archive_writer)
+        for src_path, arcname in member_pairs:
+            writer.AddFile(src_path, arcname)
+        writer.Close()
+        archive_writer.close()
+        os.replace(tmp_file, tar_file)
+        if zip_mark:
+            logging.info(f"{tar_file} compressed {archive_writer.raw_bytes} -> {archive_writer.compressed_bytes} bytes")
+        else:
+            writer.WriteIndex(tar_file + INDEX_SUFFIX, os.path.basename(tar_file))
+        writer.WriteMarker(tar_file, archive_writer, codec if zip_mark else "store")
+        if stats is not None:
+            stats["raw_bytes"] = archive_writer.raw_bytes
+            stats["compressed_bytes"] = archive_writer.compressed_bytes
+            stats["cpu_seconds"] = archive_writer.cpu_seconds
+    except Exception as e:
+        logging.error(f"failed to tar {tar_file} : {e}")
+        # 关闭与删除不完整的临时文件时的错误（如磁盘已满）只记录日志，不覆盖原始错误
+        try:
+            if archive_writer is not None:
+                archive_writer.abort()
+        except Exception as close_error:
+            logging.error(f"failed to close {tmp_file} : {close_error}")
+        try:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        except OSError as remove_error:
+            logging.error(f"failed to remove {tmp_file} : {remove_error}")
+        return False
+    return True
+
+ARCHIVE_SUFFIX_MAP = {"gzip": ".tgz", "zstd": ".tar.zst", "lz4": ".tar.lz4"}
+
+"""
+打包本地文件夹，均在进程内完成：
+  - 非压缩模式同时输出成员偏移索引<tar>.idx.json（路径、header/data偏移、大小、md5），
+    上传后可通过SeekableTarReader按range读取单个成员
+  - 压缩模式(zip_mark)使用多线程分块压缩（启用CpuPool时在子进程中压缩），codec支持gzip(.tgz)/zstd(.tar.zst)/lz4(.tar.lz4)，
+    codec为store时等同于非压缩模式，level/workers可配置
+  - 打包完成后写入完成标记<tar>.done.json，已存在的归档按verify（fast/full）检查后复用
+  - stats不为None时写入 raw_bytes/compressed_bytes/cpu_seconds，用于统计压缩收益
+"""
+def TarLocalFolder(folder_path, output_root, zip_mark=False, codec="gzip", level=6, workers=None, stats=None,
+                   verify="fast"):
     if not os.path.exists(folder_path):
         return None
     os.makedirs(output_root, exist_ok=True)
     folder_name = os.path.basename(folder_path)
+    if codec == "store":
+        zip_mark = False
     if zip_mark:
-        tar_file = os.path.join(output_root, f"{folder_name}.tgz")
-        cmd = f"tar -czf {tar_file} -C {folder_path} ."
+        tar_file = os.path.join(output_root, f"{folder_name}{ARCHIVE_SUFFIX_MAP[codec]}")
     else:
         tar_file = os.path.join(output_root, f"{folder_name}.tar")
-        cmd = f"tar -cf {tar_file} -C {folder_path} ."
-    if os.path.exists(tar_file):
-        if os.system('tar -tvf {} > /dev/null 2>&1'.format(tar_file)):
-            os.remove(tar_file)
-        else:
-            logging.info(f"{tar_file} is already exsited")
-            return tar_file
-    logging.info(cmd)
-    if os.system(cmd):
-        return None
+    if _CheckExistingArchive(tar_file, IterTree(folder_path), zip_mark, verify):
+        return tar_file
+    logging.info(f"tar {folder_path} -> {tar_file}")
+    with GetReadLimiter().Slot(folder_path):
+        if not _WriteArchive(tar_file, _ReadOrderedMembers(IterTree(folder_path)), zip_mark, codec, level, workers,
+                             stats):
+            return None
+    return tar_file
+
+"""
+将指定的成员列表[(src_path, arcname)]直接打包为output_root/<archive_name>.tar（附带成员索引与完成标记），不经过临时目录拷贝；
+root_path不为空时以其属性写入根目录"."，与TarLocalFolder的成员布局一致
+"""
+def TarLocalMembers(member_list, output_root, archive_name, root_path=None, verify="fast"):
+    os.makedirs(output_root, exist_ok=True)
+    tar_file = os.path.join(output_root, f"{archive_name}.tar")
+
+    def memberPairs():
+        if root_path is not None:
+            yield root_path, "."
+        yield from IterMembers(member_list)
+
+    if _CheckExistingArchive(tar_file, memberPairs(), verify=verify):
+        return tar_file
+    logging.info(f"tar {len(member_list)} members -> {tar_file}")
+    read_root = root_path if root_path is not None else (member_list[0][0] if member_list else output_root)
+    with GetReadLimiter().Slot(read_root):
+        if not _WriteArchive(tar_file, _ReadOrderedMembers(memberPairs()), False, "store", None, None, None):
+            return None
     return tar_file
 
 def GetFileSize(file_path, isLogicSize=False):
@@ -264,6 +339,12 @@ class ProgressManager:
         with self.lock:
             self.main_bar.update(amount)
 
+    def AddTotal(self, amount):
+        """ 监听模式下发现新的数据包时增加总量 """
+        with self.lock:
+            self.main_bar.total += amount
+            self.main_bar.refresh()
+
     def add_thread_bar(self, thread_id, total):
         with self.lock:
             self.thread_bars[thread_id] = tqdm(
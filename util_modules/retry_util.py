@@ -0,0 +1,354 @@
+"""
+统一的重试策略
+  - IsRetryable : 错误分类，网络异常、超时、限流（429）与服务端错误（5xx）可重试，参数/权限/本地文件错误与无法识别的异常不重试
+  - RetryPolicy : 指数退避 + full jitter（sleep = random(0, min(max_delay, base_delay * 2^n))），避免所有worker同时重试
+  - RetryBudget : 整个运行的重试预算，重试次数不超过 min_retries + ratio * 请求数，故障期间不会因重试放大流量
+  - CircuitBreaker : 每个endpoint一个熔断器，连续可重试失败达到阈值后打开，调用方阻塞等待（暂停调度）而不是直接失败，
+    到期后半开放行一个试探请求，成功则关闭；一次调用从开始起最多暂停max_pause_seconds，超过后抛出CircuitOpenError；
+    不可重试的失败（参数、权限、本地文件等）与后端健康无关，不改变熔断状态
+"""
+import errno
+import logging
+import random
+import socket
+import threading
+import time
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# ExpiredToken、RequestTimeTooSkewed需要刷新凭证或校准本机时钟，原样重试不会成功，也不应触发熔断，按不可重试处理
+RETRYABLE_CODES = {"RequestTimeout", "SlowDown", "InternalError", "ServiceUnavailable", "Throttling",
+                   "ThrottlingException", "TooManyRequests"}
+# 各SDK底层的网络异常（urllib3、http.client、botocore等，不继承内置ConnectionError），按类名识别
+NETWORK_ERRORS = {"MaxRetryError", "ProtocolError", "ReadTimeoutError", "ConnectTimeoutError", "NewConnectionError",
+                  "IncompleteRead", "HTTPClientError", "EndpointConnectionError", "ConnectionClosedError",
+                  "ResponseStreamingError", "ChunkedEncodingError", "SSLError"}
+NETWORK_ERRNOS = {None, errno.ECONNRESET, errno.ECONNREFUSED, errno.ECONNABORTED, errno.ETIMEDOUT, errno.EPIPE,
+                  errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ENETDOWN}
+
+
+class StatusError(Exception):
+    """ 返回值表示失败的请求（如HTTP状态码非2xx），按status分类 """
+    def __init__(self, status, message=""):
+        super().__init__(f"status={status} {message}".strip())
+        self.status = status
+
+
+class RetryableError(Exception):
+    """ 调用方明确可以重试的失败 """
+
+
+class CircuitOpenError(Exception):
+    """ 熔断器打开超过最长等待时间 """
+
+
+class RequestCancelled(Exception):
+    """ 请求已被调用方取消（如对冲请求中的另一方已成功），不再重试 """
+
+
+def _Status(error):
+    for attr in ("status", "status_code", "http_status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):  # botocore ClientError
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    if response is not None and isinstance(getattr(response, "status_code", None), int):  # requests
+        return response.status_code
+    if response is not None and isinstance(getattr(response, "status", None), int):  # minio S3Error（urllib3响应）
+        return response.status
+    return None
+
+
+def _Code(error):
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    code = getattr(error, "code", None)
+    return code if isinstance(code, str) else None
+
+
+def _IsNetworkError(error):
+    """ 异常本身或其原因（SDK包装的底层异常，如tos的TosClientError）是否为网络异常 """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (ConnectionError, TimeoutError, socket.timeout)):
+            return True
+        if isinstance(error, OSError) and error.errno in NETWORK_ERRNOS:
+            # requests的ConnectionError/Timeout等继承OSError，errno为None
+            return True
+        if any(cls.__name__ in NETWORK_ERRORS for cls in type(error).__mro__):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def IsRetryable(error):
+    """ 判断异常是否值得重试；无法识别的异常不重试，避免参数、权限等错误反复重试并触发熔断 """
+    if isinstance(error, (RetryableError, ConnectionError, TimeoutError, socket.timeout)):
+        return True
+    if isinstance(error, (CircuitOpenError, RequestCancelled, FileNotFoundError, PermissionError, IsADirectoryError,
+                          ValueError, TypeError, KeyError, NotImplementedError)):
+        return False
+    if _Code(error) in RETRYABLE_CODES:
+        return True
+    status = _Status(error)
+    if status is not None:
+        # oss2等SDK对网络错误使用负数/0状态码
+        return status <= 0 or status in RETRYABLE_STATUS or status >= 500
+    return _IsNetworkError(error)
+
+
+class RetryBudget:
+    def __init__(self, ratio=0.2, min_retries=20):
+        """
+        ratio : 每个请求为预算增加的重试额度
+        min_retries : 请求较少时也允许的重试次数
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def OnRequest(self):
+        with self.lock:
+            self.requests += 1
+
+    def TryRetry(self):
+        """ 预算允许时计入一次重试并返回True """
+        with self.lock:
+            if self.retries >= self.min_retries + self.ratio * self.requests:
+                self.rejected += 1
+                if self.rejected == 1 or self.rejected % 100 == 0:
+                    logging.warning(f"retry budget exhausted: requests={self.requests}, retries={self.retries}, "
+                                    f"rejected={self.rejected}")
+                return False
+            self.retries += 1
+            return True
+
+    def Metrics(self):
+        with self.lock:
+            return {"requests": self.requests, "retries": self.retries, "rejected": self.rejected}
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, open_seconds=30, max_open_seconds=600, max_pause_seconds=3600):
+        """
+        failure_threshold : 连续可重试失败多少次后打开
+        open_seconds : 首次打开时长，半开试探失败后翻倍，最长max_open_seconds
+        max_pause_seconds : 调用方最长等待时间，超过后抛出CircuitOpenError
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.max_pause_seconds = max_pause_seconds
+        self.cond = threading.Condition()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.current_open_seconds = open_seconds
+        self.open_until = 0.0
+        self.trial_inflight = False
+        self.opened_times = 0
+        self.paused_seconds = 0.0
+
+    def Acquire(self, deadline=None):
+        """
+        请求前调用：关闭状态直接返回；打开状态阻塞等待；半开状态只放行一个试探请求
+        deadline : 最晚等待到的时间点（time.time()），为None时最多等待max_pause_seconds，超过后抛出CircuitOpenError
+        """
+        st = time.time()
+        if deadline is None:
+            deadline = st + self.max_pause_seconds
+        with self.cond:
+            while True:
+                if self.state == self.CLOSED:
+                    break
+                now = time.time()
+                if self.state == self.OPEN and now >= self.open_until:
+                    self.state = self.HALF_OPEN
+                    logging.info(f"circuit {self.name} half open, sending trial request")
+                if self.state == self.HALF_OPEN and not self.trial_inflight:
+                    self.trial_inflight = True
+                    break
+                if now >= deadline:
+                    self.paused_seconds += now - st
+                    raise CircuitOpenError(f"circuit {self.name} open for more than {self.max_pause_seconds}s")
+                wait = self.open_until - now if self.state == self.OPEN else 1.0
+                self.cond.wait(timeout=max(0.05, min(wait, deadline - now)))
+            self.paused_seconds += time.time() - st
+
+    def Available(self):
+        """ 是否可以立即放行请求：关闭，或打开已到期，或半开且没有进行中的试探请求 """
+        with self.cond:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.time() >= self.open_until
+            return not self.trial_inflight
+
+    def Record(self, ok, retryable=True):
+        """
+        请求结束后调用，只有可重试的失败（网络、限流、5xx）计入熔断；不可重试的失败不计入失败也不重置状态，
+        半开状态下只结束本次试探、放行下一个试探请求；返回熔断器当前是否未关闭
+        """
+        with self.cond:
+            if self.state == self.HALF_OPEN and self.trial_inflight:
+                self.trial_inflight = False
+            if not ok and not retryable:
+                self.cond.notify_all()
+                return self.state != self.CLOSED
+            if ok:
+                if self.state != self.CLOSED:
+                    logging.info(f"circuit {self.name} closed")
+                self.state = self.CLOSED
+                self.consecutive_failures = 0
+                self.current_open_seconds = self.open_seconds
+                self.cond.notify_all()
+                return False
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN:
+                self.current_open_seconds = min(self.max_open_seconds, self.current_open_seconds * 2)
+                self._Open()
+            elif self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._Open()
+            self.cond.notify_all()
+            return self.state != self.CLOSED
+
+    def _Open(self):
+        """ 在self.cond内调用 """
+        self.state = self.OPEN
+        self.open_until = time.time() + self.current_open_seconds
+        self.opened_times += 1
+        logging.warning(f"circuit {self.name} open for {self.current_open_seconds}s after "
+                        f"{self.consecutive_failures} consecutive failures, pausing requests")
+
+    def Metrics(self):
+        with self.cond:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "opened_times": self.opened_times,
+                "paused_seconds": round(self.paused_seconds, 1)
+            }
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=60.0, budget=None):
+        """
+        max_attempts : 最多尝试次数（含第一次）
+        base_delay / max_delay : 退避基数与上限（秒）
+        budget : RetryBudget，为None时使用全局预算
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def Backoff(self, attempt):
+        """ 第attempt次重试前的等待时间（full jitter） """
+        return random.uniform(0, min(self.max_delay, self.base_delay * pow(2, attempt)))
+
+    def Call(self, func, *args, breaker=None, name=None, is_ok=None, pick=None, **kwargs):
+        """
+        执行func(*args, **kwargs)，可重试的异常按退避重试；is_ok(result)为False的返回值视为可重试失败，
+        重试耗尽后返回最后一次的结果；不可重试的异常与重试耗尽后的异常直接抛出。
+        pick : pick() -> (index, breaker)，每次尝试前选择endpoint（如EndpointBalancer.PickBreaker），
+               以func(*args, index=index, **kwargs)调用并使用该endpoint的熔断器，此时忽略breaker参数
+        熔断器打开期间的失败不消耗重试预算、不退避（在Acquire中等待后端恢复或改选其它endpoint），但计入尝试次数；
+        从调用开始累计暂停超过熔断器的max_pause_seconds时抛出CircuitOpenError
+        """
+        budget = self.budget or GetRetryBudget()
+        budget.OnRequest()
+        st = time.time()
+        attempt = 0
+        while True:
+            call_kwargs = kwargs
+            if pick is not None:
+                index, breaker = pick()
+                call_kwargs = dict(kwargs, index=index)
+            if breaker is not None:
+                breaker.Acquire(st + breaker.max_pause_seconds)
+            error = None
+            result = None
+            try:
+                result = func(*args, **call_kwargs)
+                ok = is_ok(result) if is_ok is not None else True
+                retryable = not ok
+            except Exception as e:
+                error = e
+                ok = False
+                retryable = IsRetryable(e)
+            tripped = breaker.Record(ok, retryable) if breaker is not None else False
+            if ok:
+                return result
+            attempt += 1
+            if tripped and retryable and attempt < self.max_attempts:
+                continue
+            if not retryable or attempt >= self.max_attempts or not budget.TryRetry():
+                if error is not None:
+                    raise error
+                return result
+            delay = self.Backoff(attempt - 1)
+            logging.warning(f"{name or getattr(func, '__name__', 'request')} failed "
+                            f"({error if error is not None else 'bad result'}), "
+                            f"retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+_budget = None
+_policy = None
+_breakers = {}
+_breaker_kwargs = {}
+_lock = threading.Lock()
+
+
+def InitRetryPolicy(max_attempts=3, base_delay=1.0, max_delay=60.0, budget_ratio=0.2, min_retries=20,
+                    **breaker_kwargs) -> RetryPolicy:
+    """ 配置全局重试策略、重试预算与熔断参数（failure_threshold、open_seconds等），已创建的熔断器不受影响 """
+    global _budget, _policy, _breaker_kwargs
+    with _lock:
+        _budget = RetryBudget(budget_ratio, min_retries)
+        _policy = RetryPolicy(max_attempts, base_delay, max_delay, _budget)
+        _breaker_kwargs = breaker_kwargs
+        return _policy
+
+
+def GetRetryBudget() -> RetryBudget:
+    global _budget
+    with _lock:
+        if _budget is None:
+            _budget = RetryBudget()
+        return _budget
+
+
+def GetRetryPolicy() -> RetryPolicy:
+    global _policy
+    with _lock:
+        if _policy is None:
+            _policy = RetryPolicy()
+        return _policy
+
+
+def GetCircuitBreaker(name) -> CircuitBreaker:
+    """ 按名称（后端类型 + endpoint）共享熔断器 """
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **_breaker_kwargs)
+        return _breakers[name]
+
+
+def RetryMetrics():
+    with _lock:
+        breakers = list(_breakers.values())
+    return {
+        "budget": GetRetryBudget().Metrics(),
+        "circuits": [breaker.Metrics() for breaker in breakers]
+    }
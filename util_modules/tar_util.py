@@ -0,0 +1,454 @@
+"""
+进程内tar打包工具
+  - IndexedTarWriter : 写tar的同时记录每个成员的header/data偏移与校验值，可输出索引文件（<tar>.idx.json）
+  - PackSmallFiles : 将文件夹内的小文件按目标大小打包成若干tar分片，大文件保持原样，并输出清单
+  - ParallelCompressWriter : 多线程分块压缩，输出pigz风格的多member gzip或多frame zstd，标准工具可直接解压
+  - 完成标记（<tar>.done.json）: 记录归档大小、成员数、header块校验值与源目录指纹，续传时无需重新读取整个归档即可判断能否复用
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import stat
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from util_modules.disk_util import FadviseSequential, FadviseDontNeed, GetReadLimiter
+
+COPY_BUFSIZE = 4 * 1024 * 1024
+INDEX_SUFFIX = ".idx.json"
+DONE_SUFFIX = ".done.json"
+
+
+def IterTree(root, arc_root="."):
+    """ 按打包顺序返回(src_path, arcname)，等价于 tar -C root arc_root，成员名以"./"开头 """
+    yield root, arc_root
+    for cur_root, dirs, files in os.walk(root):
+        dirs.sort()
+        rel_root = os.path.relpath(cur_root, root)
+        for name in dirs + sorted(files):
+            arcname = os.path.normpath(os.path.join(rel_root, name)).replace("\\", "/")
+            yield os.path.join(cur_root, name), f"{arc_root}/{arcname}"
+
+
+def IterMembers(member_list, arc_root="."):
+    """ 将[(src_path, arcname)]展开为打包顺序的成员列表，目录递归展开 """
+    for src_path, arcname in member_list:
+        arcname = f"{arc_root}/{arcname.strip('/')}"
+        if os.path.isdir(src_path) and not os.path.islink(src_path):
+            yield from IterTree(src_path, arcname)
+        else:
+            yield src_path, arcname
+
+
+def _FingerprintLine(arcname, st):
+    # 目录的mtime随子项增删变化（如行程目录下新拷贝的clip不是归档成员），子项的变化已由各自的指纹行体现，不计入
+    if stat.S_ISDIR(st.st_mode):
+        return f"{arcname}\0dir\n"
+    size = st.st_size if stat.S_ISREG(st.st_mode) else 0
+    return f"{arcname}\0{size}\0{st.st_mtime_ns}\n"
+
+
+def _Fingerprint(lines):
+    """ 与成员写入顺序无关（成员可能按磁盘物理布局排序写入） """
+    return hashlib.sha1("".join(sorted(lines)).encode("utf-8", "surrogateescape")).hexdigest()
+
+
+def SourceFingerprint(member_pairs):
+    """ 源文件指纹：成员名、大小与mtime，只需stat，不读取文件内容 """
+    return _Fingerprint([_FingerprintLine(arcname, os.lstat(src_path)) for src_path, arcname in member_pairs])
+
+
+class _HashingReader:
+    """ 包装源文件，tarfile拷贝数据时顺带计算md5，避免二次读取；按所在设备限速并上报读取延迟 """
+    def __init__(self, fp, dev):
+        self.fp = fp
+        self.dev = dev
+        self.md5 = hashlib.md5()
+        self.limiter = GetReadLimiter()
+
+    def read(self, size=-1):
+        self.limiter.Throttle(self.dev, size if size and size > 0 else COPY_BUFSIZE)
+        st = time.time()
+        data = self.fp.read(size)
+        self.limiter.Report(self.dev, len(data), time.time() - st)
+        self.md5.update(data)
+        return data
+
+
+class IndexedTarWriter:
+    def __init__(self, tar_file=None, fileobj=None):
+        self.tar = tarfile.open(name=tar_file, fileobj=fileobj, mode="w", format=tarfile.PAX_FORMAT,
+                                copybufsize=COPY_BUFSIZE)
+        self.members = []  # [{"path", "header_offset", "data_offset", "size", "md5"}]
+        self.member_index = {}  # <path, record>，硬链接成员按链接目标查找数据位置
+        self.header_crc = 0  # 所有header块的滚动crc32
+        self.fingerprint_lines = []  # 源文件指纹，与SourceFingerprint一致
+
+    def AddFile(self, src_path, arcname):
+        """ 写入单个成员并返回其索引记录；socket与FIFO不能归档，跳过并返回None """
+        st = os.lstat(src_path)
+        self.fingerprint_lines.append(_FingerprintLine(arcname, st))
+        tarinfo = self.tar.gettarinfo(src_path, arcname)
+        if tarinfo is None or tarinfo.isfifo():
+            logging.warning(f"skip special file {src_path}")
+            return None
+        header_offset = self.tar.offset
+        header = tarinfo.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        self.header_crc = zlib.crc32(header, self.header_crc)
+        checksum = None
+        if tarinfo.isreg():
+            with open(src_path, "rb") as fp:
+                FadviseSequential(fp.fileno())
+                reader = _HashingReader(fp, st.st_dev)
+                self.tar.addfile(tarinfo, reader)
+                checksum = reader.md5.hexdigest()
+                # 源文件只读一次，读完释放page cache
+                FadviseDontNeed(fp.fileno())
+        else:
+            self.tar.addfile(tarinfo)
+        record = {
+            "path": arcname,
+            "header_offset": header_offset,
+            "data_offset": header_offset + len(header),
+            "size": tarinfo.size if tarinfo.isreg() else 0,
+            "md5": checksum
+        }
+        target = self.member_index.get(tarinfo.linkname) if tarinfo.islnk() else None
+        if target is not None:
+            # 硬链接成员本身没有数据，索引指向链接目标的数据，按range读取时与目标一致
+            record.update(data_offset=target["data_offset"], size=target["size"], md5=target["md5"])
+        self.members.append(record)
+        self.member_index[tarinfo.name] = record
+        return record
+
+    def AddTree(self, root, arc_root="."):
+        """ 等价于 tar -C root arc_root，成员名以"./"开头 """
+        for src_path, arcname in IterTree(root, arc_root):
+            self.AddFile(src_path, arcname)
+
+    def AddMembers(self, member_list, arc_root="."):
+        """ 按[(src_path, arcname)]直接写入指定成员，目录递归写入，无需先拷贝到临时目录 """
+        for src_path, arcname in IterMembers(member_list, arc_root):
+            self.AddFile(src_path, arcname)
+
+    def WriteIndex(self, index_file, archive_name=None):
+        """ 输出成员偏移索引，供SeekableTarReader通过range请求读取单个成员 """
+        with open(index_file + ".tmp", "w") as fp:
+            json.dump({
+                "archive": archive_name,
+                "format": "tar",
+                "members": self.members
+            }, fp)
+        os.replace(index_file + ".tmp", index_file)
+
+    def WriteMarker(self, tar_file, archive_writer, codec="store"):
+        """ 归档与索引全部落盘后写入完成标记，archive_writer为ChecksumFileWriter或ParallelCompressWriter """
+        with open(tar_file + DONE_SUFFIX + ".tmp", "w") as fp:
+            json.dump({
+                "archive": os.path.basename(tar_file),
+                "codec": codec,
+                "size": archive_writer.compressed_bytes,
+                "archive_crc32": archive_writer.crc,
+                "members": len(self.members),
+                "header_crc32": self.header_crc,
+                "fingerprint": _Fingerprint(self.fingerprint_lines)
+            }, fp)
+        os.replace(tar_file + DONE_SUFFIX + ".tmp", tar_file + DONE_SUFFIX)
+
+    @property
+    def offset(self):
+        return self.tar.offset
+
+    def Close(self):
+        self.tar.close()
+
+
+class ChecksumFileWriter:
+    """ 不压缩的输出文件，写入时计算整个归档的crc32，接口与ParallelCompressWriter一致 """
+    def __init__(self, output_file):
+        self.fp = open(output_file, "wb")
+        self.raw_bytes = 0
+        self.crc = 0
+        self.cpu_seconds = 0.0
+
+    @property
+    def compressed_bytes(self):
+        return self.raw_bytes
+
+    def write(self, data):
+        self.fp.write(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.raw_bytes += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.raw_bytes
+
+    def close(self):
+        self.fp.close()
+
+    def abort(self):
+        """ 出错时关闭文件，不再写出数据 """
+        self.fp.close()
+
+
+class ParallelCompressWriter:
+    """
+    写入的数据按block_size切块，在线程池中独立压缩（zlib/zstd压缩时释放GIL），按顺序写出：
+      - gzip : 每块一个完整的gzip member，拼接后 gzip -d / tar -xzf 可直接解压
+      - zstd : 每块一个zstd frame，需要安装zstandard
+      - lz4 : 每块一个lz4 frame，需要安装lz4
+    tell()返回已写入的未压缩字节数，供tarfile计算偏移；cpu_seconds为各压缩线程累计的CPU耗时，crc为压缩后输出的crc32
+    pool不为None时数据块通过共享内存交给CpuPool的子进程压缩，不占用当前进程的GIL
+    """
+    def __init__(self, output_file, codec="gzip", level=6, workers=None, block_size=4 * 1024 * 1024, pool=None):
+        self.codec = codec
+        self.level = level
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        if codec == "zstd":
+            import zstandard
+            self._zstd_params = zstandard.ZstdCompressionParameters.from_level(level)
+            self._zstandard = zstandard
+        elif codec == "lz4":
+            import lz4.frame
+            self._lz4_frame = lz4.frame
+        elif codec != "gzip":
+            raise ValueError(f"unsupported codec {codec}")
+        self.pool = pool if pool is not None and pool.slot_size >= block_size else None
+        if self.pool is not None:
+            self.workers = self.pool.workers
+        self.fp = open(output_file, "wb")
+        self.executor = ThreadPoolExecutor(max_workers=self.workers) if self.pool is None else None
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.cpu_seconds = 0.0
+        self.crc = 0
+
+    def _Compress(self, block):
+        st = time.thread_time()
+        if self.codec == "gzip":
+            data = gzip.compress(block, compresslevel=self.level, mtime=0)
+        elif self.codec == "lz4":
+            data = self._lz4_frame.compress(block, compression_level=self.level)
+        else:
+            data = self._zstandard.ZstdCompressor(compression_params=self._zstd_params).compress(block)
+        return data, time.thread_time() - st
+
+    def _Flush(self, final=False):
+        while len(self.buffer) >= self.block_size or (final and self.buffer):
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            if self.pool is not None:
+                self.pending.append(self.pool.SubmitCompress(block, self.codec, self.level))
+            else:
+                self.pending.append(self.executor.submit(self._Compress, block))
+            # 限制在途的块数量，避免内存无限增长
+            while len(self.pending) > self.workers * 2:
+                self._WriteOne()
+        if final:
+            while self.pending:
+                self._WriteOne()
+
+    def _WriteOne(self):
+        data, cpu_seconds = self.pending.popleft().result()
+        self.cpu_seconds += cpu_seconds
+        self.fp.write(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.compressed_bytes += len(data)
+
+    def write(self, data):
+        self.buffer += data
+        self.raw_bytes += len(data)
+        if len(self.buffer) >= self.block_size:
+            self._Flush()
+        return len(data)
+
+    def tell(self):
+        return self.raw_bytes
+
+    def close(self):
+        if self.fp.closed:
+            return
+        try:
+            self._Flush(final=True)
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            self.fp.close()
+
+    def abort(self):
+        """ 出错时丢弃未写出的数据块并关闭文件，不会再次触发压缩或写盘错误 """
+        if self.fp.closed:
+            return
+        # 在途的压缩任务执行完后自行释放资源，结果直接丢弃
+        self.buffer = bytearray()
+        self.pending.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.fp.close()
+
+
+"""
+检查已存在的归档能否复用：完成标记存在、文件大小一致且源文件指纹未变化，只读取标记文件与源目录元数据；
+full为True时额外读取整个归档校验crc32
+"""
+def CheckArchiveMarker(tar_file, member_pairs, full=False):
+    try:
+        with open(tar_file + DONE_SUFFIX, "r") as fp:
+            marker = json.load(fp)
+        if os.path.getsize(tar_file) != marker["size"]:
+            logging.warning(f"{tar_file} size mismatch, expect {marker['size']}")
+            return False
+        if SourceFingerprint(member_pairs) != marker["fingerprint"]:
+            logging.warning(f"source of {tar_file} has changed since archived")
+            return False
+        if full:
+            crc = 0
+            with open(tar_file, "rb") as fp:
+                while True:
+                    data = fp.read(COPY_BUFSIZE)
+                    if not data:
+                        break
+                    crc = zlib.crc32(data, crc)
+            if crc != marker["archive_crc32"]:
+                logging.warning(f"{tar_file} checksum mismatch")
+                return False
+    except (OSError, ValueError, KeyError) as e:
+        logging.info(f"{tar_file} is not reusable : {e}")
+        return False
+    return True
+
+
+"""
+将folder_path下小于small_file_threshold的文件打包成约shard_size大小的tar分片，输出到output_root
+返回 (shard_list, large_file_list, manifest_file)
+  - shard_list : 分片文件绝对路径列表
+  - large_file_list : [(rel_path, abs_path)]，大文件不打包，按原路径上传
+  - manifest_file : 清单，记录每个原始相对路径所在的分片与数据偏移，大文件的shard为null
+"""
+def PackSmallFiles(folder_path, output_root, small_file_threshold=1024 * 1024, shard_size=256 * 1024 * 1024):
+    if not os.path.isdir(folder_path):
+        return None
+    os.makedirs(output_root, exist_ok=True)
+    folder_name = os.path.basename(os.path.normpath(folder_path))
+
+    shard_list = []
+    large_file_list = []
+    manifest = {}
+    writer = None
+    shard_name = None
+
+    def closeShard():
+        nonlocal writer, shard_name
+        if writer is None:
+            return
+        writer.Close()
+        writer = None
+        shard_name = None
+
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            abs_path = os.path.join(root, file)
+            rel_path = os.path.relpath(abs_path, folder_path).replace("\\", "/")
+            if os.path.islink(abs_path) and not os.path.exists(abs_path):
+                logging.warning(f"skip broken symlink {abs_path}")
+                continue
+            if not os.path.islink(abs_path) and not os.path.isfile(abs_path):
+                logging.warning(f"skip special file {abs_path}")
+                continue
+            file_size = os.path.getsize(abs_path)
+            if file_size >= small_file_threshold or os.path.islink(abs_path):
+                large_file_list.append((rel_path, abs_path))
+                manifest[rel_path] = {"shard": None, "offset": 0, "size": file_size}
+                continue
+            if writer is None:
+                shard_name = f"{folder_name}_pack_{len(shard_list):05d}.tar"
+                shard_list.append(os.path.join(output_root, shard_name))
+                writer = IndexedTarWriter(shard_list[-1])
+            record = writer.AddFile(abs_path, rel_path)
+            manifest[rel_path] = {"shard": shard_name, "offset": record["data_offset"], "size": record["size"]}
+            if writer.offset >= shard_size:
+                closeShard()
+    closeShard()
+
+    manifest_file = os.path.join(output_root, f"{folder_name}_pack_manifest.json")
+    with open(manifest_file, "w") as fp:
+        json.dump({
+            "source": folder_name,
+            "small_file_threshold": small_file_threshold,
+            "shard_size": shard_size,
+            "shards": [os.path.basename(shard) for shard in shard_list],
+            "files": manifest
+        }, fp)
+    logging.info(f"packed {folder_path} into {len(shard_list)} shards, {len(large_file_list)} large files kept as-is")
+    return shard_list, large_file_list, manifest_file
+
+
+"""
+性能测试:
+  python -m util_modules.tar_util pack [file_count] [file_size]     小文件打包 objects/s 与 MB/s
+  python -m util_modules.tar_util compress <folder> [workers] [level] 多线程压缩与 tar -czf 的MB/s对比
+"""
+if __name__ == "__main__":
+    import sys
+    import shutil
+    import subprocess
+    import tempfile
+
+    mode = sys.argv[1] if len(sys.argv) > 1 else "pack"
+    if mode == "compress":
+        folder = sys.argv[2]
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+        level = int(sys.argv[4]) if len(sys.argv) > 4 else 6
+        work_root = tempfile.mkdtemp(prefix="compress_bench_")
+        total_mb = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(folder)
+                       for f in files) / pow(1024, 2)
+
+        st = time.time()
+        subprocess.run(f"tar -czf {work_root}/baseline.tgz -C {folder} .", shell=True, check=True)
+        baseline_cost = time.time() - st
+
+        st = time.time()
+        writer = ParallelCompressWriter(f"{work_root}/parallel.tgz", level=level, workers=workers)
+        tar_writer = IndexedTarWriter(fileobj=writer)
+        tar_writer.AddTree(folder)
+        tar_writer.Close()
+        writer.close()
+        parallel_cost = time.time() - st
+        subprocess.run(f"tar -tzf {work_root}/parallel.tgz > /dev/null", shell=True, check=True)
+
+        print(f"data={total_mb:.1f}MB, tar -czf: {total_mb / baseline_cost:.1f} MB/s "
+              f"({os.path.getsize(work_root + '/baseline.tgz') / pow(1024, 2):.1f}MB), "
+              f"parallel x{workers}: {total_mb / parallel_cost:.1f} MB/s "
+              f"({os.path.getsize(work_root + '/parallel.tgz') / pow(1024, 2):.1f}MB)")
+        shutil.rmtree(work_root)
+        sys.exit(0)
+
+    file_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    file_size = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+    work_root = tempfile.mkdtemp(prefix="pack_bench_")
+    src_root = os.path.join(work_root, "clip_bench")
+    payload = os.urandom(file_size)
+    for i in range(file_count):
+        sub_root = os.path.join(src_root, f"cam_{i % 8}", f"{i // 1000:04d}")
+        os.makedirs(sub_root, exist_ok=True)
+        with open(os.path.join(sub_root, f"{i:08d}.jpg"), "wb") as fp:
+            fp.write(payload)
+
+    st = time.time()
+    shards, large_files, manifest_file = PackSmallFiles(src_root, os.path.join(work_root, "out"))
+    cost = time.time() - st
+    total_mb = file_count * file_size / pow(1024, 2)
+    print(f"files={file_count}, shards={len(shards)}, cost={cost:.2f}s, "
+          f"{file_count / cost:.0f} objects/s, {total_mb / cost:.1f} MB/s, "
+          f"requests {file_count} -> {len(shards) + len(large_files) + 1}")
+    shutil.rmtree(work_root)
@@ -0,0 +1,299 @@
+"""
+带超时的函数调用
+  - TimeoutExecutor.Call : 在可复用的线程池中执行，超时抛出TimeoutError；线程无法强制结束，超时的调用通过CancelToken
+    协作取消（I/O调用在每次读写/重试前检查），占用的worker被放弃并补充新的线程，线程池容量不受影响
+  - TimeoutExecutor.CallIsolated : 在可复用的子进程池中执行，只用于确实可能卡死（不可中断的系统调用、C扩展死循环）的代码，
+    超时后结束子进程并重建进程池；func与参数需要可以pickle
+  - timeout_retry : 装饰器，超时或失败时按统一重试策略重试，重试耗尽后抛出最后一次的异常
+"""
+import concurrent.futures
+import importlib
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from functools import wraps
+
+from util_modules.retry_util import RequestCancelled, RetryPolicy
+
+
+class CancelToken:
+    """ 调用超时后被取消，长时间运行的调用应定期检查 """
+    def __init__(self, timeout=None):
+        self.event = threading.Event()
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+
+    def Cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def Check(self):
+        """ 已取消时抛出RequestCancelled """
+        if self.event.is_set():
+            raise RequestCancelled("call cancelled after timeout")
+
+    def Remaining(self, default=None):
+        """ 距离超时的剩余秒数，可用于设置socket超时；没有超时时返回default """
+        if self.deadline is None:
+            return default
+        return max(0.0, self.deadline - time.monotonic())
+
+    def Sleep(self, seconds):
+        """ 可被取消的sleep """
+        if self.event.wait(seconds):
+            raise RequestCancelled("call cancelled after timeout")
+
+
+class _Task:
+    def __init__(self, func, args, kwargs, token):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.token = token
+        self.started = False
+        self.abandoned = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _CallByName(module_name, qualname, args, kwargs):
+    """ 子进程中按名称找到函数；被装饰的函数调用其原始函数（__wrapped__），避免在子进程中再次提交 """
+    target = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        target = getattr(target, name)
+    target = getattr(target, "__wrapped__", target)
+    return target(*args, **kwargs)
+
+
+class TimeoutExecutor:
+    def __init__(self, max_workers=32, isolated_workers=2, max_abandoned=64, name="timeout"):
+        """
+        max_workers : 线程池大小（不含已超时被放弃的线程）
+        isolated_workers : 子进程池大小，首次使用CallIsolated时创建
+        max_abandoned : 超时仍未结束的线程数超过该值时报错（说明调用没有响应取消）
+        """
+        self.max_workers = max_workers
+        self.isolated_workers = isolated_workers
+        self.max_abandoned = max_abandoned
+        self.name = name
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.idle = 0
+        self.abandoned = 0
+        self.calls = 0
+        self.timeouts = 0
+        self.process_pool = None
+        self.process_pool_restarts = 0
+
+    def _Loop(self):
+        while True:
+            task = self.tasks.get()
+            with self.lock:
+                self.idle -= 1
+                if task.abandoned:
+                    # 排队期间已超时
+                    self.idle += 1
+                    continue
+                task.started = True
+            try:
+                task.result = task.func(*task.args, **task.kwargs)
+            except BaseException as e:
+                task.error = e
+            with self.lock:
+                task.done.set()
+                if task.abandoned:
+                    # 超时后已补充了新的线程，当前线程退出
+                    self.abandoned -= 1
+                    return
+                self.idle += 1
+
+    def _Submit(self, task):
+        with self.lock:
+            self.calls += 1
+            if self.idle == 0 and self.workers < self.max_workers:
+                self.workers += 1
+                self.idle += 1
+                threading.Thread(target=self._Loop, daemon=True, name=f"{self.name}-worker").start()
+        self.tasks.put(task)
+
+    def Call(self, func, *args, timeout=None, with_token=False, **kwargs):
+        """
+        在线程池中执行func(*args, **kwargs)，超过timeout秒（包括排队时间）抛出TimeoutError，异常原样抛出
+        with_token : 以cancel_token参数传入CancelToken，超时后取消
+        """
+        token = CancelToken(timeout)
+        if with_token:
+            kwargs["cancel_token"] = token
+        task = _Task(func, args, kwargs, token)
+        self._Submit(task)
+        if not task.done.wait(timeout):
+            with self.lock:
+                if not task.done.is_set():
+                    token.Cancel()
+                    task.abandoned = True
+                    self.timeouts += 1
+                    if task.started:
+                        # 线程无法强制结束，不再计入线程池，由后续提交补充新的线程
+                        self.workers -= 1
+                        self.abandoned += 1
+                        if self.abandoned > self.max_abandoned:
+                            logging.error(f"[{self.name}] {self.abandoned} timed out calls are still running, "
+                                          f"consider isolating {getattr(func, '__name__', func)} in a process")
+                    raise TimeoutError(f"{getattr(func, '__name__', 'call')} timed out after {timeout}s")
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+    def _ProcessPool(self):
+        """ 在self.lock内调用 """
+        if self.process_pool is None:
+            # spawn：子进程不继承父进程的线程与锁状态
+            self.process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.isolated_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.process_pool
+
+    def _KillProcessPool(self, pool):
+        with self.lock:
+            if self.process_pool is not pool:
+                return
+            self.process_pool = None
+            self.process_pool_restarts += 1
+        terminate = getattr(pool, "terminate_workers", None)  # python >= 3.14
+        if terminate is not None:
+            terminate()
+        else:
+            for process in list((getattr(pool, "_processes", None) or {}).values()):
+                process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def CallIsolated(self, func, *args, timeout=None, **kwargs):
+        """
+        在子进程中执行func(*args, **kwargs)，超时后结束子进程（同一进程池中其他进行中的调用会失败并由调用方重试），
+        func需要是模块级函数（可以被装饰）
+        """
+        with self.lock:
+            pool = self._ProcessPool()
+            self.calls += 1
+        future = pool.submit(_CallByName, func.__module__, func.__qualname__, args, kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            logging.warning(f"[{self.name}] {func.__name__} timed out after {timeout}s in isolated process, restarting pool")
+            self._KillProcessPool(pool)
+            raise TimeoutError(f"{func.__name__} timed out after {timeout}s")
+
+    def Metrics(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "timeouts": self.timeouts,
+                "workers": self.workers,
+                "abandoned": self.abandoned,
+                "process_pool_restarts": self.process_pool_restarts
+            }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def GetTimeoutExecutor() -> TimeoutExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = TimeoutExecutor()
+        return _executor
+
+
+def timeout_retry(max_retry=3, timeout=60, isolate=False, with_token=False):
+    """
+    超时或失败时重试（按统一重试策略退避，计入全局重试预算），重试耗尽后抛出最后一次的异常
+    isolate : 在子进程中执行，只用于确实可能卡死的代码
+    with_token : 以cancel_token参数传入CancelToken（isolate=False时有效）
+    """
+    def decorator(func):
+        policy = RetryPolicy(max_attempts=max_retry)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            executor = GetTimeoutExecutor()
+            if isolate:
+                return policy.Call(executor.CallIsolated, func, *args, timeout=timeout, name=func.__name__, **kwargs)
+            return policy.Call(executor.Call, func, *args, timeout=timeout, with_token=with_token, name=func.__name__,
+                               **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+"""
+性能测试：python -m util_modules.timeout_util [calls]
+对比原有的每次调用创建一个进程的timeout_retry与线程池、子进程池的单次调用开销
+"""
+
+
+def _Noop(x):
+    return x
+
+
+def _LegacyCall(func, *args, timeout=60):
+    """ 原实现：每次调用创建Process与两个Queue """
+    from multiprocessing import Process, Queue
+    result_queue = Queue()
+    exc_queue = Queue()
+
+    def worker(rq, eq):
+        try:
+            rq.put(func(*args))
+        except Exception as e:
+            eq.put(e)
+
+    p = Process(target=worker, args=(result_queue, exc_queue))
+    p.start()
+    p.join(timeout=timeout)
+    return result_queue.get()
+
+
+if __name__ == "__main__":
+    import sys
+
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    executor = TimeoutExecutor()
+
+    def bench(name, call, n):
+        call()  # 预热（创建线程/进程池）
+        st = time.perf_counter()
+        for _ in range(n):
+            call()
+        cost = (time.perf_counter() - st) / n
+        print(f"{name:<28}: {cost * 1000:8.3f} ms/call")
+        return cost
+
+    # 原实现依赖fork继承闭包，使用fork上下文与其默认行为一致
+    multiprocessing.set_start_method("fork", force=True)
+    legacy = bench("process per call (legacy)", lambda: _LegacyCall(_Noop, 1), max(10, calls // 10))
+    thread = bench("thread pool", lambda: executor.Call(_Noop, 1, timeout=5), calls)
+    isolated = bench("reusable process pool", lambda: executor.CallIsolated(_Noop, 1, timeout=5), calls)
+    print(f"thread pool is {legacy / thread:.0f}x faster, reusable process pool is {legacy / isolated:.0f}x faster")
+
+    # 超时与取消：超时的调用被放弃，线程池补充新线程后仍可继续使用
+    def slow(cancel_token=None):
+        while True:
+            cancel_token.Sleep(0.05)
+
+    st = time.perf_counter()
+    try:
+        executor.Call(slow, timeout=0.2, with_token=True)
+    except TimeoutError as e:
+        print(f"timeout after {time.perf_counter() - st:.2f}s : {e}")
+    time.sleep(0.2)
+    print(f"after cancellation : {executor.Call(_Noop, 2, timeout=1)}, metrics = {executor.Metrics()}")